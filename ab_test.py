@@ -0,0 +1,420 @@
+import argparse
+import math
+import os
+import statistics
+import sys
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import compact_store
+import serialization
+from batch_runner import ADDRESS_PLACEHOLDER, build_engine, read_addresses
+from run_config import RunConfig
+from run_engine import RunEngine, RunQueue, RunRecord, answers_match, extract_answer
+from scheduler import BULK
+
+# What decides which variant won a pair
+METRICS = ("quality", "latency", "cost")
+
+# Wald SPRT settings: false-winner rate, missed-winner rate, and the share of
+# decisive pairs the better variant is assumed to win
+DEFAULT_ALPHA = 0.05
+DEFAULT_BETA = 0.2
+DEFAULT_EFFECT = 0.75
+
+# Upper bound on paired calls when neither variant pulls ahead
+DEFAULT_MAX_PAIRS = 40
+
+A, B = "A", "B"
+
+
+class SequentialTest:
+    """
+    Two-sided Wald sequential probability ratio test on decisive pairs.
+
+    Every pair one variant wins is a Bernoulli trial. Against H0 (each wins
+    half of them), one SPRT tests "A wins with probability effect" and another
+    the same for B. The first to cross its upper boundary names the winner;
+    once both fall below their lower boundaries the variants are declared
+    equivalent at this effect size. Tied pairs carry no evidence.
+
+    Either SPRT can name a false winner, so each runs at alpha / 2 to keep
+    the overall false-winner rate at alpha.
+    """
+
+    def __init__(self, alpha: float = DEFAULT_ALPHA, beta: float = DEFAULT_BETA, effect: float = DEFAULT_EFFECT):
+        if not 0.5 < effect < 1:
+            raise ValueError("effect must be between 0.5 and 1")
+        side_alpha = alpha / 2
+        self.upper = math.log((1 - beta) / side_alpha)
+        self.lower = math.log(beta / (1 - side_alpha))
+        self._win = math.log(effect / 0.5)
+        self._loss = math.log((1 - effect) / 0.5)
+        self.llr = {A: 0.0, B: 0.0}
+        self.wins = {A: 0, B: 0}
+        self.ties = 0
+
+    def add(self, winner: Optional[str]):
+        if winner is None:
+            self.ties += 1
+            return
+        loser = B if winner == A else A
+        self.wins[winner] += 1
+        self.llr[winner] += self._win
+        self.llr[loser] += self._loss
+
+    @property
+    def decision(self) -> Optional[str]:
+        """A or B once that variant is significantly better, "equivalent", or None to keep going"""
+        for variant in (A, B):
+            if self.llr[variant] >= self.upper:
+                return variant
+        if self.llr[A] <= self.lower and self.llr[B] <= self.lower:
+            return "equivalent"
+        return None
+
+
+def _normalized(answer: Any) -> Any:
+    # Variants may name their fields differently, so objects compare by value in order
+    if isinstance(answer, dict):
+        return tuple(_normalized(value) for value in answer.values())
+    if isinstance(answer, list):
+        return tuple(_normalized(value) for value in answer)
+    if isinstance(answer, bool) or answer is None:
+        return answer
+    if isinstance(answer, (int, float)):
+        return float(answer)
+    return str(answer).strip().lower()
+
+
+class Score:
+    """
+    One variant's run of one input.
+
+    Attributes:
+        ok: The call succeeded
+        valid: Schema-valid output (plain success for non-JSON tests)
+        correct: Matches the expected answer, None when none was given
+        answer: Extracted answer value
+        latency: Seconds, None if the call failed
+        cost: USD, None if unknown
+    """
+
+    def __init__(self, record: RunRecord, expected: Optional[str]):
+        result = record.result
+        self.ok = record.status == RunRecord.DONE and result is not None
+        self.valid = False
+        self.correct: Optional[bool] = None
+        self.answer: Any = None
+        self.latency = result.response_time if self.ok else None
+        self.cost = result.cost if self.ok else None
+        if not self.ok:
+            self.correct = False if expected else None
+            return
+        if result.config.use_json:
+            outcome = result.validate()
+            self.valid = outcome.valid
+            self.answer = extract_answer(outcome.parsed) if outcome.is_json else result.content.strip()
+        else:
+            self.valid = True
+            self.answer = result.content.strip()
+        if expected:
+            self.correct = answers_match(self.answer, expected)
+
+    @property
+    def quality(self) -> Tuple[bool, bool]:
+        return self.valid, self.correct is not False
+
+
+def pair_winner(a: Score, b: Score, metric: str) -> Optional[str]:
+    """The variant that did better on metric in one pair, or None for a tie"""
+    if metric == "quality":
+        if a.quality == b.quality:
+            return None
+        return A if a.quality > b.quality else B
+    # A failed call loses on speed and price too; an unknown cost is no evidence
+    if a.ok != b.ok:
+        return A if a.ok else B
+    x, y = getattr(a, metric), getattr(b, metric)
+    if x is None or y is None or x == y:
+        return None
+    return A if x < y else B
+
+
+class ABPair:
+    def __init__(self, index: int, label: str, expected: Optional[str]):
+        self.index = index
+        self.label = label
+        self.expected = expected
+        self.records: Dict[str, RunRecord] = {}
+        self.scores: Dict[str, Score] = {}
+        self.winner: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return len(self.records) == 2 and not any(r.active for r in self.records.values())
+
+    @property
+    def agree(self) -> Optional[bool]:
+        a, b = self.scores.get(A), self.scores.get(B)
+        if a is None or b is None or not (a.ok and b.ok):
+            return None
+        return _normalized(a.answer) == _normalized(b.answer)
+
+
+class ABTest:
+    """
+    Runs two saved tests over the same inputs, a pair at a time per worker,
+    until a sequential test picks a winner.
+
+    Each input is sent to both variants back to back on a private RunQueue
+    sharing the caller's engine (bulk priority, like sweeps). Only
+    max_workers pairs are in flight, so a decision stops the spending within
+    one wave; unfinished calls are then cancelled. on_pair is called from
+    worker threads as each pair is scored.
+    """
+
+    def __init__(
+        self,
+        engine: RunEngine,
+        variants: Dict[str, RunConfig],
+        inputs: List[Tuple[str, Dict[str, RunConfig], Optional[str]]],
+        metric: str = "quality",
+        test: Optional[SequentialTest] = None,
+        max_workers: int = 2,
+        on_pair: Optional[Callable[[ABPair], None]] = None
+    ):
+        """
+        Args:
+            engine: Engine to run on
+            variants: {"A": config, "B": config}, as loaded
+            inputs: (label, {"A": config, "B": config}, expected answer or None) per input
+            metric: One of METRICS; decides each pair's winner
+            test: Sequential test to feed, defaults to SequentialTest()
+            max_workers: Pairs in flight at once
+            on_pair: Called with each scored pair
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+        self.variants = variants
+        self.inputs = inputs
+        self.metric = metric
+        self.test = test or SequentialTest()
+        self.max_workers = max_workers
+        self.on_pair = on_pair
+        self.pairs: List[ABPair] = []
+        self.done = threading.Event()
+        self._next = 0
+        self._by_run: Dict[int, Tuple[ABPair, str]] = {}
+        self._lock = threading.Lock()
+        self.queue = RunQueue(engine, max_workers=2 * max_workers, max_pending=2 * max_workers,
+                              on_update=self._on_record, priority=BULK)
+
+    @property
+    def decision(self) -> Optional[str]:
+        return self.test.decision
+
+    def start(self):
+        with self._lock:
+            for _ in range(self.max_workers):
+                self._submit_next()
+        if not self.pairs:
+            self.done.set()
+
+    def _submit_next(self):
+        # Caller holds the lock
+        if self._next >= len(self.inputs) or self.test.decision is not None:
+            return
+        label, configs, expected = self.inputs[self._next]
+        self._next += 1
+        pair = ABPair(len(self.pairs) + 1, label, expected)
+        self.pairs.append(pair)
+        for variant in (A, B):
+            record = self.queue.submit(configs[variant])
+            pair.records[variant] = record
+            self._by_run[record.run_id] = (pair, variant)
+
+    def _on_record(self, record: RunRecord):
+        with self._lock:
+            entry = self._by_run.get(record.run_id)
+            if entry is None or record.active:
+                return
+            pair, _ = entry
+            if not pair.finished or pair.scores:
+                return
+            if self.test.decision is not None:
+                # Finished after the decision (or cancelled by it); not counted
+                return
+            for variant in (A, B):
+                pair.scores[variant] = Score(pair.records[variant], pair.expected)
+            pair.winner = pair_winner(pair.scores[A], pair.scores[B], self.metric)
+            self.test.add(pair.winner)
+            decided = self.test.decision is not None
+            self._submit_next()
+            remaining = any(p.records and not p.finished for p in self.pairs)
+        if self.on_pair is not None:
+            self.on_pair(pair)
+        if decided:
+            self.queue.cancel_all()
+            self.done.set()
+        elif not remaining:
+            self.done.set()
+
+    def cancel(self):
+        self.queue.cancel_all()
+        self.done.set()
+
+    def shutdown(self):
+        self.queue.shutdown()
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Per-variant rates and means over the scored pairs"""
+        scored = [p for p in self.pairs if p.scores]
+        summary = {}
+        for variant in (A, B):
+            scores = [p.scores[variant] for p in scored]
+            latencies = [s.latency for s in scores if s.latency is not None]
+            costs = [s.cost for s in scores if s.cost is not None]
+            correct = [s.correct for s in scores if s.correct is not None]
+            summary[variant] = {
+                "runs": len(scores),
+                "failed": sum(1 for s in scores if not s.ok),
+                "valid_rate": sum(s.valid for s in scores) / len(scores) if scores else None,
+                "correct_rate": sum(correct) / len(correct) if correct else None,
+                "mean_latency": statistics.fmean(latencies) if latencies else None,
+                "p50_latency": statistics.median(latencies) if latencies else None,
+                "mean_cost": statistics.fmean(costs) if costs else None,
+                "pair_wins": self.test.wins[variant],
+            }
+        agreement = [p.agree for p in scored if p.agree is not None]
+        summary["pairs"] = {
+            "scored": len(scored),
+            "ties": self.test.ties,
+            "agreement_rate": sum(agreement) / len(agreement) if agreement else None,
+        }
+        return summary
+
+
+def build_inputs(
+    variants: Dict[str, RunConfig],
+    addresses: Optional[List[str]] = None,
+    repeats: int = DEFAULT_MAX_PAIRS,
+    expected: Optional[Dict[str, str]] = None,
+    expected_answer: Optional[str] = None
+) -> List[Tuple[str, Dict[str, RunConfig], Optional[str]]]:
+    """
+    The input set: one entry per address, or the tests as saved repeated up to repeats times.
+
+    Args:
+        variants: {"A": config, "B": config}
+        addresses: Substituted for ADDRESS_PLACEHOLDER in both tests' prompts
+        repeats: Inputs to make without addresses
+        expected: Address -> expected answer
+        expected_answer: Expected answer for every input
+
+    Raises:
+        ValueError: If addresses are given but a test has no placeholder
+    """
+    if not addresses:
+        return [(f"#{i}", dict(variants), expected_answer) for i in range(1, repeats + 1)]
+    for variant, config in variants.items():
+        if ADDRESS_PLACEHOLDER not in config.prompt and ADDRESS_PLACEHOLDER not in config.system_prompt:
+            raise ValueError(f"Variant {variant}: prompt has no {ADDRESS_PLACEHOLDER} placeholder")
+    inputs = []
+    for address in addresses:
+        configs = {variant: config.with_changes(
+            prompt=config.prompt.replace(ADDRESS_PLACEHOLDER, address),
+            system_prompt=config.system_prompt.replace(ADDRESS_PLACEHOLDER, address))
+            for variant, config in variants.items()}
+        inputs.append((address, configs, (expected or {}).get(address, expected_answer)))
+    return inputs
+
+
+def format_summary(names: Dict[str, str], summary: Dict[str, Dict[str, Any]]) -> str:
+    def cell(value, spec):
+        return "-" if value is None else format(value, spec)
+
+    lines = [f"{'':<3}{'test':<32}{'runs':>6}{'failed':>8}{'valid':>8}{'correct':>9}"
+             f"{'mean s':>9}{'p50 s':>8}{'mean $':>10}{'wins':>6}"]
+    for variant in (A, B):
+        row = summary[variant]
+        lines.append(f"{variant:<3}{names[variant][:31]:<32}{row['runs']:>6}{row['failed']:>8}"
+                     f"{cell(row['valid_rate'], '.0%'):>8}{cell(row['correct_rate'], '.0%'):>9}"
+                     f"{cell(row['mean_latency'], '.2f'):>9}{cell(row['p50_latency'], '.2f'):>8}"
+                     f"{cell(row['mean_cost'], '.5f'):>10}{row['pair_wins']:>6}")
+    pairs = summary["pairs"]
+    lines.append(f"{pairs['scored']} pairs scored, {pairs['ties']} tied; "
+                 f"answers agreed in {cell(pairs['agreement_rate'], '.0%')} of pairs where both succeeded")
+    return "\n".join(lines)
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Compare two saved tests with a sequential A/B test")
+    parser.add_argument("test_a", help="Saved test for variant A, e.g. Legacy_prompts/propertyinfo.json")
+    parser.add_argument("test_b", help="Saved test for variant B, e.g. Good_prompts/initial-property-info.json")
+    parser.add_argument("--addresses", help=f"File with one address per line, substituted for {ADDRESS_PLACEHOLDER}")
+    parser.add_argument("--expected", help="JSON object mapping each address to its expected answer")
+    parser.add_argument("--expected-answer", help="Expected answer for every input")
+    parser.add_argument("--metric", choices=METRICS, default="quality",
+                        help="What decides each pair: validity and correctness, latency or cost (default quality)")
+    parser.add_argument("--max-pairs", type=int, default=DEFAULT_MAX_PAIRS,
+                        help=f"Stop after this many pairs without a decision (default {DEFAULT_MAX_PAIRS})")
+    parser.add_argument("--workers", type=int, default=2, help="Pairs in flight at once (default 2)")
+    parser.add_argument("--alpha", type=float, default=DEFAULT_ALPHA,
+                        help=f"Chance of naming either test the winner when there is none (default {DEFAULT_ALPHA})")
+    parser.add_argument("--beta", type=float, default=DEFAULT_BETA,
+                        help=f"Chance of missing a real winner (default {DEFAULT_BETA})")
+    parser.add_argument("--effect", type=float, default=DEFAULT_EFFECT,
+                        help=f"Share of decisive pairs a real winner takes (default {DEFAULT_EFFECT})")
+    parser.add_argument("--http2", action="store_true", help="Multiplex API calls over HTTP/2 (needs httpx and h2)")
+    args = parser.parse_args(argv)
+
+    names = {A: os.path.basename(args.test_a), B: os.path.basename(args.test_b)}
+    variants = {A: RunConfig.from_test_data(compact_store.load(args.test_a)),
+                B: RunConfig.from_test_data(compact_store.load(args.test_b))}
+    expected = None
+    if args.expected:
+        with open(args.expected, "rb") as f:
+            expected = serialization.load(f)
+    try:
+        addresses = read_addresses(args.addresses) if args.addresses else None
+        inputs = build_inputs(variants, addresses, args.max_pairs, expected, args.expected_answer)
+        test = SequentialTest(args.alpha, args.beta, args.effect)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    inputs = inputs[:args.max_pairs]
+
+    print_lock = threading.Lock()
+
+    def report(pair: ABPair):
+        a, b = pair.scores[A], pair.scores[B]
+        with print_lock:
+            print(f"pair {pair.index} ({pair.label}): winner {pair.winner or 'tie'} | "
+                  f"A {'valid' if a.valid else 'invalid'} {a.latency or 0:.2f}s | "
+                  f"B {'valid' if b.valid else 'invalid'} {b.latency or 0:.2f}s", flush=True)
+
+    ab = ABTest(build_engine(args.http2), variants, inputs, args.metric, test, args.workers, report)
+    ab.start()
+    try:
+        while not ab.done.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        ab.cancel()
+    finally:
+        ab.shutdown()
+
+    decision = ab.decision
+    if decision in (A, B):
+        verdict = f"{decision} ({names[decision]}) is better on {args.metric}"
+    elif decision == "equivalent":
+        verdict = f"No difference in {args.metric} at the tested effect size"
+    else:
+        verdict = f"No decision after {len([p for p in ab.pairs if p.scores])} pairs; add inputs or raise --max-pairs"
+    print(format_summary(names, ab.summary()))
+    print(verdict)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,523 @@
+import argparse
+import hashlib
+import os
+import signal
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+import columnar_export
+import compact_store
+import metrics
+import serialization
+from local_tools import default_tools
+from openai_client import OpenAIClient
+from perplexity_client import ASYNC_MODELS, PerplexityAPIClient
+from pre_resolver import default_resolver
+from request_control import APIRequestError, CancelToken, RequestCancelled, http2_enabled, open_connections
+from routing import CircuitOpenError, FallbackRouter, provider_for, translate_params
+from run_config import RunConfig
+from run_engine import RunEngine, RunResult
+from scheduler import BULK, Scheduler
+from tracing import TRACER, export_on_exit, traced
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+# A synchronous call that was in flight when the process died; the provider may have billed it
+INTERRUPTED = "interrupted"
+
+# Placeholder replaced by each line of an address list
+ADDRESS_PLACEHOLDER = "{address}"
+
+# Seconds between status checks of async (deep research) items
+ASYNC_POLL_INTERVAL = 10.0
+
+# Errors that mean every remaining call would fail too: pause instead of failing items
+PAUSE_STATUS_CODES = {401, 402, 403, 429}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    key TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    config TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    remote_id TEXT,
+    response TEXT,
+    served_model TEXT,
+    response_time REAL,
+    cost REAL,
+    error TEXT,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS items_status ON items (status, seq);
+"""
+
+
+def item_key(config: RunConfig) -> str:
+    """Content hash of everything that is sent; the same test and input always map to the same item"""
+    return hashlib.sha256(compact_store.canonical_bytes(config.to_dict())).hexdigest()
+
+
+def expand_items(test_paths: List[str], addresses: Optional[List[str]] = None) -> List[Tuple[str, RunConfig]]:
+    """
+    Build (label, config) items from saved tests, optionally once per address.
+
+    Args:
+        test_paths: Saved test files (.json or .ptz)
+        addresses: Values substituted for ADDRESS_PLACEHOLDER in each test's prompts
+
+    Raises:
+        ValueError: If addresses are given but a test has no placeholder
+    """
+    items = []
+    for path in test_paths:
+        base = RunConfig.from_test_data(compact_store.load(path))
+        name = os.path.splitext(os.path.basename(path))[0]
+        if not addresses:
+            items.append((name, base))
+            continue
+        if ADDRESS_PLACEHOLDER not in base.prompt and ADDRESS_PLACEHOLDER not in base.system_prompt:
+            raise ValueError(f"{path}: prompt has no {ADDRESS_PLACEHOLDER} placeholder")
+        for address in addresses:
+            items.append((f"{name}: {address}", base.with_changes(
+                prompt=base.prompt.replace(ADDRESS_PLACEHOLDER, address),
+                system_prompt=base.system_prompt.replace(ADDRESS_PLACEHOLDER, address))))
+    return items
+
+
+def read_addresses(path: str) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+class Checkpoint:
+    """
+    Durable per-item state of a batch in SQLite.
+
+    Every transition commits before the next step starts, and a result is stored in
+    the same transaction that marks its item done, so a crash can only ever lose the
+    call that was in flight.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    def add(self, items: Iterable[Tuple[str, RunConfig]]) -> int:
+        """Insert items not already in the batch; returns how many were new"""
+        with self._lock, self._conn:
+            seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM items").fetchone()[0]
+            added = 0
+            for label, config in items:
+                seq += 1
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO items (key, seq, label, config, status) VALUES (?, ?, ?, ?, ?)",
+                    (item_key(config), seq, label, serialization.dumps(config.to_dict()), PENDING))
+                added += cursor.rowcount
+        return added
+
+    def recover(self, retry_failed: bool = False, retry_in_flight: bool = False) -> int:
+        """
+        Resume after a crash.
+
+        Async items left in flight keep their remote_id and go back to pending, to
+        be polled rather than re-sent. A synchronous call left in flight may have
+        completed (and been billed) on the provider's side, so re-sending it could
+        pay twice; it is marked interrupted and only re-sent with retry_in_flight.
+
+        Args:
+            retry_failed: Also return failed items to pending
+            retry_in_flight: Also return interrupted items to pending
+
+        Returns:
+            Number of items that will be (re)attempted
+        """
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE items SET status = ? WHERE status = ? AND remote_id IS NULL",
+                               (INTERRUPTED, IN_FLIGHT))
+            statuses = (IN_FLIGHT,)
+            if retry_failed:
+                statuses += (FAILED,)
+            if retry_in_flight:
+                statuses += (INTERRUPTED,)
+            self._conn.execute(
+                # A failed async job cannot be polled back to life; retrying it means resubmitting
+                f"UPDATE items SET status = ?, error = NULL, "
+                f"remote_id = CASE WHEN status = ? THEN NULL ELSE remote_id END "
+                f"WHERE status IN ({','.join('?' * len(statuses))})",
+                (PENDING, FAILED) + statuses)
+            return self._conn.execute("SELECT COUNT(*) FROM items WHERE status = ?", (PENDING,)).fetchone()[0]
+
+    def pending(self) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT key, label, config, remote_id FROM items WHERE status = ? ORDER BY seq",
+                (PENDING,)).fetchall()
+
+    @traced("checkpoint claim", "persistence")
+    def claim(self, key: str) -> bool:
+        """Move a pending item to in_flight; False if something else already took it"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE items SET status = ?, attempts = attempts + 1, started_at = ? "
+                "WHERE key = ? AND status = ?", (IN_FLIGHT, time.time(), key, PENDING))
+            return cursor.rowcount == 1
+
+    @traced("checkpoint job id", "persistence")
+    def set_remote_id(self, key: str, remote_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE items SET remote_id = ? WHERE key = ?", (remote_id, key))
+
+    @traced("checkpoint result", "persistence")
+    def complete(self, key: str, result: RunResult):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE items SET status = ?, response = ?, served_model = ?, response_time = ?, "
+                "cost = ?, error = NULL, finished_at = ? WHERE key = ?",
+                (DONE, serialization.dumps(result.response), result.served_model,
+                 result.response_time, result.cost, time.time(), key))
+
+    @traced("checkpoint failure", "persistence")
+    def fail(self, key: str, error: str):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE items SET status = ?, error = ?, finished_at = ? WHERE key = ?",
+                               (FAILED, error, time.time(), key))
+
+    @traced("checkpoint release", "persistence")
+    def release(self, key: str):
+        """Put an unfinished item back to pending (cancelled or paused)"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE items SET status = ? WHERE key = ? AND status = ?",
+                               (PENDING, key, IN_FLIGHT))
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall()
+        counts = {PENDING: 0, IN_FLIGHT: 0, DONE: 0, FAILED: 0, INTERRUPTED: 0}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    def failures(self) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT label, attempts, error FROM items WHERE status = ? ORDER BY seq", (FAILED,)).fetchall()
+
+    def interrupted(self) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT label, attempts FROM items WHERE status = ? ORDER BY seq", (INTERRUPTED,)).fetchall()
+
+    def history_entries(self) -> Iterable[Dict[str, Any]]:
+        """Finished items in the GUI's history-entry layout, for export"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT label, config, response, served_model, response_time, cost, finished_at "
+                "FROM items WHERE status = ? ORDER BY seq", (DONE,)).fetchall()
+        for row in rows:
+            config = serialization.loads(row["config"])
+            yield {
+                "timestamp": datetime.fromtimestamp(row["finished_at"]).isoformat(),
+                "label": row["label"],
+                "model": config["model"],
+                "served_model": row["served_model"],
+                "prompt": config["prompt"],
+                "url": config["url"],
+                "domain_filter": config["domain_filter"],
+                "recency_filter": config["recency_filter"],
+                "context_size": config["context_size"],
+                "config": config,
+                "response": serialization.loads(row["response"]),
+                "response_time": row["response_time"],
+                "cost": row["cost"],
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ThroughputMeter:
+    """
+    Exponentially weighted completion rate, for progress and ETA.
+
+    With several workers, completions arrive closer together than any single call
+    takes, so the measured interval already reflects the concurrency.
+    """
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.interval: Optional[float] = None
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def tick(self):
+        with self._lock:
+            now = time.monotonic()
+            elapsed, self._last = now - self._last, now
+            if self.interval is None:
+                self.interval = elapsed
+            else:
+                self.interval = self.alpha * elapsed + (1 - self.alpha) * self.interval
+
+    def eta(self, remaining: int) -> Optional[float]:
+        with self._lock:
+            return None if self.interval is None else remaining * self.interval
+
+    def per_minute(self) -> Optional[float]:
+        with self._lock:
+            return None if not self.interval else 60.0 / self.interval
+
+
+def _format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+class BatchRunner:
+    """
+    Runs a checkpoint's pending items concurrently through a RunEngine.
+
+    Rate-limit, quota and open-breaker errors pause the batch (the item returns to
+    pending) rather than failing every remaining item. Its calls are scheduled as
+    bulk work, behind any interactive runs sharing the engine.
+    """
+
+    def __init__(self, engine: RunEngine, checkpoint: Checkpoint, max_workers: int = 4,
+                 poll_interval: float = ASYNC_POLL_INTERVAL):
+        self.engine = engine
+        self.checkpoint = checkpoint
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.meter = ThroughputMeter()
+        self.cancel_token = CancelToken()
+        self.paused: Optional[str] = None
+        self._print_lock = threading.Lock()
+
+    def stop(self, reason: Optional[str] = None):
+        """Stop claiming items and abort those in flight; they return to pending"""
+        if reason and self.paused is None:
+            self.paused = reason
+        self.cancel_token.cancel()
+
+    def warm_up(self, items: List[sqlite3.Row]):
+        """Open a connection per worker to each provider the items use, so no item times connection setup"""
+        providers = {provider_for(RunConfig(**serialization.loads(item["config"])).model) for item in items}
+        for provider in providers:
+            client = self.engine.router.clients.get(provider)
+            if client is not None:
+                open_connections(client.session, client.base_url, min(self.max_workers, len(items)))
+
+    def run(self) -> Dict[str, int]:
+        items = self.checkpoint.pending()
+        self.warm_up(items)
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="batch") as executor:
+            for item in items:
+                TRACER.begin("queued", "queue", item["key"], label=item["label"])
+                executor.submit(self._run_item, item)
+        return self.checkpoint.counts()
+
+    def _execute(self, key: str, config: RunConfig, remote_id: Optional[str]) -> RunResult:
+        if config.model not in ASYNC_MODELS:
+            return self.engine.execute(config, self.cancel_token, priority=BULK)
+
+        client = self.engine.router.clients.get("perplexity")
+        if client is None:
+            raise APIRequestError("Perplexity API key is not configured")
+        start = time.monotonic()
+        if remote_id is None:
+            # Record the job id before waiting, so a restart polls instead of paying again
+            kwargs = translate_params(config.to_params(), config.model)
+            kwargs.pop("stream", None)
+            limiter = self.engine.router.limiter
+            with limiter.acquire("perplexity", self.cancel_token, priority=BULK) if limiter else nullcontext():
+                remote_id = client.submit_async(**kwargs)["id"]
+            self.checkpoint.set_remote_id(key, remote_id)
+
+        while True:
+            status = client.get_async(remote_id, config.model)
+            if status.get("status") == "COMPLETED":
+                response = status.get("response") or {}
+                return self.engine.account(RunResult(config, response, time.monotonic() - start,
+                                                     response.get("model", config.model)))
+            if status.get("status") == "FAILED":
+                raise APIRequestError(status.get("error_message") or "Async job failed")
+            with TRACER.span("wait for async job", "async_job", remote_id=remote_id):
+                if self.cancel_token.wait(self.poll_interval):
+                    raise RequestCancelled("Request cancelled")
+
+    def _run_item(self, item: sqlite3.Row):
+        TRACER.end("queued", "queue", item["key"])
+        with TRACER.span("batch item", "batch", label=item["label"]):
+            self._run_claimed(item)
+
+    def _run_claimed(self, item: sqlite3.Row):
+        key = item["key"]
+        if self.cancel_token.cancelled or not self.checkpoint.claim(key):
+            return
+        config = RunConfig(**serialization.loads(item["config"]))
+        try:
+            result = self._execute(key, config, item["remote_id"])
+        except RequestCancelled:
+            self.checkpoint.release(key)
+            return
+        except CircuitOpenError as e:
+            self.checkpoint.release(key)
+            self.stop(str(e))
+            return
+        except APIRequestError as e:
+            if e.status_code in PAUSE_STATUS_CODES:
+                self.checkpoint.release(key)
+                self.stop(str(e))
+                return
+            self.checkpoint.fail(key, str(e))
+            self.report(item["label"], f"failed: {e}")
+            return
+        except Exception as e:
+            self.checkpoint.fail(key, str(e))
+            self.report(item["label"], f"failed: {e}")
+            return
+
+        self.checkpoint.complete(key, result)
+        self.report(item["label"], f"done in {result.response_time:.1f}s")
+
+    def report(self, label: str, outcome: str):
+        self.meter.tick()
+        counts = self.checkpoint.counts()
+        finished = counts[DONE] + counts[FAILED] + counts[INTERRUPTED]
+        total = sum(counts.values())
+        remaining = counts[PENDING] + counts[IN_FLIGHT]
+        rate = self.meter.per_minute()
+        rate_text = f"{rate:.1f}/min" if rate else "?"
+        with self._print_lock:
+            print(f"[{finished}/{total}] {label[:60]} {outcome} | "
+                  f"{rate_text}, ETA {_format_duration(self.meter.eta(remaining))}", flush=True)
+
+
+def build_engine(http2: bool = False) -> RunEngine:
+    """
+    A RunEngine over clients configured from the environment / .env
+
+    Args:
+        http2: Use the HTTP/2 transport (also enabled by PROMPT_TESTER_HTTP2=1)
+    """
+    load_dotenv()
+    perplexity_key = os.getenv("PERPLEXITY_API_KEY")
+    openai_key = os.getenv("OPENAI_API_KEY")
+    http2 = http2 or http2_enabled()
+    clients = {
+        "perplexity": PerplexityAPIClient(perplexity_key, http2=http2) if perplexity_key else None,
+        "openai": OpenAIClient(openai_key, http2=http2) if openai_key else None,
+    }
+    return RunEngine(FallbackRouter(clients, limiter=Scheduler()), tools=default_tools(),
+                     resolver=default_resolver())
+
+
+def print_status(checkpoint: Checkpoint):
+    counts = checkpoint.counts()
+    print(", ".join(f"{status}: {count}" for status, count in counts.items()))
+    for row in checkpoint.failures():
+        print(f"  failed ({row['attempts']} attempts) {row['label'][:60]}: {row['error']}")
+    interrupted = checkpoint.interrupted()
+    for row in interrupted:
+        print(f"  interrupted, possibly paid ({row['attempts']} attempts) {row['label'][:60]}")
+    if interrupted:
+        print(f"{len(interrupted)} calls were in flight when the batch stopped and may already have been "
+              f"billed; add --retry-in-flight to send them again")
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(
+        description="Run saved tests headlessly with a crash-safe checkpoint. "
+                    "Re-running the same command resumes where it stopped.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Add tests to the batch and run every unfinished item")
+    run.add_argument("batch", help="Checkpoint database, created if missing")
+    run.add_argument("tests", nargs="*", help="Saved test files (.json or .ptz)")
+    run.add_argument("--addresses", help=f"File with one address per line, substituted for {ADDRESS_PLACEHOLDER}")
+    run.add_argument("--workers", type=int, default=4, help="Concurrent calls (default 4)")
+    run.add_argument("--retry-failed", action="store_true", help="Also retry items that failed")
+    run.add_argument("--retry-in-flight", action="store_true",
+                     help="Also re-send calls interrupted by a crash (they may be paid twice)")
+    run.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this localhost port")
+    run.add_argument("--http2", action="store_true",
+                     help="Multiplex calls over HTTP/2 (needs httpx and h2; worth it for many workers)")
+    run.add_argument("--trace", help="Write a Chrome trace of every request stage to this file (open in Perfetto)")
+
+    status = sub.add_parser("status", help="Show item counts and failures")
+    status.add_argument("batch")
+
+    export = sub.add_parser("export", help="Export finished items (.json, .ptz, .parquet, .npz or .csv)")
+    export.add_argument("batch")
+    export.add_argument("output")
+
+    args = parser.parse_args(argv)
+    if args.command != "run" and not os.path.exists(args.batch):
+        print(f"{args.batch} does not exist")
+        return 1
+    checkpoint = Checkpoint(args.batch)
+
+    if args.command == "status":
+        print_status(checkpoint)
+        return 0
+
+    if args.command == "export":
+        extension = os.path.splitext(args.output)[1].lower()
+        entries = checkpoint.history_entries()
+        if extension == compact_store.COMPACT_EXTENSION:
+            compact_store.export_compact(args.output, entries)
+        elif extension in columnar_export.FORMATS:
+            columnar_export.export_columnar(args.output, entries)
+        else:
+            with open(args.output, "wb") as f:
+                serialization.dump(list(entries), f, indent=True)
+        print(f"Exported finished items to {args.output}")
+        return 0
+
+    export_on_exit(args.trace)
+    addresses = read_addresses(args.addresses) if args.addresses else None
+    added = checkpoint.add(expand_items(args.tests, addresses))
+    todo = checkpoint.recover(retry_failed=args.retry_failed, retry_in_flight=args.retry_in_flight)
+    print(f"{added} new items, {todo} to run", flush=True)
+
+    if args.metrics_port:
+        metrics.REGISTRY.gauge_callback("batch_items", "Batch items by checkpoint status", ("status",),
+                                        lambda: {(status,): count for status, count in checkpoint.counts().items()})
+        metrics.start_server(args.metrics_port)
+
+    runner = BatchRunner(build_engine(args.http2), checkpoint, max_workers=args.workers)
+    # Ctrl-C aborts in-flight calls; they go back to pending for the next run
+    signal.signal(signal.SIGINT, lambda signum, frame: runner.stop("interrupted"))
+    runner.run()
+
+    print_status(checkpoint)
+    if runner.paused:
+        print(f"Paused ({runner.paused}); run the same command again to resume")
+        return 3
+    counts = checkpoint.counts()
+    return 0 if counts[FAILED] == 0 and counts[INTERRUPTED] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import serialization
+from request_control import Http2Adapter, Timeouts, create_session, post_json
+
+# h2 is needed for both the stand-in server and the client transport
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+except ImportError:
+    h2 = None
+
+RESPONSE = serialization.dumps_bytes({
+    "id": "bench", "object": "chat.completion", "model": "sonar",
+    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "Franklin County"}}],
+    "usage": {"prompt_tokens": 65, "completion_tokens": 8, "total_tokens": 73},
+})
+PAYLOAD = {"model": "sonar", "messages": [{"role": "user", "content": "What county is columbus ohio in?"}]}
+BENCH_TIMEOUTS = Timeouts(connect=30.0, read=30.0, total=60.0)
+
+
+class StandInServer:
+    """
+    Local chat-completions stand-in, in a child process so its CPU time does
+    not compete with the client under test.
+
+    Every new connection waits setup_delay before it is served, standing in for
+    the network round trips of connecting to a remote API; every request waits
+    latency, standing in for the model. HTTP/1.1 (keep-alive) and HTTP/2 are
+    spoken on separate ports: over TLS with ALPN, like the real APIs, when a
+    certificate is given, otherwise in cleartext (HTTP/2 by prior knowledge).
+    """
+
+    def __init__(self, latency: float, setup_delay: float, tls: Optional[Tuple[str, str]] = None):
+        self.latency = latency
+        self.setup_delay = setup_delay
+        # (certificate file, key file)
+        self.tls = tls
+        # Connections accepted so far, per protocol
+        self._counts = {"http/1.1": multiprocessing.Value("i", 0), "h2": multiprocessing.Value("i", 0)}
+        parent, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=self._serve, args=(child,), daemon=True)
+        self._process.start()
+        self.ports: Dict[str, int] = parent.recv()
+
+    def connections(self, protocol: str) -> int:
+        return self._counts[protocol].value
+
+    def stop(self):
+        self._process.terminate()
+
+    def _context(self, protocol: str) -> Optional[ssl.SSLContext]:
+        if self.tls is None:
+            return None
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(*self.tls)
+        context.set_alpn_protocols([protocol])
+        return context
+
+    def _serve(self, ready):
+        loop = asyncio.new_event_loop()
+        http1 = loop.run_until_complete(asyncio.start_server(self._http1, "127.0.0.1", 0, backlog=1024,
+                                                             ssl=self._context("http/1.1")))
+        http2 = loop.run_until_complete(asyncio.start_server(self._http2, "127.0.0.1", 0, backlog=1024,
+                                                             ssl=self._context("h2")))
+        ready.send({"http/1.1": http1.sockets[0].getsockname()[1], "h2": http2.sockets[0].getsockname()[1]})
+        loop.run_forever()
+
+    async def _http1(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._counts["http/1.1"].value += 1
+        await asyncio.sleep(self.setup_delay)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                await reader.readexactly(length)
+                await asyncio.sleep(self.latency)
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\n\r\n%s" % (len(RESPONSE), RESPONSE))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _http2(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._counts["h2"].value += 1
+        await asyncio.sleep(self.setup_delay)
+        conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False))
+        conn.initiate_connection()
+        writer.write(conn.data_to_send())
+
+        async def respond(stream_id: int):
+            await asyncio.sleep(self.latency)
+            conn.send_headers(stream_id, [(":status", "200"), ("content-type", "application/json"),
+                                          ("content-length", str(len(RESPONSE)))])
+            conn.send_data(stream_id, RESPONSE, end_stream=True)
+            writer.write(conn.data_to_send())
+
+        tasks = set()
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                for event in conn.receive_data(data):
+                    if isinstance(event, h2.events.DataReceived):
+                        conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                    elif isinstance(event, h2.events.StreamEnded):
+                        task = asyncio.ensure_future(respond(event.stream_id))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                writer.write(conn.data_to_send())
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def make_certificate(directory: str) -> Optional[Tuple[str, str]]:
+    """A throwaway self-signed certificate for 127.0.0.1, or None without the openssl CLI"""
+    if shutil.which("openssl") is None:
+        return None
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+                    "-nodes", "-keyout", key, "-out", cert, "-days", "1", "-subj", "/CN=127.0.0.1",
+                    "-addext", "subjectAltName=IP:127.0.0.1"], check=True, capture_output=True)
+    return cert, key
+
+
+def run_load(session, url: str, concurrency: int, requests_per_worker: int) -> Dict[str, float]:
+    """Send concurrency * requests_per_worker calls, concurrency at a time"""
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(requests_per_worker):
+            start = time.perf_counter()
+            post_json(session, url, PAYLOAD, "sonar", timeouts=BENCH_TIMEOUTS).json()
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    wall = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "wall": wall,
+        "rate": len(latencies) / wall,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "max": latencies[-1],
+    }
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Compare the HTTP/1.1 and HTTP/2 transports against a local stand-in")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 32, 64])
+    parser.add_argument("--requests", type=int, default=4, help="Sequential calls per worker (default 4)")
+    parser.add_argument("--latency", type=float, default=0.2, help="Simulated model seconds per call (default 0.2)")
+    parser.add_argument("--setup-delay", type=float, default=0.05,
+                        help="Simulated network round trips per new connection, seconds (default 0.05)")
+    parser.add_argument("--plain", action="store_true", help="Cleartext instead of TLS")
+    args = parser.parse_args(argv)
+
+    if h2 is None:
+        print('The benchmark needs h2 (and httpx): pip install "httpx[http2]"', file=sys.stderr)
+        return 2
+    # Discarded overflow connections are the point of the comparison, not news
+    logging.getLogger("urllib3.connectionpool").setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as directory:
+        tls = None if args.plain else make_certificate(directory)
+        if tls is None and not args.plain:
+            print("openssl not found; running in cleartext", file=sys.stderr)
+        server = StandInServer(args.latency, args.setup_delay, tls)
+        scheme = "https" if tls else "http"
+        print(f"{scheme}, model latency {args.latency * 1000:.0f} ms, connection setup "
+              f"{args.setup_delay * 1000:.0f} ms + handshake, {args.requests} calls per worker")
+        print(f"{'transport':<10}{'workers':>8}{'wall s':>9}{'calls/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+              f"{'max ms':>9}{'cpu ms/call':>12}{'conns':>7}")
+        for concurrency in args.concurrency:
+            for transport in ("http/1.1", "h2"):
+                # A fresh session per run, so every run starts cold
+                session = create_session({})
+                if transport == "h2":
+                    verify = ssl.create_default_context(cafile=tls[0]) if tls else True
+                    session.mount(f"{scheme}://", Http2Adapter(prior_knowledge=not tls, verify=verify))
+                elif tls:
+                    # REQUESTS_CA_BUNDLE would otherwise override the stand-in's certificate
+                    session.trust_env = False
+                    session.verify = tls[0]
+                before = server.connections(transport)
+                cpu = time.process_time()
+                result = run_load(session, f"{scheme}://127.0.0.1:{server.ports[transport]}/chat/completions",
+                                  concurrency, args.requests)
+                cpu = (time.process_time() - cpu) / (concurrency * args.requests)
+                session.close()
+                print(f"{transport:<10}{concurrency:>8}{result['wall']:>9.2f}{result['rate']:>9.1f}"
+                      f"{result['p50'] * 1000:>9.0f}{result['p95'] * 1000:>9.0f}{result['max'] * 1000:>9.0f}"
+                      f"{cpu * 1000:>12.2f}{server.connections(transport) - before:>7}")
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
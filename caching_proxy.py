@@ -0,0 +1,430 @@
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+from dotenv import load_dotenv
+
+import compact_store
+import metrics
+import openai_client
+import perplexity_client
+import serialization
+from request_control import Deadline, create_session, send_request, timeouts_for
+from scheduler import PIPELINE, PRIORITY_WEIGHTS, Scheduler
+from service import DEFAULT_WORKERS, MAX_HEADER_BYTES, HTTPError, read_request, send_json
+
+DEFAULT_PORT = 8766
+
+# Path prefix -> upstream API root; clients set e.g. PERPLEXITY_BASE_URL=http://host:8766/perplexity
+UPSTREAMS = {
+    "perplexity": perplexity_client.DEFAULT_BASE_URL,
+    "openai": openai_client.DEFAULT_BASE_URL,
+}
+KEY_ENV_VARS = {"perplexity": "PERPLEXITY_API_KEY", "openai": "OPENAI_API_KEY"}
+
+# Only synchronous chat completions are cached; async job submissions and polls pass through
+CACHED_PATH = "chat/completions"
+
+DEFAULT_MAX_ENTRIES = 4096
+
+# Seconds an answer is reused; grounded answers go stale as search results change
+DEFAULT_TTL = 3600.0
+
+CHUNK_BYTES = 8192
+
+
+def payload_key(provider: str, path: str, payload: object) -> str:
+    """Content hash of a request; key order and whitespace in the body do not matter"""
+    digest = hashlib.sha256(f"{provider}/{path}\n".encode("utf-8"))
+    digest.update(compact_store.canonical_bytes(payload))
+    return digest.hexdigest()
+
+
+def _iter_chunks(response: requests.Response) -> Iterator[bytes]:
+    # Forward whatever has arrived instead of waiting for full chunks, so streams stay live
+    read1 = getattr(response.raw, "read1", None)
+    if read1 is not None:
+        return iter(lambda: read1(CHUNK_BYTES, decode_content=True), b"")
+    return response.iter_content(chunk_size=None)
+
+
+class ProxyCache:
+    """
+    Thread-safe LRU of finished upstream bodies by payload_key.
+
+    Entries expire ttl seconds after they were stored; the least recently used
+    entry is evicted once max_entries are held.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, str, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key: str) -> Optional[Tuple[str, bytes]]:
+        """(content type, body), or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        metrics.record_cache("proxy", entry is not None)
+        return entry[1:] if entry is not None else None
+
+    def put(self, key: str, content_type: str, body: bytes):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), content_type, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class _Flight:
+    """
+    One upstream response and the callers reading it.
+
+    Chunks are kept as they arrive, so a caller that joins late replays them
+    from the start and then follows along. Only touched on the loop thread.
+    """
+
+    def __init__(self):
+        self.status: Optional[int] = None
+        self.content_type = "application/json"
+        self.chunks: List[bytes] = []
+        self.done = False
+        self.failed = False
+        self._changed = asyncio.Event()
+
+    @classmethod
+    def finished(cls, status: int, content_type: str, body: bytes) -> "_Flight":
+        flight = cls()
+        flight.start(status, content_type)
+        flight.append(body)
+        flight.finish()
+        return flight
+
+    @property
+    def body(self) -> bytes:
+        return b"".join(self.chunks)
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def start(self, status: int, content_type: str):
+        self.status = status
+        self.content_type = content_type
+        self._notify()
+
+    def append(self, chunk: bytes):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self):
+        self.done = True
+        self._notify()
+
+    def fail(self, message: str):
+        """The upstream call broke; callers not yet answered get a 502, the rest a cut-off body"""
+        self.failed = True
+        if self.status is None:
+            self.start(502, "application/json")
+            self.append(serialization.dumps_bytes({"error": message}))
+        self.finish()
+
+    async def relay(self, writer: asyncio.StreamWriter, source: str):
+        while self.status is None:
+            await self._changed.wait()
+        try:
+            phrase = HTTPStatus(self.status).phrase
+        except ValueError:
+            phrase = ""
+        head = [f"HTTP/1.1 {self.status} {phrase}", f"Content-Type: {self.content_type}",
+                f"X-Cache: {source}", "Connection: close"]
+        if self.done:
+            head.append(f"Content-Length: {len(self.body)}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+
+        sent = 0
+        while True:
+            changed = self._changed
+            if sent < len(self.chunks):
+                writer.write(b"".join(self.chunks[sent:]))
+                sent = len(self.chunks)
+                await writer.drain()
+                continue
+            if self.done:
+                return
+            await changed.wait()
+
+
+class CachingProxy:
+    """
+    Shared reverse proxy in front of the Perplexity and OpenAI APIs.
+
+    Point every tester at it (PERPLEXITY_BASE_URL / OPENAI_BASE_URL) and
+    identical chat completions are paid for once across all of them:
+
+    - Requests are keyed by their canonical JSON body, so the same request
+      from any caller hits the same entry. Only 200 responses are cached,
+      streamed and unstreamed bodies separately.
+    - An identical request arriving while the first is still in flight joins
+      it instead of calling the API again, and streams along with it.
+    - Upstream calls go through one Scheduler, so the provider limits in
+      DEFAULT_PROVIDER_LIMITS hold for the whole team. Callers may send
+      X-Priority (interactive, pipeline or bulk; default pipeline).
+    - Responses are relayed chunk by chunk as they arrive.
+
+    Upstream calls block, so they run on a thread pool; everything else is a
+    coroutine on one event loop. A caller that hangs up does not cancel the
+    call, whose answer is still cached for the next. "Cache-Control: no-cache"
+    skips the cache and fetches a fresh answer.
+
+    The cache is shared regardless of credentials: a hit is served to any
+    caller, whichever key paid for it. Every proxied request must carry an
+    Authorization header, and with allowed_keys its bearer token must be one
+    of them, so only holders of a listed key can read cached answers.
+    """
+
+    def __init__(
+        self,
+        cache: Optional[ProxyCache] = None,
+        limiter: Optional[Scheduler] = None,
+        keys: Optional[Dict[str, str]] = None,
+        max_workers: int = DEFAULT_WORKERS,
+        http2: bool = False,
+        upstreams: Optional[Dict[str, str]] = None,
+        allowed_keys: Optional[Iterable[str]] = None
+    ):
+        """
+        Args:
+            cache: Response cache; defaults to a ProxyCache()
+            limiter: Shared rate limits; defaults to Scheduler()
+            keys: Provider -> API key used for every upstream call; providers
+                  without one get each caller's own Authorization header
+            max_workers: Upstream calls executing at once
+            http2: Call the APIs over HTTP/2 (needs httpx and h2)
+            upstreams: Path prefix -> API root, defaults to UPSTREAMS
+            allowed_keys: Bearer tokens callers must present; without them any
+                          Authorization header is accepted
+
+        Raises:
+            ValueError: If keys is given without allowed_keys, which would let
+                        anyone who can reach the proxy spend those keys
+        """
+        if keys and not allowed_keys:
+            raise ValueError("Upstream keys need allowed_keys, or any caller could spend them")
+        self.cache = cache if cache is not None else ProxyCache()
+        self.limiter = limiter if limiter is not None else Scheduler()
+        self.keys = keys or {}
+        self.upstreams = upstreams or UPSTREAMS
+        self.allowed_keys = set(allowed_keys) if allowed_keys else None
+        self.session = create_session({}, http2=http2)
+        self.counts = {"hit": 0, "coalesced": 0, "miss": 0, "passthrough": 0}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="proxy")
+        self._flights: Dict[str, _Flight] = {}
+
+    async def serve(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT):
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_HEADER_BYTES)
+        print(f"Proxying on http://{host}:{port} "
+              f"({', '.join(f'/{name} -> {url}' for name, url in self.upstreams.items())})", flush=True)
+        async with server:
+            await server.serve_forever()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            method, path, headers, body = await read_request(reader)
+            await self._dispatch(method, path, headers, body, writer)
+        except HTTPError as e:
+            await send_json(writer, e.status, {"error": e.message})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _dispatch(self, method: str, path: str, headers: Dict[str, str], body: bytes,
+                        writer: asyncio.StreamWriter):
+        if path == "/health" and method == "GET":
+            await send_json(writer, 200, {
+                "status": "ok",
+                "cached": len(self.cache),
+                "in_flight": len(self._flights),
+                "requests": self.counts,
+                "waiting": {f"{provider}/{priority}": count
+                            for (provider, priority), count in self.limiter.waiting().items()},
+            })
+            return
+
+        provider, _, rest = path.lstrip("/").partition("/")
+        if provider not in self.upstreams:
+            raise HTTPError(404, f"No upstream for {path}; use /{' or /'.join(self.upstreams)}")
+        if method == "HEAD":
+            # Connection warm-ups from the clients; nothing to forward
+            writer.write(b"HTTP/1.1 204 No Content\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            return
+        if method not in ("GET", "POST"):
+            raise HTTPError(405, "Use GET or POST")
+        self._authorize(headers)
+        priority = headers.get("x-priority", PIPELINE)
+        if priority not in PRIORITY_WEIGHTS:
+            raise HTTPError(400, f"Unknown priority: {priority}")
+
+        model = ""
+        key = None
+        if method == "POST" and rest == CACHED_PATH:
+            try:
+                payload = serialization.loads(body)
+            except serialization.JSONDecodeError as e:
+                raise HTTPError(400, f"Invalid JSON: {e}")
+            model = payload.get("model", "") if isinstance(payload, dict) else ""
+            key = payload_key(provider, rest, payload)
+
+        if key is not None and "no-cache" not in headers.get("cache-control", ""):
+            hit = self.cache.get(key)
+            if hit is not None:
+                self._count(provider, "hit")
+                await _Flight.finished(200, *hit).relay(writer, "HIT")
+                return
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._count(provider, "coalesced")
+                await flight.relay(writer, "COALESCED")
+                return
+
+        self._count(provider, "miss" if key is not None else "passthrough")
+        auth = f"Bearer {self.keys[provider]}" if self.keys.get(provider) else headers.get("authorization")
+        flight = _Flight()
+        if key is not None:
+            self._flights[key] = flight
+        loop = asyncio.get_running_loop()
+        loop.run_in_executor(self._executor, self._call, loop, flight, key, provider,
+                             f"{self.upstreams[provider]}/{rest}", method, body, auth, model, priority)
+        await flight.relay(writer, "MISS" if key is not None else "BYPASS")
+
+    def _authorize(self, headers: Dict[str, str]):
+        """
+        Check the caller's credentials before anything is served, cached answers included.
+
+        Raises:
+            HTTPError: 401 without an Authorization header, 403 for a key not in allowed_keys
+        """
+        authorization = headers.get("authorization", "")
+        if not authorization:
+            raise HTTPError(401, "Send an Authorization header")
+        scheme, _, token = authorization.partition(" ")
+        if self.allowed_keys is not None and (scheme.lower() != "bearer" or token.strip() not in self.allowed_keys):
+            raise HTTPError(403, "Key not allowed on this proxy")
+
+    def _count(self, provider: str, result: str):
+        self.counts[result] += 1
+        metrics.PROXY_REQUESTS.inc(provider=provider, result=result)
+
+    def _call(self, loop: asyncio.AbstractEventLoop, flight: _Flight, key: Optional[str], provider: str,
+              url: str, method: str, body: bytes, auth: Optional[str], model: str, priority: str):
+        """Worker thread: make the upstream call, handing status and chunks to the loop as they arrive"""
+        deadline = Deadline(timeouts_for(model).total)
+        error = None
+        try:
+            with self.limiter.acquire(provider, deadline=deadline, priority=priority):
+                try:
+                    response = send_request(self.session, method, url, model, body=body or None,
+                                            deadline=deadline, stream=True,
+                                            headers={"Authorization": auth} if auth else None)
+                except requests.exceptions.HTTPError as e:
+                    # Relay the API's own error to the caller
+                    response = e.response
+                try:
+                    loop.call_soon_threadsafe(flight.start, response.status_code,
+                                              response.headers.get("content-type", "application/json"))
+                    for chunk in _iter_chunks(response):
+                        loop.call_soon_threadsafe(flight.append, chunk)
+                finally:
+                    response.close()
+        except Exception as e:
+            error = f"Upstream request failed: {e}"
+        loop.call_soon_threadsafe(self._finish, flight, key, error)
+
+    def _finish(self, flight: _Flight, key: Optional[str], error: Optional[str]):
+        if error is not None:
+            flight.fail(error)
+        else:
+            flight.finish()
+        if key is None:
+            return
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if flight.status == 200 and not flight.failed:
+            self.cache.put(key, flight.content_type, flight.body)
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Shared caching proxy for the Perplexity and OpenAI APIs")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Interface to bind (default localhost only; use 0.0.0.0 to serve a team)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port (default {DEFAULT_PORT})")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"Upstream calls executing at once (default {DEFAULT_WORKERS})")
+    parser.add_argument("--cache-ttl", type=float, default=DEFAULT_TTL,
+                        help=f"Seconds an answer is reused; 0 disables caching (default {DEFAULT_TTL:g})")
+    parser.add_argument("--max-entries", type=int, default=DEFAULT_MAX_ENTRIES,
+                        help=f"Answers kept (default {DEFAULT_MAX_ENTRIES})")
+    parser.add_argument("--keys-from-env", action="store_true",
+                        help="Call the APIs with this machine's PERPLEXITY_API_KEY / OPENAI_API_KEY "
+                             "instead of each caller's key (requires --allowed-keys)")
+    parser.add_argument("--allowed-keys",
+                        help="File with one bearer token per line; only callers presenting one are served")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this localhost port")
+    parser.add_argument("--http2", action="store_true", help="Call the APIs over HTTP/2 (needs httpx and h2)")
+    args = parser.parse_args(argv)
+    if args.keys_from_env and not args.allowed_keys:
+        parser.error("--keys-from-env needs --allowed-keys, or anyone who can reach the proxy spends your keys")
+
+    keys = {}
+    if args.keys_from_env:
+        load_dotenv()
+        keys = {provider: os.getenv(var) for provider, var in KEY_ENV_VARS.items() if os.getenv(var)}
+    allowed_keys = None
+    if args.allowed_keys:
+        with open(args.allowed_keys, encoding="utf-8") as f:
+            allowed_keys = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    if args.metrics_port:
+        metrics.start_server(args.metrics_port)
+    proxy = CachingProxy(ProxyCache(args.max_entries, args.cache_ttl), keys=keys,
+                         max_workers=args.workers, http2=args.http2, allowed_keys=allowed_keys)
+    try:
+        asyncio.run(proxy.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        proxy.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
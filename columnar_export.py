@@ -0,0 +1,345 @@
+import csv
+import math
+import os
+import sys
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+import compact_store
+import serialization
+from run_config import RunConfig
+from run_engine import extract_answer, response_content, validate_output
+
+# pyarrow and numpy are optional; CSV export always works
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Column name -> type; every format stores the same typed columns.
+# Missing floats are NaN, missing ints 0 and missing strings "" so no column is nullable.
+COLUMNS: List[Tuple[str, str]] = [
+    ("timestamp", "str"),
+    ("model", "str"),
+    ("served_model", "str"),
+    ("prompt", "str"),
+    ("response_time", "float"),
+    ("prompt_tokens", "int"),
+    ("completion_tokens", "int"),
+    ("total_tokens", "int"),
+    ("cost", "float"),
+    ("search_results", "int"),
+    ("is_json", "bool"),
+    ("valid", "bool"),
+    ("answer", "str"),
+    ("answer_number", "float"),
+    ("temperature", "float"),
+    ("max_tokens", "int"),
+    ("context_size", "str"),
+    ("recency_filter", "str"),
+    ("reasoning_effort", "str"),
+    ("verbosity", "str"),
+    ("use_json", "bool"),
+]
+COLUMN_TYPES = dict(COLUMNS)
+
+# Extension -> (format name, optional module it needs)
+FORMATS = {
+    ".parquet": ("Parquet", pyarrow),
+    ".npz": ("NumPy", numpy),
+    ".csv": ("CSV", csv),
+}
+
+DEFAULT_CHUNK_SIZE = 4096
+
+
+def available_formats() -> List[Tuple[str, str]]:
+    """(name, extension) for every columnar format usable in this environment."""
+    return [(name, ext) for ext, (name, module) in FORMATS.items() if module is not None]
+
+
+def _config_of(entry: Dict[str, Any]) -> RunConfig:
+    if "config" in entry:
+        return RunConfig(**entry["config"])
+    # Entries exported before run snapshots were stored only carry these fields
+    return RunConfig(
+        model=entry.get("model", ""),
+        prompt=entry.get("prompt", ""),
+        url=entry.get("url", ""),
+        domain_filter=entry.get("domain_filter", ""),
+        recency_filter=entry.get("recency_filter", "none"),
+        context_size=entry.get("context_size", "low"),
+    )
+
+
+def _as_int(value: Any) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _as_float(value: Any) -> float:
+    if isinstance(value, bool):
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def flatten_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Turn one history entry into a row of typed column values.
+
+    Args:
+        entry: A test_history entry (as exported by export_results)
+
+    Returns:
+        Column name -> value for every name in COLUMNS
+    """
+    config = _config_of(entry)
+    response = entry.get("response") or {}
+    usage = response.get("usage") or {}
+
+    cost = entry.get("cost")
+    if cost is None and isinstance(usage.get("cost"), dict):
+        cost = usage["cost"].get("total_cost")
+
+    content = response_content(response)
+    outcome = validate_output(content, config.response_format())
+    answer = extract_answer(outcome.parsed) if outcome.is_json else content.strip()
+    if isinstance(answer, str):
+        answer_text = answer
+    elif answer is None:
+        answer_text = ""
+    else:
+        answer_text = serialization.dumps(answer)
+
+    return {
+        "timestamp": entry.get("timestamp", ""),
+        "model": config.model,
+        "served_model": entry.get("served_model") or config.model,
+        "prompt": config.prompt,
+        "response_time": _as_float(entry.get("response_time")),
+        "prompt_tokens": _as_int(usage.get("prompt_tokens")),
+        "completion_tokens": _as_int(usage.get("completion_tokens")),
+        "total_tokens": _as_int(usage.get("total_tokens")),
+        "cost": _as_float(cost),
+        "search_results": len(response.get("search_results") or []),
+        "is_json": outcome.is_json,
+        "valid": outcome.valid,
+        "answer": answer_text,
+        "answer_number": _as_float(answer),
+        "temperature": _as_float(config.temperature),
+        "max_tokens": _as_int(config.max_tokens),
+        "context_size": config.context_size,
+        "recency_filter": config.recency_filter,
+        "reasoning_effort": config.reasoning_effort,
+        "verbosity": config.verbosity,
+        "use_json": config.use_json,
+    }
+
+
+def iter_chunks(entries: Iterable[Dict[str, Any]], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Dict[str, List[Any]]]:
+    """Yield column-oriented chunks of at most chunk_size flattened entries."""
+    chunk = {name: [] for name, _ in COLUMNS}
+    size = 0
+    for entry in entries:
+        for name, value in flatten_entry(entry).items():
+            chunk[name].append(value)
+        size += 1
+        if size == chunk_size:
+            yield chunk
+            chunk = {name: [] for name, _ in COLUMNS}
+            size = 0
+    if size:
+        yield chunk
+
+
+class _ParquetWriter:
+    ARROW_TYPES = {"str": "string", "float": "float64", "int": "int64", "bool": "bool_"}
+
+    def __init__(self, path: str):
+        self.schema = pyarrow.schema(
+            [(name, getattr(pyarrow, self.ARROW_TYPES[kind])()) for name, kind in COLUMNS])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, chunk: Dict[str, List[Any]]):
+        # Each chunk becomes its own row group
+        self.writer.write_table(pyarrow.Table.from_pydict(chunk, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class _NpzWriter:
+    """
+    Collects typed arrays chunk by chunk and writes one compressed .npz.
+
+    String columns are dictionary-encoded (int32 codes plus a "<name>__values"
+    array), which keeps the archive small and loadable without pickle.
+    """
+
+    NUMPY_TYPES = {"float": "float64", "int": "int64", "bool": "bool"}
+
+    def __init__(self, path: str):
+        self.path = path
+        self.arrays = {name: [] for name, _ in COLUMNS}
+        self.codes = {name: {} for name, kind in COLUMNS if kind == "str"}
+
+    def write(self, chunk: Dict[str, List[Any]]):
+        for name, kind in COLUMNS:
+            values = chunk[name]
+            if kind == "str":
+                codes = self.codes[name]
+                values = [codes.setdefault(v, len(codes)) for v in values]
+                self.arrays[name].append(numpy.asarray(values, dtype="int32"))
+            else:
+                self.arrays[name].append(numpy.asarray(values, dtype=self.NUMPY_TYPES[kind]))
+
+    def close(self):
+        arrays = {}
+        for name, kind in COLUMNS:
+            parts = self.arrays[name]
+            dtype = "int32" if kind == "str" else self.NUMPY_TYPES[kind]
+            arrays[name] = numpy.concatenate(parts) if parts else numpy.empty(0, dtype=dtype)
+            if kind == "str":
+                arrays[f"{name}__values"] = numpy.array(list(self.codes[name]), dtype=str)
+        numpy.savez_compressed(self.path, **arrays)
+
+
+class _CsvWriter:
+    def __init__(self, path: str):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, _ in COLUMNS])
+
+    def write(self, chunk: Dict[str, List[Any]]):
+        columns = []
+        for name, kind in COLUMNS:
+            values = chunk[name]
+            if kind == "float":
+                values = ["" if math.isnan(v) else repr(v) for v in values]
+            elif kind == "bool":
+                values = [int(v) for v in values]
+            columns.append(values)
+        self.writer.writerows(zip(*columns))
+
+    def close(self):
+        self.file.close()
+
+
+_WRITERS = {".parquet": _ParquetWriter, ".npz": _NpzWriter, ".csv": _CsvWriter}
+
+
+def export_columnar(path: str, entries: Iterable[Dict[str, Any]],
+                    chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """
+    Export history entries as typed columns, chunk by chunk.
+
+    The format follows the extension: .parquet (pyarrow), .npz (numpy) or .csv.
+
+    Args:
+        path: Destination file
+        entries: History entries; may be a generator
+        chunk_size: Rows flattened and written per chunk
+
+    Returns:
+        Number of rows written
+
+    Raises:
+        ValueError: If the extension is not a columnar format
+        ImportError: If the format's optional dependency is not installed
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError(f"Unsupported columnar format '{ext}'; use {', '.join(FORMATS)}")
+    name, module = FORMATS[ext]
+    if module is None:
+        raise ImportError(f"{name} export needs {'pyarrow' if ext == '.parquet' else 'numpy'}; "
+                          f"install it or export to .csv")
+
+    writer = _WRITERS[ext](path)
+    rows = 0
+    try:
+        for chunk in iter_chunks(entries, chunk_size):
+            writer.write(chunk)
+            rows += len(chunk["model"])
+    finally:
+        writer.close()
+    return rows
+
+
+def load_columns(path: str) -> Dict[str, Any]:
+    """
+    Read a columnar export back as numpy arrays.
+
+    Returns:
+        Column name -> numpy array (strings as unicode arrays)
+
+    Raises:
+        ImportError: If numpy (or pyarrow, for Parquet) is not installed
+    """
+    if numpy is None:
+        raise ImportError("Loading columnar exports needs numpy")
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".parquet":
+        if pyarrow is None:
+            raise ImportError("Loading Parquet exports needs pyarrow")
+        table = pyarrow.parquet.read_table(path)
+        return {name: table.column(name).to_numpy() for name in table.column_names}
+
+    if ext == ".npz":
+        with numpy.load(path) as archive:
+            columns = {}
+            for name in archive.files:
+                if name.endswith("__values"):
+                    continue
+                values_key = f"{name}__values"
+                columns[name] = archive[values_key][archive[name]] if values_key in archive.files else archive[name]
+            return columns
+
+    if ext == ".csv":
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            raw = list(zip(*reader)) or [()] * len(header)
+        columns = {}
+        for name, values in zip(header, raw):
+            kind = COLUMN_TYPES.get(name, "str")
+            if kind == "float":
+                columns[name] = numpy.array([float(v) if v else math.nan for v in values], dtype="float64")
+            elif kind == "int":
+                columns[name] = numpy.array([int(v) for v in values], dtype="int64")
+            elif kind == "bool":
+                columns[name] = numpy.array([v == "1" for v in values], dtype=bool)
+            else:
+                columns[name] = numpy.array(values, dtype=str)
+        return columns
+
+    raise ValueError(f"Unsupported columnar format '{ext}'")
+
+
+def main(argv: List[str]) -> int:
+    """Convert a JSON or .ptz history export: columnar_export.py EXPORT OUT.{parquet,npz,csv}"""
+    if len(argv) != 2:
+        print("usage: python columnar_export.py EXPORT.json|EXPORT.ptz OUT.parquet|OUT.npz|OUT.csv")
+        return 2
+
+    entries = compact_store.load(argv[0])
+    if not isinstance(entries, list):
+        entries = [entries]
+    rows = export_columnar(argv[1], entries)
+    print(f"{argv[0]} -> {argv[1]} ({rows} rows)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,265 @@
+import gzip
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+import metrics
+import serialization
+from tracing import traced
+
+# Compact files are gzip-compressed JSON whose large values live in a shared blob directory
+COMPACT_EXTENSION = ".ptz"
+COMPACT_FORMAT = "prompt-tester-compact"
+COMPACT_VERSION = 1
+BLOB_DIR_NAME = ".blobs"
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Values smaller than this (serialized) are kept inline; a ref costs ~80 bytes
+MIN_BLOB_SIZE = 256
+
+# Top-level fields of saved tests and history entries worth content-addressing
+DEFAULT_BLOB_FIELDS = ["system_prompt", "json_format", "response", "prompt"]
+
+
+def canonical_bytes(obj: Any) -> bytes:
+    """Serialize obj deterministically so equal values always hash the same."""
+    return serialization.dumps_bytes(obj, sort_keys=True)
+
+
+class BlobStore:
+    """
+    Directory of gzip-compressed JSON values addressed by the SHA-256 of their content.
+    """
+
+    def __init__(self, root: str, cache_size: int = 256):
+        self.root = root
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.writes = 0
+
+    @classmethod
+    def beside(cls, path: str) -> "BlobStore":
+        """The blob store shared by every compact file in path's directory."""
+        return cls(os.path.join(os.path.dirname(os.path.abspath(path)), BLOB_DIR_NAME))
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest}.json.gz")
+
+    def put(self, obj: Any) -> str:
+        """
+        Store a value once.
+
+        Args:
+            obj: JSON-serializable value
+
+        Returns:
+            The value's SHA-256 hex digest
+        """
+        data = canonical_bytes(obj)
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = self._blob_path(digest)
+        if os.path.exists(blob_path):
+            self.hits += 1
+            return digest
+
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        # Write-then-rename so a crash never leaves a truncated blob behind
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(blob_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as f:
+                f.write(data)
+            os.replace(tmp_path, blob_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.writes += 1
+        return digest
+
+    def get(self, digest: str) -> Any:
+        with self._lock:
+            if digest in self._cache:
+                self._cache.move_to_end(digest)
+                metrics.record_cache("blobs", True)
+                return self._cache[digest]
+        metrics.record_cache("blobs", False)
+
+        with gzip.open(self._blob_path(digest), "rb") as f:
+            value = serialization.load(f)
+
+        with self._lock:
+            self._cache[digest] = value
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return value
+
+
+def _compact_response(response: Any) -> Any:
+    """Drop a citations list that merely repeats the search_results URLs."""
+    if not isinstance(response, dict):
+        return response
+    citations = response.get("citations")
+    search_results = response.get("search_results")
+    if isinstance(citations, list) and isinstance(search_results, list):
+        urls = [r.get("url") for r in search_results if isinstance(r, dict)]
+        if citations == urls:
+            response = dict(response)
+            response["citations"] = {"$derive": "search_results.url"}
+    return response
+
+
+def _expand_response(response: Any) -> Any:
+    if isinstance(response, dict) and response.get("citations") == {"$derive": "search_results.url"}:
+        response = dict(response)
+        response["citations"] = [r.get("url") for r in response.get("search_results", [])]
+    return response
+
+
+def pack(record: Dict[str, Any], store: BlobStore,
+         blob_fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Replace a record's large fields with blob references.
+
+    Args:
+        record: A saved test or history entry
+        store: BlobStore receiving the large values
+        blob_fields: Top-level keys eligible for blob storage
+
+    Returns:
+        A shallow copy of record with {"$blob": digest} references
+    """
+    packed = dict(record)
+    for key in blob_fields or DEFAULT_BLOB_FIELDS:
+        value = packed.get(key)
+        if value is None:
+            continue
+        if key == "response":
+            value = _compact_response(value)
+        if len(canonical_bytes(value)) >= MIN_BLOB_SIZE:
+            packed[key] = {"$blob": store.put(value)}
+        else:
+            packed[key] = value
+    return packed
+
+
+def unpack(record: Dict[str, Any], store: BlobStore) -> Dict[str, Any]:
+    """Resolve blob references produced by pack()."""
+    unpacked = dict(record)
+    for key, value in record.items():
+        if isinstance(value, dict) and set(value) == {"$blob"}:
+            value = store.get(value["$blob"])
+        if key == "response":
+            value = _expand_response(value)
+        unpacked[key] = value
+    return unpacked
+
+
+def is_compact(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+def _write_header(f, kind: str):
+    f.write(f'{{"format":"{COMPACT_FORMAT}","version":{COMPACT_VERSION},"kind":"{kind}","data":'.encode("utf-8"))
+
+
+@traced("save compact", "persistence")
+def save_compact(path: str, record: Dict[str, Any], store: Optional[BlobStore] = None):
+    """
+    Save a single test in the compact format.
+
+    Args:
+        path: Destination .ptz file
+        record: The saved-test dictionary
+        store: BlobStore to use, defaults to the one beside path
+    """
+    store = store or BlobStore.beside(path)
+    with gzip.open(path, "wb") as f:
+        _write_header(f, "test")
+        serialization.dump(pack(record, store), f)
+        f.write(b"}")
+
+
+@traced("export compact", "persistence")
+def export_compact(path: str, records: Iterable[Dict[str, Any]], store: Optional[BlobStore] = None):
+    """
+    Stream a sequence of history entries into one compact file.
+
+    Entries are packed and written one at a time, so the export never holds
+    more than a single serialized entry in memory.
+
+    Args:
+        path: Destination .ptz file
+        records: History entries
+        store: BlobStore to use, defaults to the one beside path
+    """
+    store = store or BlobStore.beside(path)
+    with gzip.open(path, "wb") as f:
+        _write_header(f, "history")
+        f.write(b"[")
+        for i, record in enumerate(records):
+            if i:
+                f.write(b",")
+            serialization.dump(pack(record, store), f)
+        f.write(b"]}")
+
+
+def load(path: str, store: Optional[BlobStore] = None) -> Any:
+    """
+    Load a saved test or export in either the plain JSON or the compact format.
+
+    Args:
+        path: File to read
+        store: BlobStore to use for compact files, defaults to the one beside path
+
+    Returns:
+        The test dictionary, or the list of history entries for exports
+    """
+    if not is_compact(path):
+        with open(path, "rb") as f:
+            return serialization.load(f)
+
+    with gzip.open(path, "rb") as f:
+        document = serialization.load(f)
+    if document.get("format") != COMPACT_FORMAT:
+        raise ValueError(f"{path} is not a {COMPACT_FORMAT} file")
+
+    store = store or BlobStore.beside(path)
+    data = document["data"]
+    if isinstance(data, list):
+        return [unpack(record, store) for record in data]
+    return unpack(data, store)
+
+
+def main(argv: List[str]) -> int:
+    """Convert saved tests between formats: pack <file.json>... | unpack <file.ptz>..."""
+    if len(argv) < 2 or argv[0] not in ("pack", "unpack"):
+        print("usage: python compact_store.py pack|unpack FILE...")
+        return 2
+
+    command, paths = argv[0], argv[1:]
+    for path in paths:
+        data = load(path)
+        base = os.path.splitext(path)[0]
+        if command == "pack":
+            target = base + COMPACT_EXTENSION
+            if isinstance(data, list):
+                export_compact(target, data)
+            else:
+                save_compact(target, data)
+        else:
+            target = base + ".json"
+            with open(target, "wb") as f:
+                serialization.dump(data, f, indent=True)
+        print(f"{path} -> {target}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,265 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+from request_control import CancelToken, RequestCancelled
+
+
+class LatencyTracker:
+    """
+    Rolling window of observed latencies per model.
+    """
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, seconds: float):
+        with self._lock:
+            samples = self._samples.get(model)
+            if samples is None:
+                samples = self._samples[model] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def count(self, model: str) -> int:
+        with self._lock:
+            return len(self._samples.get(model, ()))
+
+    def percentile(self, model: str, p: float) -> Optional[float]:
+        """
+        Get the p-th percentile (0-1) of a model's recent latencies.
+
+        Args:
+            model: The model name
+            p: Percentile as a fraction, e.g. 0.95
+
+        Returns:
+            Latency in seconds, or None if no samples were recorded
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(p * len(samples)))
+        return samples[index]
+
+
+class HedgePolicy:
+    """
+    Send a duplicate request when the original is slower than a latency percentile.
+
+    The first response wins and the other request is cancelled. Hedges are capped
+    at budget_ratio of all hedge-eligible requests so tail-cutting cannot double spend.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        min_samples: int = 20,
+        budget_ratio: float = 0.1,
+        min_delay: float = 0.5,
+        tracker: Optional[LatencyTracker] = None
+    ):
+        """
+        Args:
+            percentile: Hedge once a request outlives this percentile of its model's latency
+            min_samples: Observations needed for a model before hedging starts
+            budget_ratio: Maximum hedges as a fraction of requests sent
+            min_delay: Never hedge earlier than this many seconds
+            tracker: Shared LatencyTracker (a new one is created if omitted)
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.budget_ratio = budget_ratio
+        self.min_delay = min_delay
+        self.tracker = tracker or LatencyTracker()
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges_issued = 0
+        self.hedges_won = 0
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """Seconds to wait before hedging a request, or None if there is not enough data yet."""
+        if self.tracker.count(model) < self.min_samples:
+            return None
+        delay = self.tracker.percentile(model, self.percentile)
+        return max(self.min_delay, delay)
+
+    def _count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def _acquire_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges_issued + 1 > self.budget_ratio * self.requests:
+                return False
+            self.hedges_issued += 1
+            return True
+
+    def _record_win(self):
+        with self._lock:
+            self.hedges_won += 1
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges_issued": self.hedges_issued,
+                "hedges_won": self.hedges_won
+            }
+
+
+class HedgeSlot:
+    """
+    Rate-limit capacity for a hedge, taken without waiting.
+
+    A hedge is a second request to the same provider, so it needs its own
+    concurrency slot and rate token from the shared limiter; when none is
+    free the hedge is skipped rather than queued.
+    """
+
+    def __init__(self, limiter: Any, provider: str, priority: str):
+        """
+        Args:
+            limiter: rate_limit.RateLimiter or scheduler.Scheduler the primary call went through
+            provider: Provider the hedge is sent to
+            priority: The run's scheduling class
+        """
+        self.limiter = limiter
+        self.provider = provider
+        self.priority = priority
+
+    def try_acquire(self) -> bool:
+        return self.limiter.try_acquire(self.provider, self.priority)
+
+    def release(self):
+        self.limiter.release(self.provider)
+
+
+class _HedgeRace:
+    """Coordinates one primary request and at most one hedge."""
+
+    def __init__(self, policy: HedgePolicy, send: Callable[[CancelToken], Any], slot: Optional[HedgeSlot]):
+        self.policy = policy
+        self.send = send
+        self.slot = slot
+        self.primary_token = CancelToken()
+        self.hedge_token = CancelToken()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.hedge_started = False
+        self.hedge_done = threading.Event()
+        self.winner: Optional[str] = None
+        self.hedge_value: Any = None
+
+    def run_hedge(self):
+        with self.lock:
+            if self.closed:
+                return
+            if self.slot is not None and not self.slot.try_acquire():
+                return
+            if not self.policy._acquire_hedge():
+                if self.slot is not None:
+                    self.slot.release()
+                return
+            self.hedge_started = True
+
+        try:
+            value = self.send(self.hedge_token)
+        except Exception:
+            pass
+        else:
+            with self.lock:
+                if self.winner is None:
+                    self.winner = "hedge"
+                    self.hedge_value = value
+            if self.winner == "hedge":
+                self.primary_token.cancel()
+        finally:
+            if self.slot is not None:
+                self.slot.release()
+            self.hedge_done.set()
+
+
+def send_hedged(
+    policy: Optional[HedgePolicy],
+    model: str,
+    cancel_token: Optional[CancelToken],
+    send: Callable[[CancelToken], Any],
+    slot: Optional[HedgeSlot] = None
+) -> Any:
+    """
+    Run send() under a hedging policy.
+
+    The primary request runs on the calling thread; a hedge, if issued, runs on a
+    timer thread. Each gets its own CancelToken, both linked to cancel_token.
+
+    Args:
+        policy: HedgePolicy to apply, or None to send once without hedging
+        model: Model name used for latency tracking
+        cancel_token: Caller's token; cancelling it aborts both requests
+        send: Callable performing the request with the CancelToken it is given
+        slot: Limiter capacity the hedge must take first; no hedge is sent
+              when it is unavailable. None hedges without a limiter
+
+    Returns:
+        The value returned by whichever request finished first
+    """
+    if policy is None:
+        return send(cancel_token)
+
+    policy._count_request()
+    race = _HedgeRace(policy, send, slot)
+    if cancel_token is not None:
+        cancel_token.add_callback(race.primary_token.cancel)
+        cancel_token.add_callback(race.hedge_token.cancel)
+
+    timer = None
+    delay = policy.hedge_delay(model)
+    if delay is not None:
+        timer = threading.Timer(delay, race.run_hedge)
+        timer.daemon = True
+        timer.start()
+
+    start_time = time.monotonic()
+    try:
+        primary_error = None
+        try:
+            value = race.send(race.primary_token)
+        except Exception as e:
+            primary_error = e
+        else:
+            with race.lock:
+                if race.winner is None:
+                    race.winner = "primary"
+
+        if timer is not None:
+            timer.cancel()
+        with race.lock:
+            race.closed = True
+            hedge_started = race.hedge_started
+
+        if race.winner == "primary":
+            race.hedge_token.cancel()
+            policy.tracker.record(model, time.monotonic() - start_time)
+            return value
+
+        if cancel_token is not None and cancel_token.cancelled:
+            raise RequestCancelled("Request cancelled")
+
+        # The primary lost or failed - the hedge is the only remaining chance
+        if hedge_started:
+            race.hedge_done.wait()
+            if race.winner == "hedge":
+                policy._record_win()
+                policy.tracker.record(model, time.monotonic() - start_time)
+                return race.hedge_value
+
+        raise primary_error
+    finally:
+        if cancel_token is not None:
+            cancel_token.remove_callback(race.primary_token.cancel)
+            cancel_token.remove_callback(race.hedge_token.cancel)
@@ -0,0 +1,312 @@
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from jsonschema import Draft202012Validator
+
+import serialization
+
+Path = Tuple[Any, ...]
+
+NUMBER = re.compile(r"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?")
+# Anything a number could still grow into, including a lone "-" or "1e"
+NUMBER_PREFIX = re.compile(r"-?(?:0|[1-9][0-9]*)?(?:\.[0-9]*)?(?:[eE][+-]?[0-9]*)?")
+LITERALS = {"true": True, "false": False, "null": None}
+WHITESPACE = " \t\r\n"
+
+# sonar-reasoning models think aloud before answering
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+# Characters of offending output quoted in an abort reason
+QUOTE_CHARS = 40
+
+
+class IncrementalJSONError(ValueError):
+    """The text so far can no longer become a single JSON document."""
+
+
+class StreamAborted(Exception):
+    """
+    A streamed structured response was abandoned because it left its schema.
+
+    Raised from inside the stream's on_delta; it is not an API failure, so the
+    router neither falls back nor counts it against the provider's breaker.
+
+    Attributes:
+        content: The content received before the abort
+    """
+
+    def __init__(self, message: str, content: str):
+        super().__init__(message)
+        self.message = message
+        self.content = content
+
+
+class _Frame:
+    __slots__ = ("container", "key", "state")
+
+    def __init__(self, container: Any):
+        self.container = container
+        self.key: Any = None if isinstance(container, dict) else 0
+        # object: key, colon, value, next;  array: first, value, next
+        self.state = "key" if isinstance(container, dict) else "first"
+
+
+class IncrementalParser:
+    """
+    Parses one JSON document fed in arbitrary fragments.
+
+    feed() returns every value completed by the new text, with its path from
+    the root (object keys and array indexes), innermost first; the root itself
+    comes last with the path (). Errors are raised as soon as the text cannot
+    be the start of a JSON document, so prose is caught at its first letter.
+    """
+
+    def __init__(self):
+        self.done = False
+        self.root: Any = None
+        self._buffer = ""
+        self._stack: List[_Frame] = []
+        self._started = False
+
+    def feed(self, text: str) -> List[Tuple[Path, Any]]:
+        """
+        Args:
+            text: The next fragment
+
+        Returns:
+            (path, value) for each value completed by this fragment
+
+        Raises:
+            IncrementalJSONError: If the document is malformed or followed by more text
+        """
+        self._buffer += text
+        completed: List[Tuple[Path, Any]] = []
+        while self._step(completed, final=False):
+            pass
+        return completed
+
+    def finish(self) -> List[Tuple[Path, Any]]:
+        """End of input: complete a trailing bare number and check the document closed"""
+        completed: List[Tuple[Path, Any]] = []
+        while self._step(completed, final=True):
+            pass
+        if not self.done:
+            raise IncrementalJSONError("Response ended before the JSON document was complete")
+        return completed
+
+    def _path(self) -> Path:
+        return tuple(frame.key for frame in self._stack)
+
+    def _step(self, completed: List[Tuple[Path, Any]], final: bool) -> bool:
+        """Consume one token from the buffer; False when more text is needed"""
+        buffer = self._buffer.lstrip(WHITESPACE)
+        self._buffer = buffer
+        if not buffer:
+            return False
+        if self.done:
+            raise IncrementalJSONError(f"Text after the JSON document: {buffer[:QUOTE_CHARS]!r}")
+        frame = self._stack[-1] if self._stack else None
+        char = buffer[0]
+
+        if frame is not None and frame.state in ("colon", "next"):
+            return self._punctuation(frame, char, completed)
+        if frame is not None and frame.state == "key":
+            if char == "}" and not frame.container:
+                self._buffer = buffer[1:]
+                self._close(completed)
+                return True
+            if char != '"':
+                raise IncrementalJSONError(f"Expected a property name, got {buffer[:QUOTE_CHARS]!r}")
+            token = self._string(buffer)
+            if token is None:
+                return False
+            frame.key = token
+            frame.state = "colon"
+            return True
+        if frame is not None and frame.state == "first" and char == "]":
+            self._buffer = buffer[1:]
+            self._close(completed)
+            return True
+
+        if not self._started and buffer.startswith(THINK_OPEN[:len(buffer)]):
+            # A reasoning block, or the start of one: skip it once it closes
+            end = buffer.find(THINK_CLOSE)
+            if end < 0:
+                return False
+            self._buffer = buffer[end + len(THINK_CLOSE):]
+            return True
+        self._started = True
+        return self._value(buffer, completed, final)
+
+    def _punctuation(self, frame: _Frame, char: str, completed: List[Tuple[Path, Any]]) -> bool:
+        is_object = isinstance(frame.container, dict)
+        if frame.state == "colon":
+            if char != ":":
+                raise IncrementalJSONError(f"Expected ':' after {frame.key!r}")
+            frame.state = "value"
+        elif char == ",":
+            if is_object:
+                frame.state = "key"
+            else:
+                frame.key += 1
+                frame.state = "value"
+        elif char == ("}" if is_object else "]"):
+            self._buffer = self._buffer[1:]
+            self._close(completed)
+            return True
+        else:
+            raise IncrementalJSONError(f"Expected ',' or {'}' if is_object else ']'}, got {char!r}")
+        self._buffer = self._buffer[1:]
+        return True
+
+    def _value(self, buffer: str, completed: List[Tuple[Path, Any]], final: bool) -> bool:
+        char = buffer[0]
+        if char in "{[":
+            self._buffer = buffer[1:]
+            self._stack.append(_Frame({} if char == "{" else []))
+            return True
+        if char == '"':
+            token = self._string(buffer)
+            if token is None:
+                return False
+            self._complete(token, completed)
+            return True
+        if char == "-" or char.isdigit():
+            match = NUMBER_PREFIX.match(buffer)
+            end = match.end()
+            if end == len(buffer) and not final:
+                return False
+            number = NUMBER.fullmatch(buffer[:end])
+            if number is None:
+                raise IncrementalJSONError(f"Malformed number {buffer[:end]!r}")
+            self._buffer = buffer[end:]
+            self._complete(serialization.loads(number.group()), completed)
+            return True
+        for literal, value in LITERALS.items():
+            if buffer.startswith(literal):
+                self._buffer = buffer[len(literal):]
+                self._complete(value, completed)
+                return True
+            if literal.startswith(buffer):
+                return False
+        raise IncrementalJSONError(f"Not JSON: {buffer[:QUOTE_CHARS]!r}")
+
+    def _string(self, buffer: str) -> Optional[str]:
+        """The string token at the start of buffer, consumed, or None if it has not closed yet"""
+        index = 1
+        while True:
+            index = buffer.find('"', index)
+            if index < 0:
+                return None
+            backslashes = len(buffer[:index]) - len(buffer[:index].rstrip("\\"))
+            if backslashes % 2 == 0:
+                break
+            index += 1
+        try:
+            token = serialization.loads(buffer[:index + 1])
+        except serialization.JSONDecodeError as e:
+            raise IncrementalJSONError(f"Malformed string: {e}")
+        self._buffer = buffer[index + 1:]
+        return token
+
+    def _complete(self, value: Any, completed: List[Tuple[Path, Any]]):
+        if not self._stack:
+            self.root = value
+            self.done = True
+            completed.append(((), value))
+            return
+        frame = self._stack[-1]
+        if isinstance(frame.container, dict):
+            frame.container[frame.key] = value
+        else:
+            frame.container.append(value)
+        frame.state = "next"
+        completed.append((self._path(), value))
+
+    def _close(self, completed: List[Tuple[Path, Any]]):
+        frame = self._stack.pop()
+        self._complete(frame.container, completed)
+
+
+def subschema(schema: Dict[str, Any], path: Path) -> Optional[Dict[str, Any]]:
+    """
+    The schema a value at path must satisfy, following properties and items.
+
+    Returns:
+        The subschema, {} for an unconstrained value, or None when the path
+        cannot exist (a property additionalProperties forbids)
+    """
+    for key in path:
+        if not isinstance(schema, dict):
+            return {}
+        if isinstance(key, str):
+            properties = schema.get("properties") or {}
+            if key in properties:
+                schema = properties[key]
+            else:
+                extra = schema.get("additionalProperties", True)
+                if extra is False:
+                    return None
+                schema = extra if isinstance(extra, dict) else {}
+        else:
+            items = schema.get("items", {})
+            schema = items if isinstance(items, dict) else {}
+    return schema if isinstance(schema, dict) else {}
+
+
+class StreamValidator:
+    """
+    Follows a streamed structured response and gives up on it as soon as it
+    leaves its schema.
+
+    Every value is checked against its subschema the moment it closes; the
+    root is left to the usual validation of the finished response, since a
+    missing required field is only known at the end anyway.
+
+    Attributes:
+        fields: Completed top-level properties, in arrival order
+    """
+
+    def __init__(self, schema: Dict[str, Any], on_field: Optional[Callable[[str, Any], None]] = None):
+        """
+        Args:
+            schema: The response's JSON schema
+            on_field: Called with each top-level property as it completes and validates
+        """
+        self.on_field = on_field
+        self.fields: Dict[str, Any] = {}
+        self._parser = IncrementalParser()
+        self._validator = Draft202012Validator(schema)
+        self._schema = schema
+        self._text: List[str] = []
+
+    @property
+    def content(self) -> str:
+        return "".join(self._text)
+
+    def feed(self, text: str):
+        """
+        Raises:
+            StreamAborted: If the content is not JSON or a closed value breaks the schema
+        """
+        self._text.append(text)
+        try:
+            completed = self._parser.feed(text)
+        except IncrementalJSONError as e:
+            raise StreamAborted(f"Response left the schema: {e}", self.content)
+        for path, value in completed:
+            if not path:
+                continue
+            schema = subschema(self._schema, path)
+            if schema is None:
+                raise StreamAborted(f"Response left the schema: unexpected property {path[-1]!r}", self.content)
+            # evolve keeps the root's $defs resolvable from the subschema
+            error = next(iter(self._validator.evolve(schema=schema).iter_errors(value)), None)
+            if error is not None:
+                where = ".".join(str(key) for key in path)
+                raise StreamAborted(f"Response left the schema at {where}: {error.message}", self.content)
+            if len(path) == 1:
+                self.fields[path[0]] = value
+                if self.on_field is not None:
+                    self.on_field(path[0], value)
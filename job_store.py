@@ -0,0 +1,350 @@
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Callable, List, Optional
+
+import serialization
+from perplexity_client import ASYNC_MODELS
+from request_control import CancelToken, RequestCancelled
+from routing import translate_params
+from run_config import RunConfig
+from run_engine import RunEngine, RunResult
+from scheduler import PIPELINE
+from tracing import traced
+
+DEFAULT_JOB_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.sqlite3")
+
+# Seconds between status checks of async jobs; deep research takes minutes
+DEFAULT_POLL_INTERVAL = 10.0
+
+# Async job statuses reported by the Perplexity API
+REMOTE_DONE = "COMPLETED"
+REMOTE_FAILED = "FAILED"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    status TEXT NOT NULL,
+    config TEXT NOT NULL,
+    remote_id TEXT,
+    response TEXT,
+    served_model TEXT,
+    response_time REAL,
+    cost REAL,
+    error TEXT,
+    delivered INTEGER NOT NULL DEFAULT 0,
+    submitted_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+)
+"""
+
+
+class Job:
+    """
+    A persisted run. Async jobs (remote_id set) are polled; the others run on a
+    local worker like a queued run.
+
+    Status moves queued -> running -> done | failed | cancelled, mirroring RunRecord.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    def __init__(self, job_id: int, config: RunConfig, status: str = QUEUED):
+        self.job_id = job_id
+        self.config = config
+        self.status = status
+        self.remote_id: Optional[str] = None
+        self.result: Optional[RunResult] = None
+        self.error: Optional[str] = None
+        self.delivered = False
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_token = CancelToken()
+
+    @property
+    def active(self) -> bool:
+        return self.status in (self.QUEUED, self.RUNNING)
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+
+class JobStore:
+    """
+    SQLite table of jobs. One connection is shared by every thread behind a lock;
+    each write commits immediately so a crash loses at most the write in progress.
+    """
+
+    def __init__(self, path: str = DEFAULT_JOB_DB):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(SCHEMA)
+
+    @traced("job create", "persistence")
+    def create(self, config: RunConfig) -> Job:
+        job = Job(0, config)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (status, config, submitted_at) VALUES (?, ?, ?)",
+                (job.status, serialization.dumps(config.to_dict()), job.submitted_at))
+        job.job_id = cursor.lastrowid
+        return job
+
+    @traced("job save", "persistence")
+    def save(self, job: Job):
+        result = job.result
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, remote_id = ?, response = ?, served_model = ?, "
+                "response_time = ?, cost = ?, error = ?, delivered = ?, started_at = ?, finished_at = ? "
+                "WHERE job_id = ?",
+                (job.status, job.remote_id,
+                 serialization.dumps(result.response) if result else None,
+                 result.served_model if result else None,
+                 result.response_time if result else None,
+                 result.cost if result else None,
+                 job.error, int(job.delivered), job.started_at, job.finished_at, job.job_id))
+
+    def _from_row(self, row: sqlite3.Row) -> Job:
+        config = RunConfig(**serialization.loads(row["config"]))
+        job = Job(row["job_id"], config, row["status"])
+        job.remote_id = row["remote_id"]
+        job.error = row["error"]
+        job.delivered = bool(row["delivered"])
+        job.submitted_at = row["submitted_at"]
+        job.started_at = row["started_at"]
+        job.finished_at = row["finished_at"]
+        if row["response"] is not None:
+            job.result = RunResult(config, serialization.loads(row["response"]),
+                                   row["response_time"], row["served_model"], row["cost"])
+        return job
+
+    def load(self, limit: int = 100) -> List[Job]:
+        """The most recent jobs plus every active one, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) OR job_id IN "
+                "(SELECT job_id FROM jobs ORDER BY job_id DESC LIMIT ?) ORDER BY job_id",
+                (Job.QUEUED, Job.RUNNING, limit)).fetchall()
+        return [self._from_row(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobManager:
+    """
+    Runs jobs that survive the app closing.
+
+    Models in ASYNC_MODELS are submitted to the provider's async API and polled by
+    one shared thread, so any number can be in flight without a thread blocked on
+    each. Other models run on a small worker pool through the RunEngine. Calls
+    are scheduled as pipeline work, behind runs started from the window.
+    on_update is called from background threads whenever a job changes.
+    """
+
+    def __init__(
+        self,
+        engine: RunEngine,
+        store: JobStore,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        max_workers: int = 2,
+        on_update: Optional[Callable[[Job], None]] = None
+    ):
+        self.engine = engine
+        self.store = store
+        self.poll_interval = poll_interval
+        self.on_update = on_update
+        self.jobs: List[Job] = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._stop = threading.Event()
+        self._poller: Optional[threading.Thread] = None
+
+    def resume(self) -> List[Job]:
+        """
+        Load persisted jobs and pick up where the last session stopped.
+
+        Async jobs resume polling. Local jobs that were still queued are run;
+        ones that were mid-request when the app closed are marked failed rather
+        than sent (and billed) a second time.
+
+        Returns:
+            The loaded jobs, oldest first
+        """
+        jobs = self.store.load()
+        with self._lock:
+            self.jobs = jobs
+        for job in jobs:
+            if job.status == Job.RUNNING and job.remote_id is None:
+                self._finish(job, Job.FAILED, "Interrupted when the app closed")
+            elif job.status == Job.QUEUED and job.remote_id is None:
+                self._executor.submit(self._run_local, job)
+
+        self._poller = threading.Thread(target=self._poll_loop, name="job-poller", daemon=True)
+        self._poller.start()
+        return jobs
+
+    def is_async(self, config: RunConfig) -> bool:
+        return config.model in ASYNC_MODELS
+
+    def submit(self, config: RunConfig) -> Job:
+        """
+        Persist and start a job.
+
+        Async submission happens on a worker so the caller never waits on the network.
+        """
+        job = self.store.create(config)
+        with self._lock:
+            self.jobs.append(job)
+        target = self._submit_async if self.is_async(config) else self._run_local
+        self._executor.submit(target, job)
+        return job
+
+    def get(self, job_id: int) -> Optional[Job]:
+        with self._lock:
+            for job in self.jobs:
+                if job.job_id == job_id:
+                    return job
+        return None
+
+    def active_count(self) -> int:
+        with self._lock:
+            return sum(1 for job in self.jobs if job.active)
+
+    def cancel(self, job: Job):
+        """
+        Stop tracking a job. The async API has no cancel endpoint, so a submitted
+        async job keeps running (and billing) on the provider's side.
+        """
+        if not job.active:
+            return
+        job.cancel_token.cancel()
+        self._finish(job, Job.CANCELLED)
+
+    def mark_delivered(self, job: Job):
+        """Record that a finished job's result has been added to history"""
+        job.delivered = True
+        self.store.save(job)
+
+    def _notify(self, job: Job):
+        if self.on_update is not None:
+            self.on_update(job)
+
+    def _finish(self, job: Job, status: str, error: Optional[str] = None):
+        with self._lock:
+            if not job.active:
+                return
+            job.status = status
+            job.error = error
+            job.finished_at = time.time()
+        self.store.save(job)
+        self._notify(job)
+
+    def _start(self, job: Job) -> bool:
+        with self._lock:
+            if job.status != Job.QUEUED:
+                return False
+            job.status = Job.RUNNING
+            job.started_at = time.time()
+        self.store.save(job)
+        self._notify(job)
+        return True
+
+    def _run_local(self, job: Job):
+        if not self._start(job):
+            return
+        try:
+            result = self.engine.execute(job.config, job.cancel_token, priority=PIPELINE)
+        except RequestCancelled:
+            self._finish(job, Job.CANCELLED)
+        except Exception as e:
+            self._finish(job, Job.FAILED, str(e))
+        else:
+            job.result = result
+            self._finish(job, Job.DONE)
+
+    def _submit_async(self, job: Job):
+        if not self._start(job):
+            return
+        client = self.engine.router.clients.get("perplexity")
+        if client is None:
+            self._finish(job, Job.FAILED, "Perplexity API key is not configured")
+            return
+
+        kwargs = translate_params(job.config.to_params(), job.config.model)
+        kwargs.pop("stream", None)
+        limiter = self.engine.router.limiter
+        try:
+            with limiter.acquire("perplexity", job.cancel_token, priority=PIPELINE) if limiter else nullcontext():
+                submitted = client.submit_async(**kwargs)
+        except RequestCancelled:
+            self._finish(job, Job.CANCELLED)
+            return
+        except Exception as e:
+            self._finish(job, Job.FAILED, str(e))
+            return
+
+        job.remote_id = submitted["id"]
+        self.store.save(job)
+        self._notify(job)
+
+    def _poll_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            with self._lock:
+                pending = [job for job in self.jobs if job.active and job.remote_id is not None]
+            for job in pending:
+                if self._stop.is_set():
+                    return
+                self._poll(job)
+
+    def _poll(self, job: Job):
+        client = self.engine.router.clients.get("perplexity")
+        if client is None:
+            return
+        try:
+            status = client.get_async(job.remote_id, job.config.model)
+        except Exception:
+            # Transient; the job is still on the provider's side, try again next round
+            return
+
+        if status.get("status") == REMOTE_DONE:
+            response = status.get("response") or {}
+            started = status.get("created_at")
+            completed = status.get("completed_at")
+            if isinstance(started, (int, float)) and isinstance(completed, (int, float)):
+                response_time = completed - started
+            else:
+                response_time = time.time() - (job.started_at or job.submitted_at)
+            job.result = self.engine.account(
+                RunResult(job.config, response, response_time, response.get("model", job.config.model)))
+            self._finish(job, Job.DONE)
+        elif status.get("status") == REMOTE_FAILED:
+            self._finish(job, Job.FAILED, status.get("error_message") or "Async job failed")
+
+    def shutdown(self):
+        """Stop polling and local workers; async jobs stay submitted and resume next session"""
+        self._stop.set()
+        with self._lock:
+            local = [job for job in self.jobs if job.active and job.remote_id is None
+                     and job.status == Job.RUNNING]
+        for job in local:
+            job.cancel_token.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
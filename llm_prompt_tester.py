@@ -1,16 +1,30 @@
 import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox, filedialog
+from tkinter import ttk, messagebox, filedialog
 import customtkinter as ctk
-import json
 import os
 from dotenv import load_dotenv
 from datetime import datetime
-import threading
-from typing import Dict, Any
-import jsonschema
-from jsonschema import validate, ValidationError
+from typing import Any, Optional
+from local_tools import default_tools
+from pre_resolver import default_resolver
 from perplexity_client import PerplexityAPIClient
 from openai_client import OpenAIClient
+from hedging import HedgePolicy
+from job_store import Job, JobManager, JobStore
+from profiling import PROFILER, profiled
+from prompt_watcher import PromptWatcher
+from request_control import ConnectionWarmer, http2_enabled
+from response_cache import ResponseCache
+from routing import FallbackRouter, provider_for
+from run_config import RunConfig
+from run_engine import QueueFullError, RunEngine, RunQueue, RunRecord, RunResult
+from scheduler import Scheduler
+from similarity_index import SimilarityIndex, find_similar_tests, word_differences
+from sweep_window import SweepWindow
+import columnar_export
+import compact_store
+import metrics
+import serialization
 
 load_dotenv()
 
@@ -28,6 +42,31 @@ class LLMPromptTesterGUI:
         self.openai_client = None
         self.current_response = None
         self.test_history = []
+        self.current_result = None
+        self.progress_running = False
+        self.run_tick_scheduled = False
+        # Shared across both clients so latency history survives a key reload
+        self.hedge_policy = HedgePolicy()
+        # Breaker state and rate limits live in the router; clients are swapped in by load_api_key.
+        # The run queue's calls are interactive, so they go ahead of queued sweep and job calls
+        self.router = FallbackRouter({"perplexity": None, "openai": None}, limiter=Scheduler())
+        # First requests after launch or a provider switch skip DNS/TCP/TLS setup
+        self.connection_warmer = ConnectionWarmer()
+        self.run_queue = RunQueue(RunEngine(self.router, tools=default_tools(), resolver=default_resolver()),
+                                  on_update=self.on_run_update, on_field=self.on_run_field)
+        # Watch mode: saved tests re-run when their request changes on disk
+        self.prompt_watcher: Optional[PromptWatcher] = None
+        self.watch_cache = ResponseCache()
+        self.watched_runs = set()
+        # The run whose streamed JSON fields are shown while it is in flight
+        self.streaming_run_id: Optional[int] = None
+        self.streamed_fields = 0
+        # Persistent jobs for long runs; they outlive the window and resume on the next start
+        self.job_manager = JobManager(self.run_queue.engine, JobStore(), on_update=self.on_job_update)
+        # Results of this session's runs, looked up before sending a near-identical request
+        self.similar_requests = SimilarityIndex()
+        # Scrapeable /metrics when PROMPT_TESTER_METRICS_PORT is set
+        metrics.start_from_env()
 
         self.perplexity_models = [
             "sonar",
@@ -46,10 +85,13 @@ class LLMPromptTesterGUI:
 
         self.setup_ui()
         self.load_api_key()
+        self.resume_jobs()
 
         # Set initial paned window position after everything is loaded
         self.root.after(100, self.set_initial_sash_position)
 
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
     def setup_ui(self):
         # Create a PanedWindow for resizable split between input and output
         self.paned_window = tk.PanedWindow(
@@ -292,6 +334,11 @@ class LLMPromptTesterGUI:
                                                     variable=self.parallel_tools_var)
         self.parallel_tools_check.grid(row=0, column=2, padx=(20, 5))
 
+        tool_count = len(self.run_queue.engine.tools)
+        tools_status = ctk.CTkLabel(self.tools_frame,
+                                    text=f"{tool_count} local tools" if tool_count else "No local dataset")
+        tools_status.grid(row=0, column=3, padx=(20, 5))
+
         # Additional OpenAI Parameters
         self.openai_extra_frame = ctk.CTkFrame(scroll_frame)
         self.openai_extra_frame.pack(fill=tk.X, padx=10, pady=5)
@@ -349,6 +396,11 @@ class LLMPromptTesterGUI:
         self.max_tokens_entry = ctk.CTkEntry(llm_frame1, placeholder_text="1000", width=70)
         self.max_tokens_entry.grid(row=0, column=4, padx=5)
 
+        # An empty Max Tokens is sized from the JSON schema unless this is off
+        self.auto_budget_var = tk.BooleanVar(value=True)
+        auto_budget_check = ctk.CTkCheckBox(llm_frame1, text="Auto Budget", variable=self.auto_budget_var)
+        auto_budget_check.grid(row=0, column=5, padx=5)
+
         # Top-p and Penalties
         llm_frame2 = ctk.CTkFrame(scroll_frame)
         llm_frame2.pack(fill=tk.X, padx=10, pady=5)
@@ -427,6 +479,22 @@ class LLMPromptTesterGUI:
         self.validation_label = ctk.CTkLabel(stats_frame, text="JSON Valid: N/A")
         self.validation_label.pack(side=tk.LEFT, padx=10)
 
+        self.hedge_label = ctk.CTkLabel(stats_frame, text="")
+        self.hedge_label.pack(side=tk.LEFT, padx=10)
+
+        runs_label = ctk.CTkLabel(parent, text="Runs:")
+        runs_label.pack(anchor=tk.W, padx=10, pady=(10, 0))
+
+        self.run_tree = ttk.Treeview(parent, columns=("run", "model", "status", "time", "prompt"),
+                                     show="headings", height=4, selectmode="browse")
+        for column, heading, width in (("run", "#", 40), ("model", "Model", 130),
+                                       ("status", "Status", 80), ("time", "Time", 60),
+                                       ("prompt", "Prompt", 300)):
+            self.run_tree.heading(column, text=heading)
+            self.run_tree.column(column, width=width, stretch=(column == "prompt"))
+        self.run_tree.pack(fill=tk.X, padx=10, pady=5)
+        self.run_tree.bind("<<TreeviewSelect>>", self.on_run_selected)
+
         response_label = ctk.CTkLabel(parent, text="Response:")
         response_label.pack(anchor=tk.W, padx=10, pady=(10, 0))
 
@@ -499,6 +567,8 @@ class LLMPromptTesterGUI:
                 self.logprobs_check.configure(state="normal")
                 self.top_logprobs_entry.configure(state="normal", placeholder_text="5")
 
+        self.warm_connections()
+
         # Update JSON format placeholder based on provider (only if not preserving)
         if not preserve_json_format:
             if is_openai:
@@ -563,6 +633,12 @@ class LLMPromptTesterGUI:
                                         width=150, height=40)
         self.test_button.pack(side=tk.LEFT, padx=5)
 
+        self.cancel_button = ctk.CTkButton(button_frame, text="Cancel",
+                                          command=self.cancel_run,
+                                          width=100, height=40,
+                                          state="disabled")
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+
         clear_button = ctk.CTkButton(button_frame, text="Clear All",
                                     command=self.clear_all,
                                     width=100, height=40)
@@ -583,6 +659,54 @@ class LLMPromptTesterGUI:
                                      width=120, height=40)
         export_button.pack(side=tk.LEFT, padx=5)
 
+        sweep_button = ctk.CTkButton(button_frame, text="Sweep...",
+                                    command=self.open_sweep,
+                                    width=100, height=40)
+        sweep_button.pack(side=tk.LEFT, padx=5)
+
+        self.watch_button = ctk.CTkButton(button_frame, text="Watch Folder...",
+                                         command=self.toggle_watch,
+                                         width=120, height=40)
+        self.watch_button.pack(side=tk.LEFT, padx=5)
+
+        self.hedge_var = tk.BooleanVar(value=False)
+        hedge_check = ctk.CTkCheckBox(button_frame, text="Hedge Slow Requests",
+                                      variable=self.hedge_var,
+                                      command=self.apply_hedge_policy)
+        hedge_check.pack(side=tk.LEFT, padx=10)
+
+        self.background_var = tk.BooleanVar(value=False)
+        background_check = ctk.CTkCheckBox(button_frame, text="Background Job",
+                                           variable=self.background_var)
+        background_check.pack(side=tk.LEFT, padx=5)
+
+        self.reuse_var = tk.BooleanVar(value=True)
+        reuse_check = ctk.CTkCheckBox(button_frame, text="Offer Reuse",
+                                      variable=self.reuse_var)
+        reuse_check.pack(side=tk.LEFT, padx=5)
+
+        self.fallback_var = tk.BooleanVar(value=False)
+        fallback_check = ctk.CTkCheckBox(button_frame, text="Allow Fallback",
+                                         variable=self.fallback_var)
+        fallback_check.pack(side=tk.LEFT, padx=5)
+
+        # Lookups the local dataset can answer skip the API; off to test the model itself
+        self.resolve_locally_var = tk.BooleanVar(value=True)
+        resolve_check = ctk.CTkCheckBox(button_frame, text="Local Answers",
+                                        variable=self.resolve_locally_var)
+        resolve_check.pack(side=tk.LEFT, padx=5)
+
+        self.profile_var = tk.BooleanVar(value=PROFILER.enabled)
+        profile_check = ctk.CTkCheckBox(button_frame, text="Profile",
+                                        variable=self.profile_var,
+                                        command=self.toggle_profiling)
+        profile_check.pack(side=tk.LEFT, padx=5)
+
+        profile_button = ctk.CTkButton(button_frame, text="Profile Report",
+                                      command=self.show_profile_report,
+                                      width=110, height=40)
+        profile_button.pack(side=tk.LEFT, padx=5)
+
         self.progress_bar = ctk.CTkProgressBar(button_frame, width=200)
         self.progress_bar.pack(side=tk.RIGHT, padx=10)
         self.progress_bar.set(0)
@@ -610,21 +734,36 @@ class LLMPromptTesterGUI:
 
         # Load Perplexity client
         if perplexity_key:
-            self.perplexity_client = PerplexityAPIClient(perplexity_key)
+            self.perplexity_client = PerplexityAPIClient(perplexity_key, http2=http2_enabled())
             self.perplexity_status_label.configure(text="Perplexity: Loaded", text_color="green")
         else:
             self.perplexity_status_label.configure(text="Perplexity: Not Found", text_color="red")
 
         # Load OpenAI client
         if openai_key:
-            self.openai_client = OpenAIClient(openai_key)
+            self.openai_client = OpenAIClient(openai_key, http2=http2_enabled())
             self.openai_status_label.configure(text="OpenAI: Loaded", text_color="green")
         else:
             self.openai_status_label.configure(text="OpenAI: Not Found", text_color="red")
 
+        self.apply_hedge_policy()
+        self.router.clients = {"perplexity": self.perplexity_client, "openai": self.openai_client}
+
         # Set initial visibility based on selected model
         self.on_model_change()
 
+    def warm_connections(self):
+        """Open connections to the selected model's provider in the background and keep them open"""
+        client = self.router.clients.get(provider_for(self.model_var.get()))
+        self.connection_warmer.keep_warm([(client.session, client.base_url)] if client is not None else [])
+
+    def apply_hedge_policy(self):
+        """Attach or detach the shared hedging policy on both clients"""
+        policy = self.hedge_policy if self.hedge_var.get() else None
+        for client in (self.perplexity_client, self.openai_client):
+            if client is not None:
+                client.hedge_policy = policy
+
     def run_test(self):
         selected_model = self.model_var.get()
         is_perplexity = selected_model in self.perplexity_models
@@ -642,241 +781,275 @@ class LLMPromptTesterGUI:
             messagebox.showerror("Error", "Please enter a prompt")
             return
 
-        self.test_button.configure(state="disabled")
-        self.progress_bar.set(0.5)
-        self.progress_bar.start()
+        # Snapshot the widgets here, on the main thread; workers only see the snapshot
+        config = self.capture_run_config()
+
+        if self.reuse_var.get() and self.offer_reuse(config):
+            return
+
+        # Long models always run as persistent jobs so closing the window loses nothing
+        if self.background_var.get() or self.job_manager.is_async(config):
+            job = self.job_manager.submit(config)
+            self.run_tree.insert("", 0, iid=self.job_iid(job), values=self.job_row_values(job))
+            self.update_run_controls()
+            return
 
-        thread = threading.Thread(target=self.execute_api_call, args=(prompt,))
-        thread.daemon = True
-        thread.start()
+        self.submit_run(config)
 
-    def execute_api_call(self, prompt: str):
+    def submit_run(self, config: RunConfig) -> Optional[RunRecord]:
+        """Queue a run, list it and follow its streamed fields; None if the queue is full"""
         try:
-            start_time = datetime.now()
-
-            # Prepare messages
-            system_prompt = self.system_prompt_text.get("1.0", tk.END).strip()
-            messages = []
-
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-
-            messages.append({"role": "user", "content": prompt})
-
-            # Determine which API to use
-            selected_model = self.model_var.get()
-            is_perplexity = selected_model in self.perplexity_models
-            is_openai = selected_model in self.openai_models
-
-            # Prepare response format (JSON only)
-            response_format = None
-            if self.use_json_var.get():
-                json_str = self.json_format_text.get("1.0", tk.END).strip()
-                if json_str and json_str != '{}':
-                    try:
-                        # Parse the JSON format configuration
-                        json_config = json.loads(json_str)
-                        # Pass the entire configuration as response_format
-                        response_format = json_config
-                    except json.JSONDecodeError:
-                        pass
-
-            # Get URL
-            url = self.url_entry.get().strip()
-            if not url:
-                url = None
-
-            # Prepare search domain filter
-            search_domain_filter = None
-            domain_filter_str = self.domain_filter_entry.get().strip()
-            if domain_filter_str:
-                domains = [d.strip() for d in domain_filter_str.split(',') if d.strip()]
-                if domains:
-                    search_domain_filter = domains[:3]  # Limit to 3 domains
-
-            # Get search recency filter
-            search_recency_filter = None
-            recency_value = self.recency_var.get()
-            if recency_value != "none":
-                search_recency_filter = recency_value
-
-            # Get date filters
-            search_after_date = self.after_date_entry.get().strip() or None
-            search_before_date = self.before_date_entry.get().strip() or None
-
-            # Get search context size
-            search_context_size = self.context_var.get()
-
-            # Get boolean options
-            return_images = self.return_images_var.get() or None
-            return_related_questions = self.return_questions_var.get() or None
-
-            # Get location
-            user_location = None
-            lat = self.latitude_entry.get().strip()
-            lon = self.longitude_entry.get().strip()
-            if lat and lon:
-                try:
-                    user_location = {
-                        "latitude": float(lat),
-                        "longitude": float(lon)
-                    }
-                    country = self.country_entry.get().strip()
-                    if country:
-                        user_location["country"] = country
-                except ValueError:
-                    pass
-
-            # Get LLM parameters
-            temperature = self.temperature_slider.get()
-
-            max_tokens = None
-            max_tokens_str = self.max_tokens_entry.get().strip()
-            if max_tokens_str:
-                try:
-                    max_tokens = int(max_tokens_str)
-                except ValueError:
-                    pass
+            record = self.run_queue.submit(config)
+        except QueueFullError as e:
+            messagebox.showerror("Error", str(e))
+            return None
+
+        self.run_tree.insert("", 0, iid=str(record.run_id), values=self.run_row_values(record))
+        self.streaming_run_id = record.run_id
+        self.streamed_fields = 0
+        self.update_run_controls()
+        return record
+
+    def toggle_watch(self):
+        """Start watching a prompt folder, or stop"""
+        if self.prompt_watcher is not None:
+            self.prompt_watcher.stop()
+            self.prompt_watcher = None
+            self.watch_button.configure(text="Watch Folder...")
+            return
 
-            top_p = None
-            top_p_str = self.top_p_entry.get().strip()
-            if top_p_str:
-                try:
-                    top_p = float(top_p_str)
-                except ValueError:
-                    pass
+        directory = filedialog.askdirectory(title="Re-run tests saved in this folder")
+        if not directory:
+            return
+        watcher = PromptWatcher([directory], self.on_prompt_changed)
+        try:
+            watcher.start()
+        except (RuntimeError, OSError) as e:
+            messagebox.showerror("Error", f"Cannot watch {directory}: {e}")
+            return
+        self.prompt_watcher = watcher
+        self.watch_button.configure(text=f"Stop Watching {os.path.basename(directory)}")
 
-            frequency_penalty = None
-            freq_penalty_str = self.freq_penalty_entry.get().strip()
-            if freq_penalty_str:
-                try:
-                    frequency_penalty = float(freq_penalty_str)
-                except ValueError:
-                    pass
+    def on_prompt_changed(self, path: str, config: RunConfig):
+        """Watcher callback; runs on the watcher thread, so hop to the main thread"""
+        self.root.after(0, self.run_watched, config)
 
-            presence_penalty = None
-            pres_penalty_str = self.pres_penalty_entry.get().strip()
-            if pres_penalty_str:
-                try:
-                    presence_penalty = float(pres_penalty_str)
-                except ValueError:
-                    pass
-
-            # Call appropriate API based on model selection
-            if is_perplexity:
-                response = self.perplexity_client.chat_completion(
-                    model=selected_model,
-                    messages=messages,
-                    response_format=response_format,
-                    url=url,
-                    search_domain_filter=search_domain_filter,
-                    search_recency_filter=search_recency_filter,
-                    search_after_date_filter=search_after_date,
-                    search_before_date_filter=search_before_date,
-                    search_context_size=search_context_size,
-                    return_images=return_images,
-                    return_related_questions=return_related_questions,
-                    user_location=user_location,
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    top_p=top_p,
-                    frequency_penalty=frequency_penalty,
-                    presence_penalty=presence_penalty,
-                    stream=False
-                )
-            elif is_openai:
-                # Check if it's a GPT-5 model
-                is_gpt5 = selected_model in ["gpt-5", "gpt-5-mini", "gpt-5-nano"]
-
-                # Prepare OpenAI-specific parameters
-                api_params = {
-                    "model": selected_model,
-                    "messages": messages,
-                    "stream": False
-                }
-
-                # Only add parameters supported by the model
-                if is_gpt5:
-                    # GPT-5 models have limited parameter support
-                    if max_tokens:
-                        api_params["max_tokens"] = max_tokens
-                else:
-                    # Other OpenAI models support all parameters
-                    api_params["temperature"] = temperature
-                    api_params["max_tokens"] = max_tokens
-                    api_params["top_p"] = top_p
-                    api_params["frequency_penalty"] = frequency_penalty
-                    api_params["presence_penalty"] = presence_penalty
-
-                # Add OpenAI-specific parameters
-                reasoning_effort = self.reasoning_effort_var.get()
-                if reasoning_effort and reasoning_effort != "medium":
-                    api_params["reasoning_effort"] = reasoning_effort
-
-                verbosity = self.verbosity_var.get()
-                if verbosity and verbosity != "medium":
-                    api_params["verbosity"] = verbosity
-
-                # Add seed if provided
-                seed_str = self.seed_entry.get().strip()
-                if seed_str:
-                    try:
-                        api_params["seed"] = int(seed_str)
-                    except ValueError:
-                        pass
-
-                # Add logprobs if enabled (not supported by GPT-5)
-                if not is_gpt5 and self.logprobs_var.get():
-                    api_params["logprobs"] = True
-                    top_logprobs_str = self.top_logprobs_entry.get().strip()
-                    if top_logprobs_str:
-                        try:
-                            api_params["top_logprobs"] = int(top_logprobs_str)
-                        except ValueError:
-                            pass
-
-                # Handle response format for OpenAI
-                if response_format:
-                    api_params["response_format"] = response_format
-
-                # Handle tools/function calling if enabled
-                if self.enable_tools_var.get():
-                    # For demonstration, we'll add a simple tool
-                    # In real usage, you'd want to allow users to define tools
-                    api_params["tools"] = [
-                        {
-                            "type": "function",
-                            "function": {
-                                "name": "example_function",
-                                "description": "An example function for testing",
-                                "parameters": {
-                                    "type": "object",
-                                    "properties": {},
-                                    "required": []
-                                }
-                            }
-                        }
-                    ]
-                    api_params["parallel_tool_calls"] = self.parallel_tools_var.get()
-
-                response = self.openai_client.chat_completion(**api_params)
-            else:
-                raise Exception(f"Unknown model provider for model: {selected_model}")
+    def run_watched(self, config: RunConfig):
+        """Re-run a saved test whose request changed, unless this exact request already ran"""
+        if self.prompt_watcher is None:
+            return
+        cached = self.watch_cache.get(config)
+        if cached is not None:
+            self.update_response(cached)
+            return
+        if self.job_manager.is_async(config):
+            job = self.job_manager.submit(config)
+            self.run_tree.insert("", 0, iid=self.job_iid(job), values=self.job_row_values(job))
+            self.update_run_controls()
+            return
+        record = self.submit_run(config)
+        if record is not None:
+            self.watched_runs.add(record.run_id)
 
-            end_time = datetime.now()
-            response_time = (end_time - start_time).total_seconds()
+    def offer_reuse(self, config: RunConfig) -> bool:
+        """
+        Offer an earlier result for a near-identical request with the same settings.
 
-            self.root.after(0, self.update_response, response, response_time)
+        Returns:
+            True if the run should not be sent (result reused or the user cancelled)
+        """
+        matches = self.similar_requests.query(config, same_params=True, limit=1)
+        if not matches:
+            return False
+
+        match = matches[0]
+        changes = word_differences(match.config.prompt, config.prompt)
+        detail = "Prompt changes: " + "; ".join(changes) if changes else "The prompt is the same."
+        answer = messagebox.askyesnocancel(
+            "Similar Request",
+            f"A request with the same settings and a {match.similarity:.0%} similar prompt "
+            f"already ran this session.\n\n{detail}\n\n"
+            "Yes: show that result without sending\nNo: send anyway\nCancel: do nothing")
+        if answer is None:
+            return True
+        if answer:
+            self.update_response(match.payload, add_to_history=False)
+            return True
+        return False
+
+    def open_sweep(self):
+        """Open a parameter sweep over the current inputs"""
+        config = self.capture_run_config()
+        if not self.router.clients.get(provider_for(config.model)):
+            messagebox.showerror("Error", f"Please configure the API key for {config.model} first")
+            return
+        if not config.prompt:
+            messagebox.showerror("Error", "Please enter a prompt")
+            return
 
-        except Exception as e:
-            self.root.after(0, self.show_error, str(e))
+        SweepWindow(self.root, self.run_queue.engine, config,
+                    on_open=lambda result: self.update_response(result, add_to_history=False))
+
+    def capture_run_config(self) -> RunConfig:
+        """Snapshot every input widget into an immutable RunConfig (main thread only)"""
+        return RunConfig(
+            model=self.model_var.get(),
+            prompt=self.prompt_text.get("1.0", tk.END).strip(),
+            system_prompt=self.system_prompt_text.get("1.0", tk.END).strip(),
+            url=self.url_entry.get().strip(),
+            domain_filter=self.domain_filter_entry.get().strip(),
+            recency_filter=self.recency_var.get(),
+            context_size=self.context_var.get(),
+            after_date=self.after_date_entry.get().strip(),
+            before_date=self.before_date_entry.get().strip(),
+            return_images=self.return_images_var.get(),
+            return_questions=self.return_questions_var.get(),
+            latitude=self.latitude_entry.get().strip(),
+            longitude=self.longitude_entry.get().strip(),
+            country=self.country_entry.get().strip(),
+            temperature=self.temperature_slider.get(),
+            max_tokens=self.max_tokens_entry.get().strip(),
+            auto_budget=self.auto_budget_var.get(),
+            top_p=self.top_p_entry.get().strip(),
+            frequency_penalty=self.freq_penalty_entry.get().strip(),
+            presence_penalty=self.pres_penalty_entry.get().strip(),
+            reasoning_effort=self.reasoning_effort_var.get(),
+            verbosity=self.verbosity_var.get(),
+            enable_tools=self.enable_tools_var.get(),
+            parallel_tools=self.parallel_tools_var.get(),
+            seed=self.seed_entry.get().strip(),
+            logprobs=self.logprobs_var.get(),
+            top_logprobs=self.top_logprobs_entry.get().strip(),
+            use_json=self.use_json_var.get(),
+            json_format=self.json_format_text.get("1.0", tk.END).strip(),
+            allow_fallback=self.fallback_var.get(),
+            resolve_locally=self.resolve_locally_var.get()
+        )
 
-    def update_response(self, response: Dict[str, Any], response_time: float):
+    def run_row_values(self, record: RunRecord):
+        elapsed = f"{record.elapsed:.1f}s" if record.started_at else ""
+        prompt = record.config.prompt.replace("\n", " ")
+        return (record.run_id, record.config.model, record.status, elapsed, prompt[:60])
+
+    def job_iid(self, job: Job) -> str:
+        return f"job-{job.job_id}"
+
+    def job_row_values(self, job: Job):
+        elapsed = f"{job.elapsed:.0f}s" if job.started_at else ""
+        prompt = job.config.prompt.replace("\n", " ")
+        return (f"J{job.job_id}", job.config.model, job.status, elapsed, prompt[:60])
+
+    def resume_jobs(self):
+        """List persisted jobs and deliver results that finished while the app was closed"""
+        for job in self.job_manager.resume():
+            if not self.run_tree.exists(self.job_iid(job)):
+                self.run_tree.insert("", 0, iid=self.job_iid(job), values=self.job_row_values(job))
+            self.deliver_job(job)
+        self.update_run_controls()
+
+    def deliver_job(self, job: Job):
+        """Add a finished job's result to history, once"""
+        if job.status == Job.DONE and job.result is not None and not job.delivered:
+            self.update_response(job.result)
+            self.job_manager.mark_delivered(job)
+
+    def on_job_update(self, job: Job):
+        """Job manager callback; runs on background threads, so hop to the main thread"""
+        # As for runs, pass the status this callback is for so a failure is reported once
+        self.root.after(0, self.refresh_job, job, job.status)
+
+    def refresh_job(self, job: Job, status: str):
+        iid = self.job_iid(job)
+        if self.run_tree.exists(iid):
+            self.run_tree.item(iid, values=self.job_row_values(job))
+
+        if status == Job.DONE:
+            self.deliver_job(job)
+        elif status == Job.FAILED:
+            self.show_error(f"Job J{job.job_id}: {job.error}")
+
+        self.update_run_controls()
+
+    def on_run_update(self, record: RunRecord):
+        """Run queue callback; runs on worker threads, so hop to the main thread"""
+        # Pass the status this callback is for: by the time the main loop gets to it the
+        # run may have moved on, and each finished run must be shown exactly once
+        self.root.after(0, self.refresh_run, record, record.status)
+
+    def on_run_field(self, record: RunRecord, name: str, value: Any):
+        """Run queue callback for a completed JSON field; runs on worker threads"""
+        self.root.after(0, self.show_run_field, record, name, value)
+
+    def show_run_field(self, record: RunRecord, name: str, value: Any):
+        """Fill in the latest run's JSON fields as they complete; the full response replaces them"""
+        if record.run_id != self.streaming_run_id or not record.active:
+            return
+        if not self.streamed_fields:
+            self.response_text.delete("1.0", tk.END)
+            self.validation_label.configure(text="JSON Valid: receiving fields...", text_color="gray")
+        self.streamed_fields += 1
+        self.response_text.insert(tk.END, f"{name}: {serialization.dumps(value)}\n")
+
+    def refresh_run(self, record: RunRecord, status: str):
+        iid = str(record.run_id)
+        if self.run_tree.exists(iid):
+            self.run_tree.item(iid, values=self.run_row_values(record))
+
+        if status == RunRecord.DONE:
+            if record.run_id in self.watched_runs:
+                self.watch_cache.put(record.result)
+            self.update_response(record.result)
+        elif status == RunRecord.FAILED:
+            self.show_error(record.error)
+
+        self.update_run_controls()
+
+    def update_run_controls(self):
+        """Keep the progress bar and Cancel button in step with the queue"""
+        if self.run_queue.active_count() or self.job_manager.active_count():
+            if not self.progress_running:
+                self.progress_bar.start()
+                self.progress_running = True
+            self.cancel_button.configure(state="normal")
+            if not self.run_tick_scheduled:
+                self.run_tick_scheduled = True
+                self.root.after(500, self.tick_running_runs)
+        else:
+            self.reset_run_controls()
+
+    def tick_running_runs(self):
+        """Refresh the elapsed time of running rows twice a second"""
+        self.run_tick_scheduled = False
+        for record in self.run_queue.records:
+            if record.status == RunRecord.RUNNING and self.run_tree.exists(str(record.run_id)):
+                self.run_tree.item(str(record.run_id), values=self.run_row_values(record))
+        for job in self.job_manager.jobs:
+            if job.status == Job.RUNNING and self.run_tree.exists(self.job_iid(job)):
+                self.run_tree.item(self.job_iid(job), values=self.job_row_values(job))
+        self.update_run_controls()
+
+    def on_run_selected(self, event=None):
+        """Show the result of the run picked in the run list"""
+        selection = self.run_tree.selection()
+        if not selection:
+            return
+        if selection[0].startswith("job-"):
+            record = self.job_manager.get(int(selection[0][len("job-"):]))
+        else:
+            record = self.run_queue.get(int(selection[0]))
+        if record is not None and record.result is not None:
+            self.update_response(record.result, add_to_history=False)
+
+    @profiled("update_response")
+    def update_response(self, result: RunResult, add_to_history: bool = True):
+        response = result.response
+        config = result.config
         self.current_response = response
+        self.current_result = result
 
         # Display raw response
         self.raw_response_text.delete("1.0", tk.END)
-        self.raw_response_text.insert("1.0", json.dumps(response, indent=2))
+        self.raw_response_text.insert("1.0", serialization.dumps(response, indent=True))
 
         # Process main response content
         if "choices" in response and len(response["choices"]) > 0:
@@ -904,8 +1077,8 @@ class LLMPromptTesterGUI:
             self.response_text.insert("1.0", display_text)
 
             # Validate JSON if applicable
-            if self.use_json_var.get():
-                self.validate_json_response(content)
+            if config.use_json:
+                self.validate_json_response(content, config.json_format)
 
         # Update usage statistics
         if "usage" in response:
@@ -920,36 +1093,55 @@ class LLMPromptTesterGUI:
 
             self.token_label.configure(text=tokens_info)
 
-        self.time_label.configure(text=f"Response Time: {response_time:.2f}s")
-
-        # Save to history with all parameters
-        self.test_history.append({
-            "timestamp": datetime.now().isoformat(),
-            "model": self.model_var.get(),
-            "prompt": self.prompt_text.get("1.0", tk.END).strip(),
-            "url": self.url_entry.get().strip(),
-            "domain_filter": self.domain_filter_entry.get().strip(),
-            "recency_filter": self.recency_var.get(),
-            "context_size": self.context_var.get(),
-            "response": response,
-            "response_time": response_time
-        })
-
-        self.progress_bar.stop()
-        self.progress_bar.set(0)
-        self.test_button.configure(state="normal")
-
-    def validate_json_response(self, content: str):
+        time_text = f"Response Time: {result.response_time:.2f}s"
+        if result.served_model != config.model:
+            time_text += f" (served by {result.served_model})"
+        if response.get("stream_aborted"):
+            time_text += f" | Aborted: {response['stream_aborted']}"
+        budget = response.get("token_budget")
+        if budget:
+            limit = f"max {budget['max_tokens']} tokens" if budget["max_tokens"] else f"{budget['verbosity']} verbosity"
+            time_text += f" | Budget: {limit}" + (", retried" if budget["retried"] else "")
+            if budget["latency_saved"] is not None:
+                time_text += f", ~{budget['latency_saved']:.2f}s saved"
+        self.time_label.configure(text=time_text)
+
+        if self.hedge_var.get():
+            report = self.hedge_policy.report()
+            self.hedge_label.configure(
+                text=f"Hedges: {report['hedges_issued']} issued, {report['hedges_won']} won")
+
+        # Save to history with all parameters, taken from the run's snapshot
+        if add_to_history:
+            self.test_history.append({
+                "timestamp": datetime.now().isoformat(),
+                "model": config.model,
+                "served_model": result.served_model,
+                "prompt": config.prompt,
+                "url": config.url,
+                "domain_filter": config.domain_filter,
+                "recency_filter": config.recency_filter,
+                "context_size": config.context_size,
+                "config": config.to_dict(),
+                "response": response,
+                "response_time": result.response_time,
+                "cost": result.cost
+            })
+            PROFILER.sample_memory("history", entries=len(self.test_history))
+            self.similar_requests.add(config, result)
+
+    def validate_json_response(self, content: str, expected_format: str = None):
         try:
-            json_response = json.loads(content)
+            json_response = serialization.loads(content)
             self.validation_label.configure(text="JSON Valid: ✓",
                                           text_color="green")
 
             # Also validate against expected format if provided
-            expected_format = self.json_format_text.get("1.0", tk.END).strip()
+            if expected_format is None:
+                expected_format = self.json_format_text.get("1.0", tk.END).strip()
             if expected_format and expected_format != '{}':
                 try:
-                    expected = json.loads(expected_format)
+                    expected = serialization.loads(expected_format)
                     # Simple structure validation - check if keys match
                     if isinstance(expected, dict) and isinstance(json_response, dict):
                         missing_keys = set(expected.keys()) - set(json_response.keys())
@@ -960,19 +1152,37 @@ class LLMPromptTesterGUI:
                         else:
                             self.validation_label.configure(text="JSON Valid: ✓ Structure matches",
                                                           text_color="green")
-                except json.JSONDecodeError:
+                except serialization.JSONDecodeError:
                     self.validation_label.configure(text="JSON Valid: ✓ (Invalid expected format)",
                                                   text_color="yellow")
 
-        except json.JSONDecodeError:
+        except serialization.JSONDecodeError:
             self.validation_label.configure(text="JSON Valid: ✗ - Response is not JSON",
                                           text_color="red")
 
     def show_error(self, error_message: str):
+        messagebox.showerror("API Error", error_message)
+
+    def reset_run_controls(self):
+        """Return the Cancel button and progress bar to their idle state"""
         self.progress_bar.stop()
         self.progress_bar.set(0)
-        self.test_button.configure(state="normal")
-        messagebox.showerror("API Error", error_message)
+        self.progress_running = False
+        self.cancel_button.configure(state="disabled")
+
+    def cancel_run(self):
+        """Abort the selected run or job, or every active run (not job) when none is selected"""
+        selection = self.run_tree.selection()
+        if selection and selection[0].startswith("job-"):
+            job = self.job_manager.get(int(selection[0][len("job-"):]))
+            if job is not None:
+                self.job_manager.cancel(job)
+            return
+        record = self.run_queue.get(int(selection[0])) if selection else None
+        if record is not None and record.active:
+            self.run_queue.cancel(record)
+        else:
+            self.run_queue.cancel_all()
 
     def clear_all(self):
         self.prompt_text.delete("1.0", tk.END)
@@ -990,139 +1200,212 @@ class LLMPromptTesterGUI:
 
         file_path = filedialog.asksaveasfilename(
             defaultextension=".json",
-            filetypes=[("JSON files", "*.json"), ("All files", "*.*")]
+            filetypes=[("JSON files", "*.json"), ("Compact tests", "*.ptz"), ("All files", "*.*")]
         )
 
         if file_path:
-            test_data = {
-                "model": self.model_var.get(),
-                "prompt": self.prompt_text.get("1.0", tk.END).strip(),
-                "system_prompt": self.system_prompt_text.get("1.0", tk.END).strip(),
-                "url": self.url_entry.get().strip(),
-                "search_params": {
-                    "domain_filter": self.domain_filter_entry.get().strip(),
-                    "recency_filter": self.recency_var.get(),
-                    "context_size": self.context_var.get(),
-                    "after_date": self.after_date_entry.get().strip(),
-                    "before_date": self.before_date_entry.get().strip(),
-                    "return_images": self.return_images_var.get(),
-                    "return_questions": self.return_questions_var.get()
-                },
-                "location": {
-                    "latitude": self.latitude_entry.get().strip(),
-                    "longitude": self.longitude_entry.get().strip(),
-                    "country": self.country_entry.get().strip()
-                },
-                "llm_params": {
-                    "temperature": self.temperature_slider.get(),
-                    "max_tokens": self.max_tokens_entry.get().strip(),
-                    "top_p": self.top_p_entry.get().strip(),
-                    "frequency_penalty": self.freq_penalty_entry.get().strip(),
-                    "presence_penalty": self.pres_penalty_entry.get().strip()
-                },
-                "use_json": self.use_json_var.get(),
-                "json_format": self.json_format_text.get("1.0", tk.END).strip(),
-                "response": self.current_response,
-                "timestamp": datetime.now().isoformat()
-            }
-
-            with open(file_path, 'w') as f:
-                json.dump(test_data, f, indent=2)
-
+            if not self.confirm_unique_test(file_path):
+                return
+            self.write_test(file_path)
             messagebox.showinfo("Success", f"Test saved to {file_path}")
 
+    def confirm_unique_test(self, file_path: str) -> bool:
+        """Warn when the folder already holds a near-duplicate of the test being saved"""
+        folder = os.path.dirname(file_path) or "."
+        matches = [m for m in find_similar_tests(self.current_result.config, [folder])
+                   if os.path.abspath(m.payload) != os.path.abspath(file_path)]
+        if not matches:
+            return True
+        lines = [f"{os.path.basename(m.payload)}: {m.similarity:.0%} similar"
+                 f"{', same settings' if m.same_params else ''}" for m in matches[:5]]
+        return messagebox.askyesno(
+            "Similar Test Exists",
+            "This folder already has tests with near-identical prompts:\n\n" + "\n".join(lines) +
+            "\n\nSave anyway?")
+
+    @profiled("save_test")
+    def write_test(self, file_path: str):
+        # Save the configuration that actually produced the displayed response
+        test_data = self.current_result.config.to_test_data()
+        test_data["response"] = self.current_response
+        test_data["timestamp"] = datetime.now().isoformat()
+
+        if file_path.endswith(compact_store.COMPACT_EXTENSION):
+            compact_store.save_compact(file_path, test_data)
+        else:
+            with open(file_path, 'wb') as f:
+                serialization.dump(test_data, f, indent=True)
+
     def load_test(self):
         file_path = filedialog.askopenfilename(
-            filetypes=[("JSON files", "*.json"), ("All files", "*.*")]
+            filetypes=[("Saved tests", "*.json *.ptz"), ("JSON files", "*.json"),
+                       ("Compact tests", "*.ptz"), ("All files", "*.*")]
         )
 
         if file_path:
             try:
-                with open(file_path, 'r') as f:
-                    test_data = json.load(f)
-
-                # Load basic settings
-                self.model_var.set(test_data.get("model", self.all_models[0]))
-                self.prompt_text.delete("1.0", tk.END)
-                self.prompt_text.insert("1.0", test_data.get("prompt", ""))
-                self.system_prompt_text.delete("1.0", tk.END)
-                self.system_prompt_text.insert("1.0", test_data.get("system_prompt", ""))
-                self.url_entry.delete(0, tk.END)
-                self.url_entry.insert(0, test_data.get("url", ""))
-
-                # Load search parameters
-                search_params = test_data.get("search_params", {})
-                self.domain_filter_entry.delete(0, tk.END)
-                self.domain_filter_entry.insert(0, search_params.get("domain_filter", ""))
-                self.recency_var.set(search_params.get("recency_filter", "none"))
-                self.context_var.set(search_params.get("context_size", "low"))
-                self.after_date_entry.delete(0, tk.END)
-                self.after_date_entry.insert(0, search_params.get("after_date", ""))
-                self.before_date_entry.delete(0, tk.END)
-                self.before_date_entry.insert(0, search_params.get("before_date", ""))
-                self.return_images_var.set(search_params.get("return_images", False))
-                self.return_questions_var.set(search_params.get("return_questions", False))
-
-                # Load location
-                location = test_data.get("location", {})
-                self.latitude_entry.delete(0, tk.END)
-                self.latitude_entry.insert(0, location.get("latitude", ""))
-                self.longitude_entry.delete(0, tk.END)
-                self.longitude_entry.insert(0, location.get("longitude", ""))
-                self.country_entry.delete(0, tk.END)
-                self.country_entry.insert(0, location.get("country", ""))
-
-                # Load LLM parameters
-                llm_params = test_data.get("llm_params", {})
-                if "temperature" in llm_params:
-                    self.temperature_slider.set(llm_params["temperature"])
-                self.max_tokens_entry.delete(0, tk.END)
-                self.max_tokens_entry.insert(0, llm_params.get("max_tokens", ""))
-                self.top_p_entry.delete(0, tk.END)
-                self.top_p_entry.insert(0, llm_params.get("top_p", ""))
-                self.freq_penalty_entry.delete(0, tk.END)
-                self.freq_penalty_entry.insert(0, llm_params.get("frequency_penalty", ""))
-                self.pres_penalty_entry.delete(0, tk.END)
-                self.pres_penalty_entry.insert(0, llm_params.get("presence_penalty", ""))
-
-                # Load JSON settings
-                self.use_json_var.set(test_data.get("use_json", False))
-
-                # Load JSON format (check both new and old field names for compatibility)
-                json_format = test_data.get("json_format") or test_data.get("expected_json", "")
-                if json_format:
-                    # Temporarily enable the text widget to insert the JSON format
-                    self.json_format_text.configure(state="normal")
-                    self.json_format_text.delete("1.0", tk.END)
-                    self.json_format_text.insert("1.0", json_format)
-
-                # Now set the proper state based on the checkbox
-                self.toggle_json_input()
-
-                # Trigger model change to update UI visibility, preserving JSON format
-                self.on_model_change(preserve_json_format=True)
-
+                self.read_test(file_path)
                 messagebox.showinfo("Success", "Test loaded successfully")
 
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to load test: {str(e)}")
 
+    @profiled("load_test")
+    def read_test(self, file_path: str):
+        # Handles both plain JSON and compact (.ptz) tests
+        test_data = compact_store.load(file_path)
+
+        # Load basic settings
+        self.model_var.set(test_data.get("model", self.all_models[0]))
+        self.prompt_text.delete("1.0", tk.END)
+        self.prompt_text.insert("1.0", test_data.get("prompt", ""))
+        self.system_prompt_text.delete("1.0", tk.END)
+        self.system_prompt_text.insert("1.0", test_data.get("system_prompt", ""))
+        self.url_entry.delete(0, tk.END)
+        self.url_entry.insert(0, test_data.get("url", ""))
+
+        # Load search parameters
+        search_params = test_data.get("search_params", {})
+        self.domain_filter_entry.delete(0, tk.END)
+        self.domain_filter_entry.insert(0, search_params.get("domain_filter", ""))
+        self.recency_var.set(search_params.get("recency_filter", "none"))
+        self.context_var.set(search_params.get("context_size", "low"))
+        self.after_date_entry.delete(0, tk.END)
+        self.after_date_entry.insert(0, search_params.get("after_date", ""))
+        self.before_date_entry.delete(0, tk.END)
+        self.before_date_entry.insert(0, search_params.get("before_date", ""))
+        self.return_images_var.set(search_params.get("return_images", False))
+        self.return_questions_var.set(search_params.get("return_questions", False))
+
+        # Load location
+        location = test_data.get("location", {})
+        self.latitude_entry.delete(0, tk.END)
+        self.latitude_entry.insert(0, location.get("latitude", ""))
+        self.longitude_entry.delete(0, tk.END)
+        self.longitude_entry.insert(0, location.get("longitude", ""))
+        self.country_entry.delete(0, tk.END)
+        self.country_entry.insert(0, location.get("country", ""))
+
+        # Load LLM parameters
+        llm_params = test_data.get("llm_params", {})
+        if "temperature" in llm_params:
+            self.temperature_slider.set(llm_params["temperature"])
+        self.max_tokens_entry.delete(0, tk.END)
+        self.max_tokens_entry.insert(0, llm_params.get("max_tokens", ""))
+        self.top_p_entry.delete(0, tk.END)
+        self.top_p_entry.insert(0, llm_params.get("top_p", ""))
+        self.freq_penalty_entry.delete(0, tk.END)
+        self.freq_penalty_entry.insert(0, llm_params.get("frequency_penalty", ""))
+        self.pres_penalty_entry.delete(0, tk.END)
+        self.pres_penalty_entry.insert(0, llm_params.get("presence_penalty", ""))
+
+        # Load OpenAI parameters (absent from tests saved by older versions)
+        openai_params = test_data.get("openai_params", {})
+        self.reasoning_effort_var.set(openai_params.get("reasoning_effort", "medium"))
+        self.verbosity_var.set(openai_params.get("verbosity", "medium"))
+        self.enable_tools_var.set(openai_params.get("enable_tools", False))
+        self.parallel_tools_var.set(openai_params.get("parallel_tools", True))
+        self.seed_entry.delete(0, tk.END)
+        self.seed_entry.insert(0, openai_params.get("seed", ""))
+        self.logprobs_var.set(openai_params.get("logprobs", False))
+        self.top_logprobs_entry.delete(0, tk.END)
+        self.top_logprobs_entry.insert(0, openai_params.get("top_logprobs", ""))
+
+        # Load JSON settings
+        self.use_json_var.set(test_data.get("use_json", False))
+
+        # Load JSON format (check both new and old field names for compatibility)
+        json_format = test_data.get("json_format") or test_data.get("expected_json", "")
+        if json_format:
+            # Temporarily enable the text widget to insert the JSON format
+            self.json_format_text.configure(state="normal")
+            self.json_format_text.delete("1.0", tk.END)
+            self.json_format_text.insert("1.0", json_format)
+
+        # Now set the proper state based on the checkbox
+        self.toggle_json_input()
+
+        # Trigger model change to update UI visibility, preserving JSON format
+        self.on_model_change(preserve_json_format=True)
+
     def export_results(self):
         if not self.test_history:
             messagebox.showwarning("Warning", "No test history to export")
             return
 
+        columnar_types = [(f"{name} columns", f"*{ext}") for name, ext in columnar_export.available_formats()]
         file_path = filedialog.asksaveasfilename(
             defaultextension=".json",
-            filetypes=[("JSON files", "*.json"), ("All files", "*.*")]
+            filetypes=[("JSON files", "*.json"), ("Compact export", "*.ptz")] + columnar_types + [("All files", "*.*")]
         )
 
         if file_path:
-            with open(file_path, 'w') as f:
-                json.dump(self.test_history, f, indent=2)
+            extension = os.path.splitext(file_path)[1].lower()
+            if extension == compact_store.COMPACT_EXTENSION:
+                compact_store.export_compact(file_path, self.test_history)
+            elif extension in columnar_export.FORMATS:
+                try:
+                    columnar_export.export_columnar(file_path, self.test_history)
+                except ImportError as e:
+                    messagebox.showerror("Error", str(e))
+                    return
+            else:
+                with open(file_path, 'wb') as f:
+                    serialization.dump(self.test_history, f, indent=True)
 
             messagebox.showinfo("Success", f"Results exported to {file_path}")
 
+    def toggle_profiling(self):
+        """Start or stop cProfile capture of the hot paths and tracemalloc sampling"""
+        if self.profile_var.get():
+            PROFILER.enable()
+            PROFILER.sample_memory("history", entries=len(self.test_history))
+        else:
+            PROFILER.disable()
+
+    def show_profile_report(self):
+        """Show the profiler's report in a window, with Save and Reset"""
+        window = ctk.CTkToplevel(self.root)
+        window.title("Profile Report")
+        window.geometry("1000x700")
+
+        report_text = ctk.CTkTextbox(window, font=("Courier", 12), wrap="none")
+        report_text.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        def refresh():
+            report_text.delete("1.0", tk.END)
+            report_text.insert("1.0", PROFILER.report())
+
+        def save():
+            file_path = filedialog.asksaveasfilename(
+                parent=window, defaultextension=".txt",
+                initialfile=f"profile-{datetime.now():%Y%m%d-%H%M%S}.txt",
+                filetypes=[("Text files", "*.txt"), ("All files", "*.*")]
+            )
+            if file_path:
+                written = PROFILER.dump(file_path)
+                messagebox.showinfo("Success", "Saved " + ", ".join(written), parent=window)
+
+        def reset():
+            PROFILER.reset()
+            refresh()
+
+        button_frame = ctk.CTkFrame(window)
+        button_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        for text, command in (("Refresh", refresh), ("Save...", save), ("Reset", reset)):
+            ctk.CTkButton(button_frame, text=text, command=command, width=100).pack(side=tk.LEFT, padx=5)
+
+        refresh()
+
+    def on_close(self):
+        if self.prompt_watcher is not None:
+            self.prompt_watcher.stop()
+        # Abort in-flight runs so their worker threads do not hold up interpreter exit
+        self.run_queue.shutdown()
+        # Submitted async jobs keep running remotely and are polled again on the next start
+        self.job_manager.shutdown()
+        self.root.destroy()
+
     def run(self):
         self.root.mainloop()
 
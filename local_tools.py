@@ -0,0 +1,395 @@
+import csv
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import serialization
+from request_control import CancelToken
+
+# Local property/tax/county dataset; create it with `python local_tools.py import ...`
+DEFAULT_PROPERTY_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "property_data.sqlite3")
+PROPERTY_DB_ENV_VAR = "PROMPT_TESTER_PROPERTY_DB"
+
+# Threads shared by every parallel tool round
+TOOL_WORKERS = 8
+
+# Rows returned by list-style tools; keeps tool output (and prompt tokens) small
+MAX_ROWS = 25
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS counties (
+    city TEXT NOT NULL,
+    state TEXT NOT NULL,
+    county TEXT NOT NULL,
+    PRIMARY KEY (city, state)
+);
+CREATE TABLE IF NOT EXISTS properties (
+    address_key TEXT PRIMARY KEY,
+    address TEXT NOT NULL,
+    city TEXT,
+    state TEXT,
+    zip TEXT,
+    county TEXT,
+    neighborhood TEXT,
+    property_type TEXT,
+    year_built INTEGER,
+    living_area_sqft INTEGER,
+    bedrooms INTEGER,
+    bathrooms REAL,
+    assessed_value REAL
+);
+CREATE TABLE IF NOT EXISTS property_taxes (
+    address_key TEXT NOT NULL,
+    tax_year INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (address_key, tax_year)
+);
+CREATE TABLE IF NOT EXISTS sales (
+    address_key TEXT NOT NULL,
+    address TEXT NOT NULL,
+    sale_date TEXT NOT NULL,
+    price REAL NOT NULL,
+    property_type TEXT,
+    neighborhood TEXT,
+    city TEXT,
+    zip TEXT
+);
+CREATE TABLE IF NOT EXISTS zip_counties (
+    zip TEXT PRIMARY KEY,
+    county TEXT NOT NULL,
+    state TEXT
+);
+CREATE TABLE IF NOT EXISTS address_points (
+    address_key TEXT PRIMARY KEY,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS neighborhoods (
+    name TEXT NOT NULL,
+    city TEXT,
+    state TEXT,
+    geometry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sales_by_address ON sales (address_key, sale_date);
+CREATE INDEX IF NOT EXISTS sales_by_neighborhood ON sales (neighborhood, sale_date);
+CREATE INDEX IF NOT EXISTS sales_by_zip ON sales (zip, sale_date);
+"""
+
+# Tables that key rows by address; import fills address_key from the address column
+ADDRESS_TABLES = ("properties", "property_taxes", "sales", "address_points")
+
+_STREET_SUFFIXES = {
+    "STREET": "ST", "AVENUE": "AVE", "ROAD": "RD", "DRIVE": "DR", "LANE": "LN", "BOULEVARD": "BLVD",
+    "COURT": "CT", "PLACE": "PL", "TERRACE": "TER", "PARKWAY": "PKWY", "CIRCLE": "CIR", "HIGHWAY": "HWY",
+    "EAST": "E", "WEST": "W", "NORTH": "N", "SOUTH": "S",
+}
+
+
+def address_key(address: str) -> str:
+    """
+    Normalize the street part of an address for lookups.
+
+    "6603 Gertrude Avenue, Cleveland, OH 44105" and "6603 gertrude ave." both
+    become "6603 GERTRUDE AVE".
+    """
+    street = address.split(",")[0].upper()
+    words = re.findall(r"[A-Z0-9]+", street)
+    return " ".join(_STREET_SUFFIXES.get(word, word) for word in words)
+
+
+class Tool:
+    """
+    A function the model may call.
+
+    Attributes:
+        name: Function name shown to the model
+        description: When the model should use it
+        parameters: JSON schema of the arguments object
+        func: Called with the parsed arguments as keyword arguments; returns a
+            JSON-serializable value
+    """
+
+    def __init__(self, name: str, description: str, parameters: Dict[str, Any], func: Callable[..., Any]):
+        self.name = name
+        self.description = description
+        self.parameters = parameters
+        self.func = func
+
+    def spec(self) -> Dict[str, Any]:
+        """The tool definition sent in the request's tools list"""
+        return {
+            "type": "function",
+            "function": {"name": self.name, "description": self.description, "parameters": self.parameters},
+        }
+
+
+class ToolRegistry:
+    """
+    Named local tools and the thread pool that runs them.
+
+    Tool failures are returned to the model as {"error": ...} rather than
+    raised, so it can correct its arguments or answer without the tool.
+    """
+
+    def __init__(self, max_workers: int = TOOL_WORKERS):
+        self.tools: Dict[str, Tool] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+
+    def __len__(self) -> int:
+        return len(self.tools)
+
+    def register(self, tool: Tool) -> Tool:
+        self.tools[tool.name] = tool
+        return tool
+
+    def specs(self) -> List[Dict[str, Any]]:
+        return [tool.spec() for tool in self.tools.values()]
+
+    def call(self, name: str, arguments: str) -> Any:
+        """Run one tool with its JSON-encoded arguments"""
+        tool = self.tools.get(name)
+        if tool is None:
+            return {"error": f"Unknown tool: {name}"}
+        try:
+            kwargs = serialization.loads(arguments) if arguments else {}
+        except serialization.JSONDecodeError as e:
+            return {"error": f"Arguments are not valid JSON: {e}"}
+        if not isinstance(kwargs, dict):
+            return {"error": "Arguments must be a JSON object"}
+        try:
+            return tool.func(**kwargs)
+        except TypeError as e:
+            return {"error": f"Bad arguments for {name}: {e}"}
+        except (sqlite3.Error, ValueError) as e:
+            return {"error": str(e)}
+
+    def execute(
+        self,
+        tool_calls: List[Dict[str, Any]],
+        parallel: bool = True,
+        cancel_token: Optional[CancelToken] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Run the tool calls of one assistant message.
+
+        Args:
+            tool_calls: The message's tool_calls
+            parallel: Run the calls concurrently on the pool instead of in order
+            cancel_token: Checked before the round starts
+
+        Returns:
+            One tool message per call, in tool_calls order. Each carries a
+            "trace" entry (name, arguments, result, seconds) that the caller
+            removes before sending the messages back.
+        """
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+
+        def run(call: Dict[str, Any]) -> Dict[str, Any]:
+            function = call.get("function") or {}
+            name, arguments = function.get("name", ""), function.get("arguments", "")
+            start = time.perf_counter()
+            result = self.call(name, arguments)
+            return {
+                "role": "tool",
+                "tool_call_id": call.get("id"),
+                "content": serialization.dumps(result),
+                "trace": {"name": name, "arguments": arguments, "result": result,
+                          "seconds": time.perf_counter() - start},
+            }
+
+        if parallel and len(tool_calls) > 1:
+            return list(self._executor.map(run, tool_calls))
+        return [run(call) for call in tool_calls]
+
+
+class PropertyDataset:
+    """
+    Read-only access to the local property/tax/county SQLite dataset.
+
+    Each thread gets its own connection, so parallel tool calls never share one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def rows(self, sql: str, params: tuple = ()) -> List[Dict[str, Any]]:
+        return [dict(row) for row in self._conn().execute(sql, params).fetchall()]
+
+    def lookup_county(self, city: str, state: str) -> Dict[str, Any]:
+        rows = self.rows("SELECT city, state, county FROM counties WHERE city = ? COLLATE NOCASE "
+                          "AND state = ? COLLATE NOCASE", (city.strip(), state.strip()))
+        return rows[0] if rows else {"error": f"No county on record for {city}, {state}"}
+
+    def lookup_property(self, address: str) -> Dict[str, Any]:
+        rows = self.rows("SELECT * FROM properties WHERE address_key = ?", (address_key(address),))
+        if not rows:
+            return {"error": f"No property on record for {address}"}
+        row = rows[0]
+        row.pop("address_key")
+        return row
+
+    def property_tax_history(self, address: str) -> Dict[str, Any]:
+        rows = self.rows("SELECT tax_year, amount FROM property_taxes WHERE address_key = ? "
+                          "ORDER BY tax_year DESC LIMIT ?", (address_key(address), MAX_ROWS))
+        if not rows:
+            return {"error": f"No tax records for {address}"}
+        return {"address": address, "taxes": rows}
+
+    def sale_history(self, address: str) -> Dict[str, Any]:
+        rows = self.rows("SELECT sale_date, price FROM sales WHERE address_key = ? "
+                          "ORDER BY sale_date DESC LIMIT ?", (address_key(address), MAX_ROWS))
+        if not rows:
+            return {"error": f"No sales on record for {address}"}
+        return {"address": address, "sales": rows}
+
+    def recent_sales(self, neighborhood: str = "", zip: str = "", property_type: str = "",
+                     since: str = "") -> Dict[str, Any]:
+        if not neighborhood and not zip:
+            raise ValueError("Give a neighborhood or a zip")
+        sql = "SELECT address, sale_date, price, property_type, neighborhood, zip FROM sales WHERE 1 = 1"
+        params: List[Any] = []
+        if neighborhood:
+            sql += " AND neighborhood = ? COLLATE NOCASE"
+            params.append(neighborhood)
+        if zip:
+            sql += " AND zip = ?"
+            params.append(zip)
+        if property_type:
+            sql += " AND property_type = ? COLLATE NOCASE"
+            params.append(property_type)
+        if since:
+            sql += " AND sale_date >= ?"
+            params.append(since)
+        sql += " ORDER BY sale_date DESC LIMIT ?"
+        params.append(MAX_ROWS)
+        return {"sales": self.rows(sql, tuple(params))}
+
+
+def _address_parameters(description: str) -> Dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {"address": {"type": "string", "description": description}},
+        "required": ["address"],
+    }
+
+
+def property_tools(dataset: PropertyDataset, registry: Optional[ToolRegistry] = None) -> ToolRegistry:
+    """Register lookups against dataset"""
+    registry = registry or ToolRegistry()
+    registry.register(Tool(
+        "lookup_county", "County a US city is in, from local records. Prefer this to a web search.",
+        {"type": "object",
+         "properties": {"city": {"type": "string"},
+                        "state": {"type": "string", "description": "Two-letter state code"}},
+         "required": ["city", "state"]},
+        dataset.lookup_county))
+    registry.register(Tool(
+        "lookup_property",
+        "Local record for a property: county, neighborhood, type, year built, size, rooms, assessed value.",
+        _address_parameters("Street address, e.g. 6603 Gertrude Ave, Cleveland, OH 44105"),
+        dataset.lookup_property))
+    registry.register(Tool(
+        "property_tax_history", "Property tax billed per tax year for an address, newest first.",
+        _address_parameters("Street address"), dataset.property_tax_history))
+    registry.register(Tool(
+        "sale_history", "Recorded sale dates and prices for an address, newest first.",
+        _address_parameters("Street address"), dataset.sale_history))
+    registry.register(Tool(
+        "recent_sales",
+        f"Up to {MAX_ROWS} most recent recorded sales in a neighborhood or zip code, for comparables.",
+        {"type": "object",
+         "properties": {
+             "neighborhood": {"type": "string"},
+             "zip": {"type": "string"},
+             "property_type": {"type": "string", "description": "e.g. single family, multifamily"},
+             "since": {"type": "string", "description": "Earliest sale date, YYYY-MM-DD"},
+         }},
+        dataset.recent_sales))
+    return registry
+
+
+def default_tools() -> ToolRegistry:
+    """
+    Tools over the local dataset at PROMPT_TESTER_PROPERTY_DB (or DEFAULT_PROPERTY_DB).
+
+    The registry is empty when the dataset does not exist, so no tools are offered.
+    """
+    path = os.getenv(PROPERTY_DB_ENV_VAR) or DEFAULT_PROPERTY_DB
+    if not os.path.exists(path):
+        return ToolRegistry()
+    return property_tools(PropertyDataset(path))
+
+
+def import_csv(db_path: str, table: str, csv_path: str) -> int:
+    """
+    Load a CSV whose header names the table's columns into the dataset.
+
+    Returns:
+        Rows imported
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(SCHEMA)
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if not columns:
+            raise ValueError(f"Unknown table {table}")
+        with open(csv_path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        if table in ADDRESS_TABLES:
+            for row in rows:
+                row["address_key"] = address_key(row.get("address") or row.get("address_key", ""))
+            if "address" not in columns:
+                for row in rows:
+                    row.pop("address", None)
+        names = [name for name in (rows[0] if rows else {}) if name in columns]
+        with conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+                ([row[name] if row[name] != "" else None for name in names] for row in rows))
+        return len(rows)
+    finally:
+        conn.close()
+
+
+def main(argv: List[str]) -> int:
+    """
+    local_tools.py import TABLE FILE.csv [--db PATH]
+    local_tools.py call TOOL '{"arg": "value"}' [--db PATH]
+    """
+    db_path = os.getenv(PROPERTY_DB_ENV_VAR) or DEFAULT_PROPERTY_DB
+    if "--db" in argv:
+        index = argv.index("--db")
+        db_path = argv[index + 1]
+        argv = argv[:index] + argv[index + 2:]
+
+    if len(argv) == 3 and argv[0] == "import":
+        count = import_csv(db_path, argv[1], argv[2])
+        print(f"Imported {count} rows into {argv[1]} ({db_path})")
+        return 0
+    if len(argv) in (2, 3) and argv[0] == "call":
+        registry = property_tools(PropertyDataset(db_path))
+        print(serialization.dumps(registry.call(argv[1], argv[2] if len(argv) == 3 else ""), indent=True))
+        return 0
+
+    print("usage: python local_tools.py import TABLE FILE.csv [--db PATH]\n"
+          "       python local_tools.py call TOOL '{\"arg\": \"value\"}' [--db PATH]")
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
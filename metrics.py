@@ -0,0 +1,292 @@
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Set to a port number to serve /metrics from the GUI
+METRICS_PORT_ENV_VAR = "PROMPT_TESTER_METRICS_PORT"
+
+# Seconds; spans a fast sonar call to a deep-research run
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Monotonic count per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Dict[LabelValues, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def expose(self) -> List[str]:
+        items = sorted(self.samples().items())
+        return self.header() + [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                                for key, value in items]
+
+
+class Gauge(Counter):
+    """Value that goes up and down per label set."""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum]
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def expose(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    The metrics a process exposes.
+
+    Recording is a dict update under a per-metric lock, so metrics stay on all the
+    time; text is only rendered when /metrics is scraped. Callback gauges are
+    evaluated at scrape time for values that are cheaper to read than to track.
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._callbacks: List[Tuple[str, str, Callable[[], Dict[LabelValues, float]], Tuple[str, ...]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Iterable[str] = (),
+                  buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def gauge_callback(self, name: str, help_text: str, labels: Iterable[str],
+                       callback: Callable[[], Dict[LabelValues, float]]):
+        """Expose a gauge whose samples (label values -> value) are read from callback when scraped"""
+        with self._lock:
+            self._callbacks.append((name, help_text, callback, tuple(labels)))
+
+    def expose(self) -> str:
+        """Render every metric in the Prometheus text format (version 0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics)
+            callbacks = list(self._callbacks)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        for name, help_text, callback, label_names in callbacks:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            for key, value in sorted(callback().items()):
+                lines.append(f"{name}{_format_labels(label_names, key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter("llm_requests_total", "Chat completion calls by outcome (ok, error or aborted)",
+                            ("provider", "model", "outcome"))
+REQUEST_ERRORS = REGISTRY.counter("llm_request_errors_total", "Failed chat completion calls by HTTP status or error type",
+                                  ("provider", "model", "code"))
+RATE_LIMITED = REGISTRY.counter("llm_rate_limited_total", "HTTP 429 responses, including ones that were retried",
+                                ("provider", "model"))
+REQUEST_LATENCY = REGISTRY.histogram("llm_request_duration_seconds", "Chat completion latency",
+                                     ("provider", "model"))
+TOKENS = REGISTRY.counter("llm_tokens_total", "Tokens reported in usage", ("provider", "model", "kind"))
+COST = REGISTRY.counter("llm_cost_usd_total", "Cost reported in usage (or estimated for OpenAI)",
+                        ("provider", "model"))
+HTTP_IN_FLIGHT = REGISTRY.gauge("llm_http_in_flight", "HTTP requests currently awaiting a response")
+RUN_QUEUE = REGISTRY.gauge("run_queue_runs", "Runs in the run queues by status", ("status",))
+CACHE_LOOKUPS = REGISTRY.counter("cache_lookups_total", "Cache lookups by result (hit or miss)", ("cache", "result"))
+SCHEDULER_WAIT = REGISTRY.histogram("scheduler_wait_seconds", "Time calls spent queued for a provider slot",
+                                    ("provider", "priority"))
+TOKEN_BUDGETS = REGISTRY.counter("token_budget_runs_total",
+                                 "Runs sent with a schema-derived max_tokens, by outcome (fit or retried)",
+                                 ("model", "outcome"))
+PROXY_REQUESTS = REGISTRY.counter("proxy_requests_total",
+                                  "Caching proxy requests by how they were served (hit, coalesced, miss or passthrough)",
+                                  ("provider", "result"))
+
+
+def _cache_hit_ratios() -> Dict[LabelValues, float]:
+    totals: Dict[str, List[float]] = {}
+    for (cache, result), count in CACHE_LOOKUPS.samples().items():
+        hits_total = totals.setdefault(cache, [0.0, 0.0])
+        hits_total[1] += count
+        if result == "hit":
+            hits_total[0] += count
+    return {(cache,): hits / total for cache, (hits, total) in totals.items() if total}
+
+
+REGISTRY.gauge_callback("cache_hit_ratio", "Share of cache lookups that hit", ("cache",), _cache_hit_ratios)
+
+
+def provider_of(model: str) -> str:
+    # Imported here: routing imports request_control, which records metrics
+    from routing import provider_for
+    return provider_for(model)
+
+
+def record_request(model: str, latency: float, error: Optional[BaseException] = None):
+    """Count one chat completion call and, unless it failed, its latency"""
+    provider = provider_of(model)
+    if error is None:
+        REQUESTS.inc(provider=provider, model=model, outcome="ok")
+        REQUEST_LATENCY.observe(latency, provider=provider, model=model)
+        return
+    code = getattr(error, "status_code", None) or type(error).__name__
+    REQUESTS.inc(provider=provider, model=model, outcome="error")
+    REQUEST_ERRORS.inc(provider=provider, model=model, code=code)
+
+
+def record_aborted(model: str):
+    """Count a streamed call the caller dropped for leaving its schema; the provider did not fail"""
+    REQUESTS.inc(provider=provider_of(model), model=model, outcome="aborted")
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def record_budget(model: str, retried: bool):
+    TOKEN_BUDGETS.inc(model=model, outcome="retried" if retried else "fit")
+
+
+def record_usage(model: str, usage: Dict, cost: Optional[float]):
+    """Count a response's tokens and cost"""
+    provider = provider_of(model)
+    TOKENS.inc(usage.get("prompt_tokens", 0) or 0, provider=provider, model=model, kind="prompt")
+    TOKENS.inc(usage.get("completion_tokens", 0) or 0, provider=provider, model=model, kind="completion")
+    if cost is not None:
+        COST.inc(cost, provider=provider, model=model)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.expose().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serve REGISTRY at http://host:port/metrics from a daemon thread.
+
+    Binds to localhost by default; the metrics include model names and spend.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    return server
+
+
+def start_from_env() -> Optional[ThreadingHTTPServer]:
+    """Start the server if METRICS_PORT_ENV_VAR is set"""
+    port = os.getenv(METRICS_PORT_ENV_VAR)
+    if not port:
+        return None
+    return start_server(int(port))
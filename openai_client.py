@@ -1,6 +1,15 @@
+import os
 import requests
-from typing import Dict, Any, Optional, List, Union
-import json
+from typing import Callable, Dict, Any, Optional, List, Union
+import serialization
+from request_control import (APIRequestError, CancelToken, Deadline, Timeouts, create_session, post_json,
+                             read_event_stream, timeouts_for)
+from hedging import HedgePolicy, HedgeSlot, send_hedged
+from tracing import TRACER
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+# Points the client elsewhere, e.g. at a shared caching_proxy.py
+BASE_URL_ENV_VAR = "OPENAI_BASE_URL"
 
 
 class OpenAIClient:
@@ -9,19 +18,25 @@ class OpenAIClient:
     Supports text generation and structured outputs with JSON schemas.
     """
 
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, http2: bool = False, base_url: Optional[str] = None):
         """
         Initialize the OpenAI client.
 
         Args:
             api_key: Your OpenAI API key
+            http2: Send requests over HTTP/2, multiplexing concurrent calls
+                   over a few connections (needs httpx and h2)
+            base_url: API root; defaults to $OPENAI_BASE_URL, then DEFAULT_BASE_URL
         """
         self.api_key = api_key
-        self.base_url = "https://api.openai.com/v1"
+        self.base_url = (base_url or os.getenv(BASE_URL_ENV_VAR) or DEFAULT_BASE_URL).rstrip("/")
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
+        self.session = create_session(self.headers, http2=http2)
+        # Optional HedgePolicy; when set, slow requests are duplicated and the first answer wins
+        self.hedge_policy: Optional[HedgePolicy] = None
 
         # Model information for GPT-5 family
         self.models = {
@@ -78,7 +93,13 @@ class OpenAIClient:
         user: Optional[str] = None,
         logit_bias: Optional[Dict[str, int]] = None,
         logprobs: Optional[bool] = None,
-        top_logprobs: Optional[int] = None
+        top_logprobs: Optional[int] = None,
+        # Request control
+        timeouts: Optional[Timeouts] = None,
+        deadline: Optional[Deadline] = None,
+        cancel_token: Optional[CancelToken] = None,
+        on_delta: Optional[Callable[[str], None]] = None,
+        hedge_slot: Optional[HedgeSlot] = None
     ) -> Dict[str, Any]:
         """
         Send a chat completion request to OpenAI API.
@@ -94,7 +115,7 @@ class OpenAIClient:
             presence_penalty: Reduce repetition of topics (-2 to 2)
             stop: Stop sequence(s) to end generation
             n: Number of completions to generate
-            stream: Whether to stream the response
+            stream: Whether to stream the response; the result is still one complete response
             reasoning_effort: GPT-5 specific - control reasoning depth
             verbosity: GPT-5 specific - control response detail level
             response_format: JSON schema for structured outputs
@@ -106,6 +127,11 @@ class OpenAIClient:
             logit_bias: Modify likelihood of specific tokens
             logprobs: Return log probabilities of output tokens
             top_logprobs: Number of most likely tokens to return
+            timeouts: Override the model's default connect/read/total timeouts
+            deadline: Overall deadline shared by all retries of this call
+            cancel_token: Token that aborts the in-flight request when cancelled
+            on_delta: With stream, called with each content fragment as it arrives
+            hedge_slot: Limiter capacity a hedge must take before it is sent
 
         Returns:
             API response as a dictionary
@@ -121,6 +147,9 @@ class OpenAIClient:
             "messages": messages,
             "stream": stream
         }
+        if stream:
+            # Usage only arrives in a final chunk when asked for
+            payload["stream_options"] = {"include_usage": True}
 
         # Add standard parameters if provided (but skip unsupported ones for GPT-5)
         if temperature is not None:
@@ -224,25 +253,37 @@ class OpenAIClient:
 
         # Note: logit_bias, logprobs, and top_logprobs are handled above based on model type
 
+        # The primary request and any hedge share one deadline
+        if deadline is None:
+            deadline = Deadline((timeouts or timeouts_for(model)).total)
+
         # Make the API request
         try:
-            response = requests.post(endpoint, json=payload, headers=self.headers)
+            response = send_hedged(
+                self.hedge_policy if not stream else None, model, cancel_token,
+                lambda token: post_json(self.session, endpoint, payload, model, timeouts=timeouts,
+                                        deadline=deadline, cancel_token=token, stream=stream),
+                hedge_slot
+            )
             response.raise_for_status()
-            return response.json()
+            if stream:
+                return read_event_stream(response, on_delta or (lambda text: None), cancel_token, deadline)
+            with TRACER.span("decode response", "serialization", bytes=len(response.content)):
+                return serialization.loads(response.content)
         except requests.exceptions.HTTPError as e:
             # Handle API errors with detailed information
             error_message = f"OpenAI API request failed with status {e.response.status_code}"
             try:
-                error_data = e.response.json()
+                error_data = serialization.loads(e.response.content)
                 if "error" in error_data:
                     error_message += f": {error_data['error'].get('message', 'Unknown error')}"
                     error_type = error_data['error'].get('type', 'unknown')
                     error_message += f" (Type: {error_type})"
             except:
                 error_message += f": {e.response.text}"
-            raise Exception(error_message)
+            raise APIRequestError(error_message, e.response.status_code)
         except requests.exceptions.RequestException as e:
-            raise Exception(f"Network error during API request: {str(e)}")
+            raise APIRequestError(f"Network error during API request: {str(e)}")
 
     def create_structured_output(
         self,
@@ -362,8 +403,8 @@ class OpenAIClient:
 
             # Try to parse as JSON
             try:
-                return json.loads(content)
-            except json.JSONDecodeError:
+                return serialization.loads(content)
+            except serialization.JSONDecodeError:
                 # If not JSON, return as-is
                 return {"content": content}
 
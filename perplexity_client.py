@@ -1,16 +1,36 @@
+import os
 import requests
-from typing import Dict, Any, Optional, List
+from typing import Callable, Dict, Any, Optional, List
+from request_control import (APIRequestError, CancelToken, Deadline, Timeouts, create_session, get_json,
+                             post_json, read_event_stream, timeouts_for)
+from hedging import HedgePolicy, HedgeSlot, send_hedged
+from tracing import TRACER
+import serialization
+
+# Models the async API accepts; their jobs outlive the app and are polled for results
+ASYNC_MODELS = ["sonar-deep-research"]
+
+# Submitting or polling an async job is quick even when the job itself is not
+ASYNC_REQUEST_TIMEOUTS = Timeouts(connect=10.0, read=30.0, total=60.0)
+
+DEFAULT_BASE_URL = "https://api.perplexity.ai"
+# Points the client elsewhere, e.g. at a shared caching_proxy.py
+BASE_URL_ENV_VAR = "PERPLEXITY_BASE_URL"
 
 
 class PerplexityAPIClient:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, http2: bool = False, base_url: Optional[str] = None):
         self.api_key = api_key
-        self.base_url = "https://api.perplexity.ai"
+        self.base_url = (base_url or os.getenv(BASE_URL_ENV_VAR) or DEFAULT_BASE_URL).rstrip("/")
         self.headers = {
             "accept": "application/json",
             "content-type": "application/json",
             "Authorization": f"Bearer {api_key}"
         }
+        # http2 multiplexes concurrent calls over a few connections (needs httpx and h2)
+        self.session = create_session(self.headers, http2=http2)
+        # Optional HedgePolicy; when set, slow requests are duplicated and the first answer wins
+        self.hedge_policy: Optional[HedgePolicy] = None
 
     def chat_completion(
         self,
@@ -31,7 +51,12 @@ class PerplexityAPIClient:
         top_p: Optional[float] = None,
         frequency_penalty: Optional[float] = None,
         presence_penalty: Optional[float] = None,
-        stream: bool = False
+        stream: bool = False,
+        timeouts: Optional[Timeouts] = None,
+        deadline: Optional[Deadline] = None,
+        cancel_token: Optional[CancelToken] = None,
+        on_delta: Optional[Callable[[str], None]] = None,
+        hedge_slot: Optional[HedgeSlot] = None
     ) -> Dict[str, Any]:
         """
         Send a chat completion request to Perplexity Grounded LLM API.
@@ -54,13 +79,75 @@ class PerplexityAPIClient:
             top_p: Nucleus sampling parameter
             frequency_penalty: Frequency penalty (-2 to 2)
             presence_penalty: Presence penalty (-2 to 2)
-            stream: Whether to stream the response
+            stream: Whether to stream the response; the result is still one complete response
+            timeouts: Override the model's default connect/read/total timeouts
+            deadline: Overall deadline shared by all retries of this call
+            cancel_token: Token that aborts the in-flight request when cancelled
+            on_delta: With stream, called with each content fragment as it arrives
+            hedge_slot: Limiter capacity a hedge must take before it is sent
 
         Returns:
             API response as a dictionary
         """
         endpoint = f"{self.base_url}/chat/completions"
 
+        payload = self.build_payload(
+            model, messages, response_format=response_format, url=url,
+            search_domain_filter=search_domain_filter, search_recency_filter=search_recency_filter,
+            search_after_date_filter=search_after_date_filter,
+            search_before_date_filter=search_before_date_filter,
+            search_context_size=search_context_size, return_images=return_images,
+            return_related_questions=return_related_questions, user_location=user_location,
+            temperature=temperature, max_tokens=max_tokens, top_p=top_p,
+            frequency_penalty=frequency_penalty, presence_penalty=presence_penalty, stream=stream
+        )
+
+        # The primary request and any hedge share one deadline
+        if deadline is None:
+            deadline = Deadline((timeouts or timeouts_for(model)).total)
+
+        try:
+            response = send_hedged(
+                self.hedge_policy if not stream else None, model, cancel_token,
+                lambda token: post_json(self.session, endpoint, payload, model, timeouts=timeouts,
+                                        deadline=deadline, cancel_token=token, stream=stream),
+                hedge_slot
+            )
+            response.raise_for_status()
+            if stream:
+                return read_event_stream(response, on_delta or (lambda text: None), cancel_token, deadline)
+            with TRACER.span("decode response", "serialization", bytes=len(response.content)):
+                return serialization.loads(response.content)
+        except requests.exceptions.RequestException as e:
+            raise self._request_failed(e)
+
+    def build_payload(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        response_format: Optional[Dict] = None,
+        url: Optional[str] = None,
+        search_domain_filter: Optional[List[str]] = None,
+        search_recency_filter: Optional[str] = None,
+        search_after_date_filter: Optional[str] = None,
+        search_before_date_filter: Optional[str] = None,
+        search_context_size: Optional[str] = None,
+        return_images: Optional[bool] = None,
+        return_related_questions: Optional[bool] = None,
+        user_location: Optional[Dict[str, Any]] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        top_p: Optional[float] = None,
+        frequency_penalty: Optional[float] = None,
+        presence_penalty: Optional[float] = None,
+        stream: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Build the chat completion request body; arguments are as for chat_completion.
+
+        Returns:
+            The JSON payload
+        """
         payload = {
             "model": model,
             "messages": messages,
@@ -127,9 +214,44 @@ class PerplexityAPIClient:
         if presence_penalty is not None:
             payload["presence_penalty"] = presence_penalty
 
+        return payload
+
+    def _request_failed(self, e: requests.exceptions.RequestException) -> APIRequestError:
+        status_code = e.response.status_code if e.response is not None else None
+        return APIRequestError(f"API Request failed: {str(e)}", status_code)
+
+    def submit_async(self, model: str, messages: List[Dict[str, str]], **kwargs) -> Dict[str, Any]:
+        """
+        Submit a chat completion to the async API instead of waiting for it.
+
+        Args:
+            model: One of ASYNC_MODELS
+            messages: List of message dictionaries with 'role' and 'content' keys
+            **kwargs: Any other build_payload argument (stream is not supported)
+
+        Returns:
+            The async job description; its "id" is passed to get_async
+        """
+        endpoint = f"{self.base_url}/async/chat/completions"
+        payload = {"request": self.build_payload(model, messages, **kwargs)}
         try:
-            response = requests.post(endpoint, json=payload, headers=self.headers)
-            response.raise_for_status()
-            return response.json()
+            response = post_json(self.session, endpoint, payload, model,
+                                 timeouts=ASYNC_REQUEST_TIMEOUTS, max_retries=0)
+            return serialization.loads(response.content)
+        except requests.exceptions.RequestException as e:
+            raise self._request_failed(e)
+
+    def get_async(self, request_id: str, model: str = "sonar-deep-research") -> Dict[str, Any]:
+        """
+        Fetch an async job's status.
+
+        Returns:
+            The job description; "status" is CREATED, IN_PROGRESS, COMPLETED or FAILED,
+            with the chat completion under "response" once COMPLETED
+        """
+        endpoint = f"{self.base_url}/async/chat/completions/{request_id}"
+        try:
+            response = get_json(self.session, endpoint, model, timeouts=ASYNC_REQUEST_TIMEOUTS)
+            return serialization.loads(response.content)
         except requests.exceptions.RequestException as e:
-            raise Exception(f"API Request failed: {str(e)}")
\ No newline at end of file
+            raise self._request_failed(e)
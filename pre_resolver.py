@@ -0,0 +1,369 @@
+import math
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import metrics
+import serialization
+from local_tools import DEFAULT_PROPERTY_DB, PROPERTY_DB_ENV_VAR, SCHEMA, PropertyDataset, address_key
+from run_config import RunConfig
+
+# Reported as the served model of locally answered runs
+LOCAL_MODEL = "local"
+
+# Longer prompts ask for more than one fact; leave them to the model
+MAX_PROMPT_CHARS = 300
+
+# Degrees per spatial index cell (~1 km of latitude); most neighborhoods span a few cells
+CELL_SIZE = 0.01
+
+STATES = {
+    "alabama": "AL", "alaska": "AK", "arizona": "AZ", "arkansas": "AR", "california": "CA",
+    "colorado": "CO", "connecticut": "CT", "delaware": "DE", "district of columbia": "DC",
+    "florida": "FL", "georgia": "GA", "hawaii": "HI", "idaho": "ID", "illinois": "IL", "indiana": "IN",
+    "iowa": "IA", "kansas": "KS", "kentucky": "KY", "louisiana": "LA", "maine": "ME", "maryland": "MD",
+    "massachusetts": "MA", "michigan": "MI", "minnesota": "MN", "mississippi": "MS", "missouri": "MO",
+    "montana": "MT", "nebraska": "NE", "nevada": "NV", "new hampshire": "NH", "new jersey": "NJ",
+    "new mexico": "NM", "new york": "NY", "north carolina": "NC", "north dakota": "ND", "ohio": "OH",
+    "oklahoma": "OK", "oregon": "OR", "pennsylvania": "PA", "rhode island": "RI",
+    "south carolina": "SC", "south dakota": "SD", "tennessee": "TN", "texas": "TX", "utah": "UT",
+    "vermont": "VT", "virginia": "VA", "washington": "WA", "west virginia": "WV", "wisconsin": "WI",
+    "wyoming": "WY",
+}
+_STATE_CODES = set(STATES.values())
+
+# Only whole questions in these shapes are answered; anything that merely
+# mentions a county or neighborhood ("which county borders ...") goes to the model.
+# An optional closing instruction such as "Just provide me with the county name" is allowed.
+_INSTRUCTION = (r"(?:\s+(?:just\s+|please\s+)?(?:provide|give|return)(?:\s+me)?(?:\s+with)?(?:\s+only)?"
+                r"\s+the\s+(?:county|neighbou?rhood)(?:\s+name)?(?:\s+only|\s+in\s+your\s+response)?\.?)?")
+_COUNTY_QUESTION = re.compile(
+    r"\s*(?:what|which)\s+county\s+is\s+(?:the\s+city\s+of\s+|zip(?:\s+code)?\s+)?(?P<place>[^?]+?)"
+    r"\s+(?:located\s+)?in\s*\??" + _INSTRUCTION + r"\s*", re.IGNORECASE)
+_NEIGHBORHOOD_QUESTION = re.compile(
+    r"\s*(?:what|which)\s+neighbou?rhood(?:\s+of\s+[A-Za-z ,.'-]+?)?\s+is\s+(?P<place>[^?]+?)"
+    r"\s+(?:located\s+)?in\s*\??" + _INSTRUCTION + r"\s*", re.IGNORECASE)
+# "I need you to tell me what neighborhood of Cleveland Ohio the following address is in: <address>."
+_NEIGHBORHOOD_REQUEST = re.compile(
+    r"\s*(?:(?:i\s+need\s+you\s+to|can\s+you|could\s+you|please)\s+)?tell\s+me\s+(?:what|which)\s+"
+    r"neighbou?rhood(?:\s+of\s+[A-Za-z ,.'-]+?)?\s+the\s+(?:follow(?:ing|in)?\s+)?(?:address|property)\s+"
+    r"is\s+(?:located\s+)?in\s*:\s*(?P<place>[^?:]+?)\.?" + _INSTRUCTION + r"\s*", re.IGNORECASE)
+_ZIP = re.compile(r"(\d{5})(?:-\d{4})?")
+# "6603 Gertrude Ave, Cleveland, OH 44105": number, street, city, state code
+_ADDRESS = re.compile(r"\d+[A-Za-z]?\s+[A-Za-z0-9 .'-]+?,\s*[A-Za-z .'-]+?,\s*[A-Z]{2}(?:\s+(\d{5})(?:-\d{4})?)?")
+
+
+def split_place(place: str) -> Optional[Tuple[str, str]]:
+    """
+    Split "columbus ohio", "Columbus, OH" or "Columbus, Ohio" into (city, state code).
+
+    Returns:
+        (city, state code), or None if place does not end in a state
+    """
+    words = re.findall(r"[A-Za-z.'-]+", place)
+    for count in (3, 2, 1):
+        if len(words) <= count:
+            continue
+        name = " ".join(words[-count:]).lower()
+        code = STATES.get(name) or (name.upper() if count == 1 and name.upper() in _STATE_CODES else None)
+        if code:
+            return " ".join(words[:-count]), code
+    return None
+
+
+def answer_field(config: RunConfig) -> Optional[str]:
+    """
+    The property a local answer goes in, "" for a plain-text answer, or None.
+
+    Only schemas asking for a single string can be answered locally; anything
+    more is a question for the model.
+    """
+    if not config.use_json:
+        return ""
+    response_format = config.response_format()
+    if response_format is None:
+        return None
+    schema = (response_format.get("json_schema") or {}).get("schema") or {}
+    properties = schema.get("properties") or {}
+    if schema.get("type") != "object" or len(properties) != 1:
+        return None
+    name, spec = next(iter(properties.items()))
+    return name if spec.get("type") == "string" else None
+
+
+def _point_in_ring(x: float, y: float, ring: Sequence[Sequence[float]]) -> bool:
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i][0], ring[i][1]
+        xj, yj = ring[j][0], ring[j][1]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def _polygons(geometry: Dict[str, Any]) -> List[List[List[List[float]]]]:
+    """A GeoJSON Polygon or MultiPolygon as a list of polygons (outer ring, then holes)"""
+    if geometry.get("type") == "Polygon":
+        return [geometry["coordinates"]]
+    if geometry.get("type") == "MultiPolygon":
+        return list(geometry["coordinates"])
+    raise ValueError(f"Unsupported geometry type {geometry.get('type')}")
+
+
+class Region:
+    """A named area (e.g. a neighborhood) with its polygons and bounding box."""
+
+    def __init__(self, name: str, geometry: Dict[str, Any]):
+        self.name = name
+        self.polygons = _polygons(geometry)
+        xs = [point[0] for polygon in self.polygons for point in polygon[0]]
+        ys = [point[1] for polygon in self.polygons for point in polygon[0]]
+        self.bounds = (min(xs), min(ys), max(xs), max(ys))
+
+    def contains(self, x: float, y: float) -> bool:
+        min_x, min_y, max_x, max_y = self.bounds
+        if not (min_x <= x <= max_x and min_y <= y <= max_y):
+            return False
+        for outer, *holes in self.polygons:
+            if _point_in_ring(x, y, outer) and not any(_point_in_ring(x, y, hole) for hole in holes):
+                return True
+        return False
+
+
+class GridIndex:
+    """
+    Uniform grid over region bounding boxes.
+
+    A point lookup reads one cell and tests only the regions overlapping it,
+    so cost depends on how many regions meet at the point, not how many exist.
+    """
+
+    def __init__(self, regions: Sequence[Region], cell_size: float = CELL_SIZE):
+        self.cell_size = cell_size
+        self.regions = list(regions)
+        self._cells: Dict[Tuple[int, int], List[Region]] = defaultdict(list)
+        for region in self.regions:
+            min_x, min_y, max_x, max_y = region.bounds
+            for cx in range(self._cell(min_x), self._cell(max_x) + 1):
+                for cy in range(self._cell(min_y), self._cell(max_y) + 1):
+                    self._cells[(cx, cy)].append(region)
+
+    def _cell(self, value: float) -> int:
+        return math.floor(value / self.cell_size)
+
+    def find(self, longitude: float, latitude: float) -> Optional[Region]:
+        for region in self._cells.get((self._cell(longitude), self._cell(latitude)), ()):
+            if region.contains(longitude, latitude):
+                return region
+        return None
+
+
+class PreResolver:
+    """
+    Answers lookup-style prompts from the local reference dataset.
+
+    Recognized questions, matched against the whole prompt (an optional
+    "Just provide me with the county name" may follow):
+        "What county is <city> <state> in?"                    -> counties
+        "What county is <ZIP> in?" / "... is <address> <ZIP> in?" -> zip_counties
+        "What neighborhood is <street>, <city>, <ST> [ZIP] in?" -> properties, or
+            address_points located in neighborhoods polygons
+        "Tell me what neighborhood the following address is in: <address>" -> the same
+
+    resolve() returns a response shaped like a chat completion whose content
+    satisfies the test's schema, or None on any miss so the run goes to the API.
+    """
+
+    def __init__(self, dataset: PropertyDataset):
+        self.dataset = dataset
+        self._index: Optional[GridIndex] = None
+        self._index_lock = threading.Lock()
+
+    def _rows(self, sql: str, params: tuple) -> List[Dict[str, Any]]:
+        try:
+            return self.dataset.rows(sql, params)
+        except sqlite3.OperationalError:
+            # Table not imported into this dataset
+            return []
+
+    def neighborhoods(self) -> GridIndex:
+        # Built on first use; neighborhood polygons do not change while the app runs
+        with self._index_lock:
+            if self._index is None:
+                rows = self._rows("SELECT name, geometry FROM neighborhoods", ())
+                self._index = GridIndex([Region(row["name"], serialization.loads(row["geometry"]))
+                                         for row in rows])
+            return self._index
+
+    def county_for_zip(self, zip_code: str) -> Optional[str]:
+        rows = self._rows("SELECT county FROM zip_counties WHERE zip = ?", (zip_code,))
+        return rows[0]["county"] if rows else None
+
+    def county_for_city(self, city: str, state: str) -> Optional[str]:
+        rows = self._rows("SELECT county FROM counties WHERE city = ? COLLATE NOCASE "
+                          "AND state = ? COLLATE NOCASE", (city, state))
+        return rows[0]["county"] if rows else None
+
+    def neighborhood_for_address(self, address: str) -> Optional[str]:
+        key = address_key(address)
+        rows = self._rows("SELECT neighborhood FROM properties WHERE address_key = ?", (key,))
+        if rows and rows[0]["neighborhood"]:
+            return rows[0]["neighborhood"]
+        rows = self._rows("SELECT latitude, longitude FROM address_points WHERE address_key = ?", (key,))
+        if not rows:
+            return None
+        region = self.neighborhoods().find(rows[0]["longitude"], rows[0]["latitude"])
+        return region.name if region is not None else None
+
+    def answer(self, prompt: str) -> Optional[Tuple[str, str]]:
+        """
+        Look up the fact prompt asks for.
+
+        Returns:
+            (answer, source description), or None if the prompt is not a
+            recognized lookup or the dataset has no answer
+        """
+        if len(prompt) > MAX_PROMPT_CHARS:
+            return None
+
+        question = _NEIGHBORHOOD_QUESTION.fullmatch(prompt) or _NEIGHBORHOOD_REQUEST.fullmatch(prompt)
+        if question:
+            address = question.group("place")
+            if _ADDRESS.fullmatch(address):
+                neighborhood = self.neighborhood_for_address(address)
+                if neighborhood:
+                    return neighborhood, f"neighborhood of {address_key(address)}"
+            return None
+
+        question = _COUNTY_QUESTION.fullmatch(prompt)
+        if question:
+            place = question.group("place")
+            # A bare ZIP, or a full address ending in one
+            zip_match = _ZIP.fullmatch(place) or _ADDRESS.fullmatch(place)
+            if zip_match and zip_match.group(1):
+                county = self.county_for_zip(zip_match.group(1))
+                return (county, f"county of ZIP {zip_match.group(1)}") if county else None
+            city_state = split_place(place)
+            if city_state:
+                county = self.county_for_city(*city_state)
+                if county:
+                    return county, f"county of {city_state[0]}, {city_state[1]}"
+        return None
+
+    def resolve(self, config: RunConfig) -> Optional[Dict[str, Any]]:
+        """
+        Answer config locally if it is a recognized lookup.
+
+        Returns:
+            A chat-completion-shaped response (content, zero usage and cost, and
+            the lookup under "local_resolution"), or None to call the API
+        """
+        field = answer_field(config)
+        found = self.answer(config.prompt) if field is not None else None
+        metrics.record_cache("pre_resolver", found is not None)
+        if found is None:
+            return None
+
+        value, source = found
+        content = serialization.dumps({field: value}) if field else value
+        return {
+            "id": f"local-{uuid.uuid4()}",
+            "object": "chat.completion",
+            "model": LOCAL_MODEL,
+            "created": int(time.time()),
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0,
+                      "cost": {"total_cost": 0.0}},
+            "local_resolution": {"source": source, "dataset": self.dataset.path},
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content}
+            }]
+        }
+
+
+def default_resolver() -> Optional[PreResolver]:
+    """A PreResolver over the local dataset, or None when it does not exist"""
+    path = os.getenv(PROPERTY_DB_ENV_VAR) or DEFAULT_PROPERTY_DB
+    if not os.path.exists(path):
+        return None
+    return PreResolver(PropertyDataset(path))
+
+
+def import_geojson(db_path: str, geojson_path: str, name_property: str = "name",
+                   city: str = "", state: str = "") -> int:
+    """
+    Load neighborhood polygons from a GeoJSON FeatureCollection (WGS84 lon/lat).
+
+    Args:
+        db_path: The dataset
+        geojson_path: FeatureCollection of Polygon / MultiPolygon features
+        name_property: Feature property holding the neighborhood name
+        city: City the neighborhoods belong to
+        state: Its state code
+
+    Returns:
+        Features imported
+    """
+    with open(geojson_path, "rb") as f:
+        collection = serialization.loads(f.read())
+    rows = []
+    for feature in collection.get("features", []):
+        name = (feature.get("properties") or {}).get(name_property)
+        geometry = feature.get("geometry") or {}
+        if not name or geometry.get("type") not in ("Polygon", "MultiPolygon"):
+            continue
+        rows.append((name, city, state, serialization.dumps(geometry)))
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(SCHEMA)
+        with conn:
+            conn.executemany("INSERT INTO neighborhoods (name, city, state, geometry) VALUES (?, ?, ?, ?)", rows)
+    finally:
+        conn.close()
+    return len(rows)
+
+
+def main(argv: List[str]) -> int:
+    """
+    pre_resolver.py import-neighborhoods FILE.geojson [--name-property P] [--city C] [--state ST] [--db PATH]
+    pre_resolver.py ask "What county is columbus ohio in?" [--db PATH]
+    """
+    options = {"--db": os.getenv(PROPERTY_DB_ENV_VAR) or DEFAULT_PROPERTY_DB,
+               "--name-property": "name", "--city": "", "--state": ""}
+    for option in list(options):
+        if option in argv:
+            index = argv.index(option)
+            options[option] = argv[index + 1]
+            argv = argv[:index] + argv[index + 2:]
+
+    if len(argv) == 2 and argv[0] == "import-neighborhoods":
+        count = import_geojson(options["--db"], argv[1], options["--name-property"],
+                               options["--city"], options["--state"])
+        print(f"Imported {count} neighborhoods into {options['--db']}")
+        return 0
+    if len(argv) == 2 and argv[0] == "ask":
+        found = PreResolver(PropertyDataset(options["--db"])).answer(argv[1])
+        if found is None:
+            print("No local answer; this prompt would go to the API")
+            return 1
+        print(f"{found[0]}  ({found[1]})")
+        return 0
+
+    print("usage: python pre_resolver.py import-neighborhoods FILE.geojson "
+          "[--name-property P] [--city C] [--state ST] [--db PATH]\n"
+          "       python pre_resolver.py ask PROMPT [--db PATH]")
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
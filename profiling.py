@@ -0,0 +1,238 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Set to 1 to start profiling as soon as the app starts
+PROFILE_ENV_VAR = "PROMPT_TESTER_PROFILE"
+
+# Stack depth recorded per allocation; deeper is more precise but slower
+MEMORY_FRAMES = 5
+
+DEFAULT_TOP_N = 25
+
+
+class SectionTiming:
+    """Wall-clock totals for one profiled section."""
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed: float):
+        self.calls += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+
+class MemorySample:
+    """
+    Traced memory at one point in a session.
+
+    Attributes:
+        label: What triggered the sample
+        info: Caller-supplied context, e.g. {"entries": len(history)}
+        current: Bytes currently allocated by Python
+        peak: Peak bytes since tracing started
+    """
+
+    def __init__(self, label: str, info: Dict[str, Any], current: int, peak: int):
+        self.label = label
+        self.info = info
+        self.current = current
+        self.peak = peak
+        self.time = time.time()
+
+
+class Profiler:
+    """
+    Toggleable cProfile capture of named sections plus tracemalloc sampling.
+
+    Sections cost one attribute check when profiling is off. When on, each
+    section call runs under its own cProfile.Profile whose stats are merged per
+    section name. Nested sections on the same thread are folded into the
+    outermost one, since a thread can only run one profiler at a time.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.started_at: Optional[float] = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, pstats.Stats] = {}
+        self._timings: Dict[str, SectionTiming] = {}
+        self._samples: List[MemorySample] = []
+        # Only the first and latest snapshots are kept, so tracing cost stays bounded
+        self._first_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._last_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._started_tracemalloc = False
+
+    def enable(self, trace_memory: bool = True):
+        if self.enabled:
+            return
+        self.enabled = True
+        self.started_at = time.time()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORY_FRAMES)
+            self._started_tracemalloc = True
+
+    def disable(self):
+        """Stop capturing; collected data is kept until reset()"""
+        self.enabled = False
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._timings.clear()
+            self._samples.clear()
+            self._first_snapshot = None
+            self._last_snapshot = None
+        if self.enabled:
+            self.started_at = time.time()
+
+    @contextmanager
+    def section(self, name: str) -> Iterator[None]:
+        """Profile the enclosed block under name"""
+        if not self.enabled or getattr(self._local, "active", False):
+            yield
+            return
+
+        self._local.active = True
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (or, on 3.12+, another thread's) is active: time only
+            profile = None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+            self._local.active = False
+            self._record(name, elapsed, profile)
+
+    def _record(self, name: str, elapsed: float, profile: Optional[cProfile.Profile]):
+        with self._lock:
+            self._timings.setdefault(name, SectionTiming()).add(elapsed)
+            if profile is None:
+                return
+            if name in self._stats:
+                self._stats[name].add(profile)
+            else:
+                self._stats[name] = pstats.Stats(profile)
+
+    def sample_memory(self, label: str, **info):
+        """Record traced memory and a snapshot; no-op unless memory tracing is on"""
+        if not self.enabled or not tracemalloc.is_tracing():
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ))
+        with self._lock:
+            self._samples.append(MemorySample(label, info, current, peak))
+            if self._first_snapshot is None:
+                self._first_snapshot = snapshot
+            self._last_snapshot = snapshot
+
+    def timings(self) -> List[Tuple[str, SectionTiming]]:
+        with self._lock:
+            return sorted(self._timings.items(), key=lambda item: item[1].total, reverse=True)
+
+    def report(self, top_n: int = DEFAULT_TOP_N) -> str:
+        """Plain-text report: section timings, top functions by cumulative time, memory growth"""
+        out = io.StringIO()
+        started = datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds") if self.started_at else "never"
+        out.write(f"Profiling {'on' if self.enabled else 'off'}, started {started}\n\n")
+
+        timings = self.timings()
+        out.write("Sections (wall time)\n")
+        if not timings:
+            out.write("  no profiled sections ran yet\n")
+        for name, timing in timings:
+            out.write(f"  {name:<20} calls {timing.calls:>5}  total {timing.total:9.3f}s  "
+                      f"mean {timing.total / timing.calls:8.3f}s  max {timing.max:8.3f}s\n")
+
+        with self._lock:
+            for name, _ in timings:
+                stats = self._stats.get(name)
+                if stats is None:
+                    continue
+                out.write(f"\nTop functions by cumulative time: {name}\n")
+                stats.stream = out
+                stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top_n)
+
+            samples = list(self._samples)
+            first, last = self._first_snapshot, self._last_snapshot
+
+        if samples:
+            out.write("\nMemory samples\n")
+            for sample in samples[-top_n:]:
+                info = " ".join(f"{k}={v}" for k, v in sample.info.items())
+                out.write(f"  {datetime.fromtimestamp(sample.time).strftime('%H:%M:%S')} {sample.label} {info}  "
+                          f"current {sample.current / 1e6:.2f} MB  peak {sample.peak / 1e6:.2f} MB\n")
+        if first is not None and last is not None and first is not last:
+            out.write("\nTop allocation growth since the first sample\n")
+            for stat in last.compare_to(first, "lineno")[:top_n]:
+                out.write(f"  {stat}\n")
+        if last is not None:
+            out.write("\nTop allocations at the latest sample\n")
+            for stat in last.statistics("lineno")[:top_n]:
+                out.write(f"  {stat}\n")
+        return out.getvalue()
+
+    def dump(self, path: str, top_n: int = DEFAULT_TOP_N) -> List[str]:
+        """
+        Write the text report to path and the merged cProfile data beside it.
+
+        The .prof file loads in pstats, snakeviz and similar viewers.
+
+        Returns:
+            The files written
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.report(top_n))
+        written = [path]
+
+        with self._lock:
+            stats = list(self._stats.values())
+        if stats:
+            merged = pstats.Stats()
+            merged.add(*stats)
+            prof_path = os.path.splitext(path)[0] + ".prof"
+            merged.dump_stats(prof_path)
+            written.append(prof_path)
+        return written
+
+
+PROFILER = Profiler()
+if os.getenv(PROFILE_ENV_VAR) == "1":
+    PROFILER.enable()
+
+
+def profiled(name: str) -> Callable:
+    """Decorator form of PROFILER.section(name)"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            with PROFILER.section(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
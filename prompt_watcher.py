@@ -0,0 +1,273 @@
+import argparse
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import compact_store
+import serialization
+from response_cache import ResponseCache, cache_key
+from run_config import RunConfig
+
+# watchdog provides native notifications on every platform; without it only Linux (inotify) is supported
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+WATCHED_EXTENSIONS = (".json", compact_store.COMPACT_EXTENSION)
+
+# Quiet time after the last event for a file before it is reloaded; editors
+# often truncate, write and rename in separate steps
+DEBOUNCE_SECONDS = 0.3
+
+# inotify(7) event masks and the fixed part of each event record
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_DELETE = 0x200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0)
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def is_prompt_file(path: str) -> bool:
+    name = os.path.basename(path)
+    return name.endswith(WATCHED_EXTENSIONS) and not name.startswith(".")
+
+
+def load_config(path: str) -> Optional[RunConfig]:
+    """The request a saved test describes, or None if it cannot be read (e.g. half-written)"""
+    try:
+        return RunConfig.from_test_data(compact_store.load(path))
+    except (OSError, ValueError, TypeError, AttributeError):
+        return None
+
+
+class _InotifyWatch:
+    """Linux inotify on an event loop's reader; no threads, no polling"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, directories: List[str], on_event: Callable[[str], None]):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.loop = loop
+        self.on_event = on_event
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories: Dict[int, str] = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory),
+                                        IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"Cannot watch {directory}")
+            self.directories[wd] = directory
+        loop.add_reader(self.fd, self._read)
+
+    def _read(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if name and wd in self.directories:
+                self.on_event(os.path.join(self.directories[wd], os.fsdecode(name)))
+
+    def close(self):
+        self.loop.remove_reader(self.fd)
+        os.close(self.fd)
+
+
+class _WatchdogHandler(FileSystemEventHandler):
+    def __init__(self, loop: asyncio.AbstractEventLoop, on_event: Callable[[str], None]):
+        super().__init__()
+        self.loop = loop
+        self.on_event = on_event
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        # Observer thread -> loop thread; a rename reports the new name
+        for path in (event.src_path, getattr(event, "dest_path", "")):
+            if path:
+                self.loop.call_soon_threadsafe(self.on_event, os.fsdecode(path))
+
+
+class _WatchdogWatch:
+    def __init__(self, loop: asyncio.AbstractEventLoop, directories: List[str], on_event: Callable[[str], None]):
+        self.observer = Observer()
+        handler = _WatchdogHandler(loop, on_event)
+        for directory in directories:
+            self.observer.schedule(handler, directory, recursive=False)
+        self.observer.start()
+
+    def close(self):
+        self.observer.stop()
+        self.observer.join()
+
+
+class PromptWatcher:
+    """
+    Watches prompt directories and reports saved tests whose request changed.
+
+    Runs its own event loop on a daemon thread, fed by native filesystem
+    notifications (watchdog when installed, else inotify on Linux). Events
+    for a file are debounced; once it has been quiet for debounce seconds it
+    is reloaded, and on_change is called (on the watcher thread) only when
+    the request it describes differs from the last one seen. Saving a
+    response or timestamp into a test therefore does not re-run it.
+    Files present at start() are taken as already run.
+    """
+
+    def __init__(
+        self,
+        directories: List[str],
+        on_change: Callable[[str, RunConfig], None],
+        debounce: float = DEBOUNCE_SECONDS
+    ):
+        self.directories = [os.path.abspath(d) for d in directories]
+        self.on_change = on_change
+        self.debounce = debounce
+        self._keys: Dict[str, str] = {}
+        self._pending: Dict[str, asyncio.TimerHandle] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._watch = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Raises:
+            RuntimeError: If this platform has no supported notification mechanism
+            OSError: If a directory cannot be watched
+        """
+        if Observer is None and not sys.platform.startswith("linux"):
+            raise RuntimeError('Watch mode needs watchdog on this platform: pip install watchdog')
+        for directory in self.directories:
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                config = load_config(path) if is_prompt_file(path) else None
+                if config is not None:
+                    self._keys[path] = cache_key(config)
+
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+        errors: List[BaseException] = []
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            try:
+                watch_type = _WatchdogWatch if Observer is not None else _InotifyWatch
+                self._watch = watch_type(self._loop, self.directories, self._on_event)
+            except BaseException as e:
+                errors.append(e)
+                started.set()
+                return
+            started.set()
+            self._loop.run_forever()
+            self._watch.close()
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="prompt-watcher", daemon=True)
+        self._thread.start()
+        started.wait()
+        if errors:
+            self._thread = None
+            raise errors[0]
+
+    def stop(self):
+        if self.running:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+        self._thread = None
+
+    def _on_event(self, path: str):
+        if not is_prompt_file(path):
+            return
+        handle = self._pending.pop(path, None)
+        if handle is not None:
+            handle.cancel()
+        self._pending[path] = self._loop.call_later(self.debounce, self._reload, path)
+
+    def _reload(self, path: str):
+        self._pending.pop(path, None)
+        if not os.path.exists(path):
+            self._keys.pop(path, None)
+            return
+        config = load_config(path)
+        if config is None:
+            # Half-written or not a test; the next save brings another event
+            return
+        key = cache_key(config)
+        if self._keys.get(path) == key:
+            return
+        self._keys[path] = key
+        self.on_change(path, config)
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Re-run saved tests whenever their request changes on disk")
+    parser.add_argument("directories", nargs="+", help="Prompt directories to watch, e.g. Good_prompts")
+    parser.add_argument("--workers", type=int, default=4, help="Runs executing at once (default 4)")
+    parser.add_argument("--http2", action="store_true", help="Multiplex API calls over HTTP/2 (needs httpx and h2)")
+    args = parser.parse_args(argv)
+
+    # Imported here: building the engine loads the API clients
+    from batch_runner import build_engine
+    engine = build_engine(args.http2)
+    cache = ResponseCache()
+    executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="watch")
+    print_lock = threading.Lock()
+
+    def run(path: str, config: RunConfig):
+        name = os.path.basename(path)
+        result = cache.get(config)
+        cached = result is not None
+        try:
+            if result is None:
+                result = engine.execute(config)
+                cache.put(result)
+        except Exception as e:
+            with print_lock:
+                print(f"{name}: failed: {e}", flush=True)
+            return
+        outcome = result.validate() if config.use_json else None
+        status = "" if outcome is None else (" valid" if outcome.valid else f" invalid ({outcome.error})")
+        with print_lock:
+            print(f"{name}: {result.served_model} {result.response_time:.2f}s"
+                  f"{' (cached)' if cached else ''}{status}\n  {serialization.dumps(result.content)}", flush=True)
+
+    watcher = PromptWatcher(args.directories, lambda path, config: executor.submit(run, path, config))
+    try:
+        watcher.start()
+    except (RuntimeError, OSError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    print(f"Watching {', '.join(watcher.directories)}; Ctrl-C to stop", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
+        executor.shutdown(wait=False, cancel_futures=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
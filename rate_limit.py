@@ -0,0 +1,150 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from request_control import CancelToken, Deadline, DeadlineExceeded, RequestCancelled
+from tracing import TRACER
+
+
+class TokenBucket:
+    """
+    Classic token bucket: rate tokens per second, bursting up to capacity.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self) -> float:
+        """
+        Take a token if one is available.
+
+        Returns:
+            0 if a token was taken, otherwise seconds until one will be available
+        """
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+
+class ProviderLimit:
+    """
+    Request-rate and concurrency budget for one provider.
+
+    Attributes:
+        requests_per_minute: Sustained request rate
+        burst: Requests that may be sent back-to-back before throttling starts
+        max_concurrency: Requests allowed in flight at once
+    """
+
+    def __init__(self, requests_per_minute: float, burst: int = 5, max_concurrency: int = 8):
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(requests_per_minute / 60.0, burst)
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+
+
+DEFAULT_PROVIDER_LIMITS = {
+    "perplexity": {"requests_per_minute": 50, "burst": 5, "max_concurrency": 8},
+    "openai": {"requests_per_minute": 60, "burst": 10, "max_concurrency": 8},
+}
+
+
+class RateLimiter:
+    """
+    Shared per-provider rate limits; every caller going through the same
+    limiter draws from the same budgets.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Dict[str, float]]] = None):
+        limits = limits if limits is not None else DEFAULT_PROVIDER_LIMITS
+        self.limits = {provider: ProviderLimit(**kwargs) for provider, kwargs in limits.items()}
+
+    def _wait(self, seconds: float, cancel_token: Optional[CancelToken], deadline: Optional[Deadline]):
+        if deadline is not None and seconds >= deadline.remaining():
+            raise DeadlineExceeded("Request deadline exceeded while waiting for rate limit")
+        if cancel_token is not None:
+            if cancel_token.wait(seconds):
+                raise RequestCancelled("Request cancelled")
+        else:
+            time.sleep(seconds)
+
+    @contextmanager
+    def acquire(
+        self,
+        provider: str,
+        cancel_token: Optional[CancelToken] = None,
+        deadline: Optional[Deadline] = None,
+        priority: Optional[str] = None
+    ) -> Iterator[None]:
+        """
+        Block until provider has both a rate token and a free concurrency slot.
+
+        Args:
+            provider: Provider name; providers without a configured limit pass straight through
+            cancel_token: Abort the wait when cancelled
+            deadline: Give up once the deadline would pass
+            priority: Ignored; every caller waits in one line (scheduler.Scheduler orders them)
+
+        Raises:
+            RequestCancelled: If cancel_token is cancelled while waiting
+            DeadlineExceeded: If the wait would outlive the deadline
+        """
+        limit = self.limits.get(provider)
+        if limit is None:
+            yield
+            return
+
+        with TRACER.span("wait for slot", "rate_limit", provider=provider):
+            # Poll the semaphore so a cancel or deadline can interrupt the wait
+            while not limit.slots.acquire(timeout=0.25):
+                self._wait(0, cancel_token, deadline)
+
+        try:
+            with TRACER.span("wait for rate token", "rate_limit", provider=provider):
+                while True:
+                    delay = limit.bucket.try_acquire()
+                    if delay == 0:
+                        break
+                    self._wait(delay, cancel_token, deadline)
+            yield
+        finally:
+            limit.slots.release()
+
+    def try_acquire(self, provider: str, priority: Optional[str] = None) -> bool:
+        """
+        Take a slot and a rate token for provider only if both are free now.
+
+        For optional extra calls such as hedges, which are skipped rather than queued.
+
+        Returns:
+            True if taken (always, for providers without a limit); pair it with release()
+        """
+        limit = self.limits.get(provider)
+        if limit is None:
+            return True
+        if not limit.slots.acquire(blocking=False):
+            return False
+        if limit.bucket.try_acquire() != 0:
+            limit.slots.release()
+            return False
+        return True
+
+    def release(self, provider: str):
+        """Give back a slot taken with try_acquire()"""
+        limit = self.limits.get(provider)
+        if limit is not None:
+            limit.slots.release()
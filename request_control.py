@@ -0,0 +1,777 @@
+import asyncio
+import concurrent.futures
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import metrics
+import serialization
+from tracing import TRACER, traced
+
+# httpx is optional; only the HTTP/2 transport needs it (plus h2: pip install "httpx[http2]")
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Set to 1 to send API calls over HTTP/2 (see Http2Adapter)
+HTTP2_ENV_VAR = "PROMPT_TESTER_HTTP2"
+
+# Headers that are HTTP/1.1-only and forbidden in HTTP/2 requests
+_HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "proxy-connection", "transfer-encoding", "upgrade"}
+
+
+class RequestCancelled(Exception):
+    """Raised when an in-flight request is aborted through its CancelToken."""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's overall deadline passes before it completes."""
+
+
+class APIRequestError(Exception):
+    """
+    Raised by the API clients when a request fails.
+
+    Attributes:
+        status_code: HTTP status of the failed response, or None for network errors
+    """
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass(frozen=True)
+class Timeouts:
+    """
+    Timeout budget for a single model.
+
+    Attributes:
+        connect: Seconds allowed to establish the TCP/TLS connection
+        read: Seconds allowed between bytes received from the server
+        total: Overall deadline for the call, including retries
+    """
+    connect: float
+    read: float
+    total: float
+
+
+DEFAULT_TIMEOUTS = Timeouts(connect=5.0, read=60.0, total=180.0)
+
+# Reasoning and research models think for a long time before the first byte
+MODEL_TIMEOUTS = {
+    "sonar": Timeouts(connect=5.0, read=60.0, total=120.0),
+    "sonar-pro": Timeouts(connect=5.0, read=90.0, total=180.0),
+    "sonar-reasoning": Timeouts(connect=5.0, read=180.0, total=300.0),
+    "sonar-deep-research": Timeouts(connect=10.0, read=900.0, total=1800.0),
+    "gpt-5": Timeouts(connect=5.0, read=300.0, total=600.0),
+    "gpt-5-mini": Timeouts(connect=5.0, read=180.0, total=300.0),
+    "gpt-5-nano": Timeouts(connect=5.0, read=120.0, total=240.0),
+}
+
+# Statuses worth retrying: the request was rejected before any work was billed
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def timeouts_for(model: str) -> Timeouts:
+    """
+    Get the timeout budget for a model.
+
+    Args:
+        model: The model name
+
+    Returns:
+        The model's Timeouts, or DEFAULT_TIMEOUTS for unknown models
+    """
+    return MODEL_TIMEOUTS.get(model, DEFAULT_TIMEOUTS)
+
+
+class Deadline:
+    """
+    An absolute point in time by which a call (and all of its retries) must finish.
+    """
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def clamp(self, timeouts: Timeouts) -> Tuple[float, float]:
+        """
+        Shrink connect/read timeouts so a single attempt cannot outlive the deadline.
+
+        Args:
+            timeouts: The model's timeout budget
+
+        Returns:
+            (connect, read) tuple suitable for requests' timeout argument
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("Request deadline exceeded")
+        return min(timeouts.connect, remaining), min(timeouts.read, remaining)
+
+
+class CancelToken:
+    """
+    Thread-safe cancellation flag with abort callbacks.
+
+    Callbacks registered while a request is in flight are invoked by cancel(),
+    which is how the socket of a blocked request gets torn down.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def add_callback(self, callback: Callable[[], None]):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        # Already cancelled - run immediately
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]):
+        with self._lock:
+            try:
+                self._callbacks.remove(callback)
+            except ValueError:
+                pass
+
+    def wait(self, timeout: float) -> bool:
+        """Sleep for up to timeout seconds; returns True if cancelled meanwhile."""
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise RequestCancelled("Request cancelled")
+
+
+# The token of the request currently being sent on this thread, if any
+_active = threading.local()
+
+
+class _AbortableConnectionMixin:
+    """Registers a socket shutdown with the active CancelToken for every request sent."""
+
+    # The socket of the latest connect(); a connection-closing response detaches
+    # self.sock while its body is still being read from it
+    _abort_target = None
+
+    def connect(self):
+        super().connect()
+        self._abort_target = self.sock
+
+    def request(self, *args, **kwargs):
+        token = getattr(_active, "token", None)
+        if token is not None:
+            token.add_callback(self._abort_socket)
+        return super().request(*args, **kwargs)
+
+    def _abort_socket(self):
+        sock = self.sock or self._abort_target
+        if sock is not None:
+            try:
+                # shutdown() (unlike close()) wakes a thread blocked in recv()
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class _AbortableHTTPConnection(_AbortableConnectionMixin, HTTPConnection):
+    pass
+
+
+class _AbortableHTTPSConnection(_AbortableConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _AbortableHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _AbortableHTTPConnection
+
+
+class _AbortableHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _AbortableHTTPSConnection
+
+
+class AbortableHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections can be aborted mid-request by a CancelToken."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _AbortableHTTPConnectionPool,
+            "https": _AbortableHTTPSConnectionPool,
+        }
+
+
+@contextmanager
+def _translated_errors(request: Optional[requests.PreparedRequest] = None):
+    """Raise httpx transport errors (and aborts) as the requests exceptions callers handle"""
+    try:
+        yield
+    except httpx.ConnectTimeout as e:
+        raise requests.exceptions.ConnectTimeout(e, request=request) from e
+    except httpx.TimeoutException as e:
+        raise requests.exceptions.ReadTimeout(e, request=request) from e
+    except httpx.TransportError as e:
+        raise requests.exceptions.ConnectionError(e, request=request) from e
+    except concurrent.futures.CancelledError as e:
+        raise requests.exceptions.ConnectionError("Request aborted", request=request) from e
+
+
+async def _next_chunk(chunks: AsyncIterator[bytes]) -> bytes:
+    return await anext(chunks, b"")
+
+
+class _Http2Body:
+    """
+    The urllib3-style raw body of a requests.Response served by Http2Adapter.
+
+    It is its own "connection" so read_event_stream's abort hook works: the
+    abort cancels this stream's pending read and leaves the shared connection
+    (and every other stream on it) alone.
+    """
+
+    def __init__(self, adapter: "Http2Adapter", response: "httpx.Response"):
+        self._adapter = adapter
+        self._response = response
+        self._chunks = response.aiter_bytes()
+        self._pending: Optional[concurrent.futures.Future] = None
+        self._aborted = False
+
+    @property
+    def connection(self) -> "_Http2Body":
+        return self
+
+    def _abort_socket(self):
+        self._aborted = True
+        pending = self._pending
+        if pending is not None:
+            pending.cancel()
+
+    def read1(self, amt: int = -1, decode_content: bool = True) -> bytes:
+        # Whatever one DATA frame (or decoder flush) delivered; b"" at the end
+        if self._aborted:
+            raise requests.exceptions.ConnectionError("Request aborted")
+        self._pending = self._adapter.submit(_next_chunk(self._chunks))
+        with _translated_errors():
+            return self._pending.result()
+
+    def read(self, amt: Optional[int] = None, decode_content: bool = True) -> bytes:
+        return b"".join(iter(self.read1, b""))
+
+    def stream(self, amt: int = 8192, decode_content: bool = True) -> Iterator[bytes]:
+        return iter(self.read1, b"")
+
+    def close(self):
+        if not self._adapter.closed:
+            self._adapter.submit(self._response.aclose())
+
+
+class Http2Adapter(HTTPAdapter):
+    """
+    Transport adapter that sends a session's requests over HTTP/2 with httpx.
+
+    Concurrent calls to one host are multiplexed as streams over a few
+    connections instead of needing a connection (and handshake) each. Retries,
+    deadlines and metrics in send_request are unchanged.
+
+    Requests run on an httpx.AsyncClient in one event loop thread; the calling
+    threads wait on futures. (httpx's synchronous HTTP/2 connection serializes
+    reads across threads and can send stream ids out of order under load.)
+    Cancelling a call returns at once and leaves the shared socket open for
+    the other calls; httpx does not reset the stream, though, so the server may
+    finish (and bill) a cancelled generation.
+
+    Args:
+        prior_knowledge: Speak HTTP/2 to plain http:// servers without
+            negotiation. https:// servers negotiate it and fall back to HTTP/1.1.
+        max_connections: Connections per host; each carries up to the server's
+            stream limit (usually 100)
+        verify: TLS verification: True for the system CAs, or an ssl.SSLContext
+            (the session's verify setting is not consulted)
+
+    Raises:
+        ImportError: If httpx or h2 is not installed
+    """
+
+    def __init__(self, prior_knowledge: bool = False, max_connections: int = 10, verify: Any = True):
+        super().__init__()
+        if httpx is None:
+            raise ImportError('The HTTP/2 transport needs httpx and h2: pip install "httpx[http2]"')
+        self.client = httpx.AsyncClient(http1=not prior_knowledge, http2=True, follow_redirects=False,
+                                        limits=httpx.Limits(max_connections=max_connections), verify=verify)
+        self.closed = False
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="http2", daemon=True).start()
+
+    def submit(self, coroutine) -> concurrent.futures.Future:
+        """Run a coroutine on the transport's event loop"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def send(self, request: requests.PreparedRequest, stream: bool = False, timeout=None,
+             verify=True, cert=None, proxies=None) -> requests.Response:
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        headers = [(name, value) for name, value in request.headers.items()
+                   if name.lower() not in _HOP_BY_HOP_HEADERS]
+        outgoing = self.client.build_request(request.method, request.url, headers=headers, content=request.body,
+                                             timeout=httpx.Timeout(read, connect=connect, pool=connect))
+
+        async def exchange() -> "httpx.Response":
+            incoming = await self.client.send(outgoing, stream=True)
+            if not stream:
+                try:
+                    await incoming.aread()
+                finally:
+                    await incoming.aclose()
+            return incoming
+
+        future = self.submit(exchange())
+        # The attempt's CancelToken (see send_request) cancels this stream only
+        token = getattr(_active, "token", None)
+        if token is not None:
+            token.add_callback(future.cancel)
+        try:
+            with _translated_errors(request):
+                incoming = future.result()
+        finally:
+            if token is not None:
+                token.remove_callback(future.cancel)
+
+        response = requests.Response()
+        response.status_code = incoming.status_code
+        response.reason = incoming.reason_phrase
+        response.headers = CaseInsensitiveDict(incoming.headers.items())
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        if stream:
+            response.raw = _Http2Body(self, incoming)
+        else:
+            response._content = incoming.content
+            response._content_consumed = True
+        return response
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.submit(self.client.aclose()).result(WARMUP_TIMEOUTS.total)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def http2_enabled() -> bool:
+    """Whether PROMPT_TESTER_HTTP2 asks for the HTTP/2 transport"""
+    return os.getenv(HTTP2_ENV_VAR, "").strip().lower() in ("1", "true", "yes")
+
+
+def create_session(headers: Dict[str, str], http2: bool = False) -> requests.Session:
+    """
+    Create a pooled session whose requests support cancellation.
+
+    Args:
+        headers: Default headers sent with every request
+        http2: Send https:// requests over HTTP/2 (see Http2Adapter)
+
+    Returns:
+        A configured requests.Session
+
+    Raises:
+        ImportError: If http2 is set and httpx or h2 is not installed
+    """
+    session = requests.Session()
+    session.headers.update(headers)
+    adapter = AbortableHTTPAdapter()
+    session.mount("https://", Http2Adapter() if http2 else adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Servers close keep-alive connections left idle for about a minute; refresh well before that
+KEEPALIVE_INTERVAL = 30.0
+
+# Stop refreshing a session that has sent nothing for this long
+KEEPALIVE_IDLE_LIMIT = 15 * 60.0
+
+WARMUP_TIMEOUTS = Timeouts(connect=10.0, read=10.0, total=20.0)
+
+
+def open_connections(session: requests.Session, url: str, count: int = 1) -> int:
+    """
+    Fill a session's pool with count open connections to url's host.
+
+    Concurrent HEAD requests force separate connections; each is returned to
+    the pool once its response is read. Failures are ignored.
+
+    Returns:
+        Connections opened
+    """
+    opened = []
+
+    def head():
+        try:
+            session.request("HEAD", url, timeout=(WARMUP_TIMEOUTS.connect, WARMUP_TIMEOUTS.read),
+                            allow_redirects=False).close()
+            opened.append(True)
+        except requests.exceptions.RequestException:
+            pass
+
+    threads = [threading.Thread(target=head, name="connection-open", daemon=True) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(WARMUP_TIMEOUTS.total)
+    return len(opened)
+
+
+class ConnectionWarmer:
+    """
+    Opens pooled connections ahead of the first request and keeps them open.
+
+    keep_warm() replaces the set of (session, url) targets. Each new target gets
+    a HEAD request right away, which pays DNS, TCP and TLS setup and leaves the
+    connection in the session's pool; afterwards a target is refreshed whenever
+    its session has been quiet for KEEPALIVE_INTERVAL, until it has been quiet
+    for KEEPALIVE_IDLE_LIMIT. All of this happens on one daemon thread, and
+    failures are ignored: a cold connection is only slower.
+    """
+
+    def __init__(self, interval: float = KEEPALIVE_INTERVAL, idle_limit: float = KEEPALIVE_IDLE_LIMIT):
+        self.interval = interval
+        self.idle_limit = idle_limit
+        self._targets: List[Tuple[requests.Session, str]] = []
+        # id(session) -> monotonic time of its last warm-up request
+        self._warmed: Dict[int, float] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def keep_warm(self, targets: List[Tuple[requests.Session, str]]):
+        """
+        Warm these targets now and keep them warm, dropping any others.
+
+        Args:
+            targets: (session, url) pairs; any URL on the API host will do
+        """
+        now = time.monotonic()
+        with self._lock:
+            kept = {id(session) for session, _ in self._targets} & {id(session) for session, _ in targets}
+            # Newly selected targets are warmed now, even if they were warm once before
+            self._warmed = {key: warmed for key, warmed in self._warmed.items() if key in kept}
+            self._targets = list(targets)
+            for session, _ in self._targets:
+                # Re-selected sessions count as active again
+                session.last_request_at = max(getattr(session, "last_request_at", 0.0), now)
+            if self._thread is None and self._targets:
+                self._thread = threading.Thread(target=self._run, name="connection-warmer", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _due(self) -> List[Tuple[requests.Session, str]]:
+        now = time.monotonic()
+        with self._lock:
+            due = []
+            for session, url in self._targets:
+                warmed = self._warmed.get(id(session))
+                quiet = now - getattr(session, "last_request_at", 0.0)
+                if warmed is None or (self.interval <= quiet < self.idle_limit and now - warmed >= self.interval):
+                    due.append((session, url))
+            return due
+
+    def _run(self):
+        while True:
+            for session, url in self._due():
+                open_connections(session, url)
+                with self._lock:
+                    self._warmed[id(session)] = time.monotonic()
+            self._wake.wait(self.interval / 2)
+            self._wake.clear()
+
+
+def _retry_delay(response: Optional[requests.Response], attempt: int, backoff: float) -> float:
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    return backoff * (2 ** attempt)
+
+
+def post_json(
+    session: requests.Session,
+    endpoint: str,
+    payload: Dict[str, Any],
+    model: str,
+    timeouts: Optional[Timeouts] = None,
+    deadline: Optional[Deadline] = None,
+    cancel_token: Optional[CancelToken] = None,
+    max_retries: int = 2,
+    backoff: float = 1.0,
+    stream: bool = False
+) -> requests.Response:
+    """
+    POST a JSON payload with per-model timeouts, a deadline shared by all retries,
+    and cancellation (see send_request).
+    """
+    # Encode once; retries resend the same bytes
+    body = serialization.dumps_bytes(payload)
+    return send_request(session, "POST", endpoint, model, body=body, timeouts=timeouts,
+                        deadline=deadline, cancel_token=cancel_token,
+                        max_retries=max_retries, backoff=backoff, stream=stream)
+
+
+def get_json(
+    session: requests.Session,
+    endpoint: str,
+    model: str,
+    timeouts: Optional[Timeouts] = None,
+    deadline: Optional[Deadline] = None,
+    cancel_token: Optional[CancelToken] = None,
+    max_retries: int = 2,
+    backoff: float = 1.0
+) -> requests.Response:
+    """GET a JSON resource with the same timeout, retry and cancellation handling as post_json."""
+    return send_request(session, "GET", endpoint, model, timeouts=timeouts, deadline=deadline,
+                        cancel_token=cancel_token, max_retries=max_retries, backoff=backoff)
+
+
+def send_request(
+    session: requests.Session,
+    method: str,
+    endpoint: str,
+    model: str,
+    body: Optional[bytes] = None,
+    timeouts: Optional[Timeouts] = None,
+    deadline: Optional[Deadline] = None,
+    cancel_token: Optional[CancelToken] = None,
+    max_retries: int = 2,
+    backoff: float = 1.0,
+    stream: bool = False,
+    headers: Optional[Dict[str, str]] = None
+) -> requests.Response:
+    """
+    Send a request with per-model timeouts, a deadline shared by all retries,
+    and cancellation.
+
+    Args:
+        session: Session created by create_session
+        method: HTTP method
+        endpoint: Full URL
+        model: Model name, used to pick default timeouts
+        body: Encoded JSON request body, if any
+        timeouts: Override the model's default Timeouts
+        deadline: Overall deadline; defaults to timeouts.total from now
+        cancel_token: Token that aborts the request when cancelled
+        max_retries: Retries for connection failures and retryable statuses
+        backoff: Base delay in seconds for exponential backoff
+        stream: Return once headers arrive and leave the body unread (see read_event_stream)
+        headers: Headers to send on top of the session's (e.g. a caller's Authorization)
+
+    Returns:
+        The successful requests.Response
+
+    Raises:
+        RequestCancelled: If cancel_token was cancelled
+        DeadlineExceeded: If the deadline passed before a response arrived
+        requests.exceptions.RequestException: For non-retryable failures
+    """
+    timeouts = timeouts or timeouts_for(model)
+    if deadline is None:
+        deadline = Deadline(timeouts.total)
+    headers = dict(headers or {})
+    if body is not None:
+        headers["Content-Type"] = "application/json"
+
+    attempt = 0
+    while True:
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        timeout = deadline.clamp(timeouts)
+
+        # Each attempt gets its own token so callbacks bound to a connection
+        # never outlive the attempt that registered them
+        attempt_token = CancelToken()
+        if cancel_token is not None:
+            cancel_token.add_callback(attempt_token.cancel)
+        _active.token = attempt_token
+
+        response = None
+        # Read by ConnectionWarmer: a session in use needs no keep-alive requests
+        session.last_request_at = time.monotonic()
+        metrics.HTTP_IN_FLIGHT.inc()
+        try:
+            with TRACER.span(f"HTTP {method}", "network", url=endpoint, model=model, attempt=attempt) as span:
+                response = session.request(method, endpoint, data=body, timeout=timeout, headers=headers,
+                                           stream=stream)
+                span["status"] = response.status_code
+        except requests.exceptions.RequestException as e:
+            if cancel_token is not None and cancel_token.cancelled:
+                raise RequestCancelled("Request cancelled") from e
+            if deadline.expired():
+                raise DeadlineExceeded(f"Request deadline exceeded: {str(e)}") from e
+            # Read timeouts are not retried: the server may already be generating (and billing)
+            if not isinstance(e, requests.exceptions.ConnectionError) or attempt >= max_retries:
+                raise
+            delay = _retry_delay(None, attempt, backoff)
+            if delay >= deadline.remaining():
+                raise
+        else:
+            if response.status_code == 429:
+                metrics.RATE_LIMITED.inc(provider=metrics.provider_of(model), model=model)
+            if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= max_retries:
+                response.raise_for_status()
+                return response
+            delay = _retry_delay(response, attempt, backoff)
+            if delay >= deadline.remaining():
+                response.raise_for_status()
+            # An unread streamed body would keep its connection out of the pool
+            response.close()
+        finally:
+            metrics.HTTP_IN_FLIGHT.dec()
+            _active.token = None
+            if cancel_token is not None:
+                cancel_token.remove_callback(attempt_token.cancel)
+
+        attempt += 1
+        with TRACER.span("retry backoff", "retry", model=model, attempt=attempt, delay=delay):
+            if cancel_token is not None:
+                if cancel_token.wait(delay):
+                    raise RequestCancelled("Request cancelled")
+            else:
+                time.sleep(delay)
+
+
+def _iter_lines(response: requests.Response) -> Iterator[bytes]:
+    # iter_lines() waits for a full 512-byte chunk; read1() returns whatever has arrived
+    read1 = getattr(response.raw, "read1", None)
+    if read1 is not None:
+        chunks = iter(lambda: read1(8192, decode_content=True), b"")
+    else:
+        chunks = response.iter_content(chunk_size=None)
+    pending = b""
+    for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip(b"\r")
+    if pending:
+        yield pending
+
+
+@traced("read stream", "network")
+def read_event_stream(
+    response: requests.Response,
+    on_delta: Callable[[str], None],
+    cancel_token: Optional[CancelToken] = None,
+    deadline: Optional[Deadline] = None
+) -> Dict[str, Any]:
+    """
+    Read a streamed (server-sent events) chat completion, passing each piece of
+    content to on_delta as it arrives.
+
+    Args:
+        response: Response from send_request(..., stream=True)
+        on_delta: Called with each content fragment, on the calling thread
+        cancel_token: Token that aborts the read when cancelled
+        deadline: Overall deadline, checked between events
+
+    Returns:
+        The chunks reassembled into a non-streamed response: the last value of
+        every top-level field (usage, citations, search_results, ...) plus one
+        choice holding the full content and any tool calls
+
+    Raises:
+        RequestCancelled: If cancel_token was cancelled
+        DeadlineExceeded: If the deadline passed mid-stream
+    """
+    merged: Dict[str, Any] = {}
+    content: List[str] = []
+    # Tool calls arrive as fragments keyed by index; arguments are split across chunks
+    tool_calls: Dict[int, Dict[str, Any]] = {}
+    finish_reason = None
+
+    # The connection registered its abort with the request's token only while
+    # headers were awaited; register it again for the body
+    abort = getattr(getattr(response.raw, "connection", None), "_abort_socket", None)
+    if cancel_token is not None and abort is not None:
+        cancel_token.add_callback(abort)
+    try:
+        for line in _iter_lines(response):
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            if deadline is not None and deadline.expired():
+                raise DeadlineExceeded("Request deadline exceeded while streaming")
+            if not line.startswith(b"data:"):
+                continue
+            data = line[len(b"data:"):].strip()
+            if data == b"[DONE]":
+                break
+            chunk = serialization.loads(data)
+            choices = chunk.pop("choices", None) or []
+            merged.update(chunk)
+            for choice in choices[:1]:
+                delta = choice.get("delta") or {}
+                text = delta.get("content")
+                if text:
+                    content.append(text)
+                    on_delta(text)
+                for fragment in delta.get("tool_calls") or []:
+                    call = tool_calls.setdefault(fragment.get("index", 0), {
+                        "id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+                    call["id"] = fragment.get("id") or call["id"]
+                    function = fragment.get("function") or {}
+                    call["function"]["name"] += function.get("name") or ""
+                    call["function"]["arguments"] += function.get("arguments") or ""
+                finish_reason = choice.get("finish_reason") or finish_reason
+    except requests.exceptions.RequestException as e:
+        if cancel_token is not None and cancel_token.cancelled:
+            raise RequestCancelled("Request cancelled") from e
+        raise
+    finally:
+        if cancel_token is not None and abort is not None:
+            cancel_token.remove_callback(abort)
+        response.close()
+
+    message: Dict[str, Any] = {"role": "assistant", "content": "".join(content)}
+    if tool_calls:
+        message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+    merged["choices"] = [{"index": 0, "message": message, "finish_reason": finish_reason}]
+    return merged
@@ -0,0 +1,63 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import compact_store
+import metrics
+from run_config import RunConfig
+from run_engine import RunResult
+
+DEFAULT_MAX_ENTRIES = 512
+
+# Seconds a result stays reusable; grounded answers go stale as search results change
+DEFAULT_TTL = 3600.0
+
+
+def cache_key(config: RunConfig) -> str:
+    """Content hash of every setting; only identical requests share a key"""
+    return hashlib.sha256(compact_store.canonical_bytes(config.to_dict())).hexdigest()
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU of recent results for identical requests.
+
+    Entries expire ttl seconds after they were stored; the least recently used
+    entry is evicted once max_entries are held.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, RunResult]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, config: RunConfig) -> Optional[RunResult]:
+        key = cache_key(config)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        metrics.record_cache("responses", entry is not None)
+        return entry[1] if entry is not None else None
+
+    def put(self, result: RunResult):
+        key = cache_key(result.config)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
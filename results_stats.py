@@ -0,0 +1,175 @@
+import sys
+from typing import Any, Dict, List, Optional, Sequence
+
+import serialization
+from columnar_export import load_columns
+
+# numpy is optional for the app, but required here
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_PERCENTILES = (50, 90, 95, 99)
+
+
+def _normalize(values: Any) -> Any:
+    # Normalize each distinct string once; answers repeat heavily across runs
+    uniques, inverse = np.unique(values.astype(str), return_inverse=True)
+    return np.char.lower(np.char.strip(uniques))[inverse]
+
+
+def group_percentiles(keys: Any, values: Any, percentiles: Sequence[float]) -> Dict[str, Any]:
+    """
+    Percentiles of values within each group, without a Python loop over rows.
+
+    One lexsort orders values inside each group; every group's percentile is then
+    read off the sorted array by index arithmetic (linear interpolation, matching
+    numpy.percentile's default).
+
+    Args:
+        keys: Group label per row
+        values: Numeric value per row; NaNs are ignored
+        percentiles: Percentiles in [0, 100]
+
+    Returns:
+        {"groups": unique labels, "count": rows per group, "p<q>": value per group}
+    """
+    keep = ~np.isnan(values)
+    keys, values = keys[keep], values[keep]
+    groups, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(groups))
+    sorted_values = values[np.lexsort((values, inverse))]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    result = {"groups": groups, "count": counts}
+    for q in percentiles:
+        position = starts + (counts - 1) * (q / 100.0)
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        fraction = position - low
+        if len(sorted_values):
+            result[f"p{q:g}"] = sorted_values[low] + (sorted_values[high] - sorted_values[low]) * fraction
+        else:
+            result[f"p{q:g}"] = np.empty(0)
+    return result
+
+
+def summarize(
+    columns: Dict[str, Any],
+    by: str = "model",
+    percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+    expected: Optional[Dict[str, str]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Per-group latency percentiles, token and cost totals, validity and accuracy.
+
+    Args:
+        columns: Column arrays from columnar_export.load_columns
+        by: Column to group by ("model", "served_model", "prompt", ...)
+        percentiles: Latency percentiles to report
+        expected: Optional prompt -> expected answer; accuracy is the share of
+            rows with an expected answer whose answer matches it (case-insensitive)
+
+    Returns:
+        One dictionary per group, ordered by group label
+    """
+    if np is None:
+        raise ImportError("results_stats needs numpy")
+
+    keys = columns[by].astype(str)
+    groups, inverse = np.unique(keys, return_inverse=True)
+    size = len(groups)
+    runs = np.bincount(inverse, minlength=size)
+
+    def group_sum(values):
+        return np.bincount(inverse, weights=values, minlength=size)
+
+    latency = group_percentiles(inverse, columns["response_time"].astype(float), percentiles)
+    # group_percentiles drops groups whose latencies are all NaN; realign to every group
+    latency_rows = {int(g): i for i, g in enumerate(latency["groups"])}
+
+    response_time = columns["response_time"].astype(float)
+    timed = ~np.isnan(response_time)
+    latency_sum = group_sum(np.where(timed, response_time, 0.0))
+    timed_runs = group_sum(timed.astype(float))
+
+    cost = columns["cost"].astype(float)
+    costed = ~np.isnan(cost)
+    cost_sum = group_sum(np.where(costed, cost, 0.0))
+    costed_runs = group_sum(costed.astype(float))
+
+    tokens = group_sum(columns["total_tokens"].astype(float))
+    valid = group_sum(columns["valid"].astype(float))
+
+    accuracy = graded = None
+    if expected:
+        prompts, prompt_inverse = np.unique(columns["prompt"].astype(str), return_inverse=True)
+        expected_by_prompt = np.array([expected.get(p, "") for p in prompts], dtype=str)
+        row_expected = expected_by_prompt[prompt_inverse]
+        has_expected = row_expected != ""
+        matches = has_expected & (_normalize(columns["answer"]) == _normalize(row_expected))
+        graded = group_sum(has_expected.astype(float))
+        accuracy = group_sum(matches.astype(float))
+
+    summary = []
+    for i, group in enumerate(groups):
+        row = {by: str(group), "runs": int(runs[i])}
+        j = latency_rows.get(i)
+        for q in percentiles:
+            row[f"p{q:g}"] = float(latency[f"p{q:g}"][j]) if j is not None else None
+        row["mean_latency"] = float(latency_sum[i] / timed_runs[i]) if timed_runs[i] else None
+        row["mean_tokens"] = float(tokens[i] / runs[i])
+        row["total_cost"] = float(cost_sum[i]) if costed_runs[i] else None
+        row["valid_rate"] = float(valid[i] / runs[i])
+        if accuracy is not None:
+            row["accuracy"] = float(accuracy[i] / graded[i]) if graded[i] else None
+        summary.append(row)
+    return summary
+
+
+def format_summary(summary: List[Dict[str, Any]]) -> str:
+    """Render summarize() output as a fixed-width text table."""
+    if not summary:
+        return "No runs"
+    headers = list(summary[0])
+
+    def cell(value):
+        if value is None:
+            return "-"
+        if isinstance(value, float):
+            return f"{value:.3f}"
+        return str(value)
+
+    rows = [[cell(row[h]) for h in headers] for row in summary]
+    widths = [max(len(h), *(len(r[i]) for r in rows)) for i, h in enumerate(headers)]
+    lines = ["  ".join(h.ljust(w) for h, w in zip(headers, widths))]
+    lines += ["  ".join(c.ljust(w) for c, w in zip(r, widths)) for r in rows]
+    return "\n".join(lines)
+
+
+def main(argv: List[str]) -> int:
+    """results_stats.py EXPORT.{parquet,npz,csv} [--by COLUMN] [--expected answers.json]"""
+    if not argv:
+        print("usage: python results_stats.py EXPORT.parquet|.npz|.csv [--by COLUMN] [--expected ANSWERS.json]")
+        return 2
+
+    path, by, expected = argv[0], "model", None
+    args = argv[1:]
+    while args:
+        flag = args.pop(0)
+        if flag == "--by" and args:
+            by = args.pop(0)
+        elif flag == "--expected" and args:
+            with open(args.pop(0), "rb") as f:
+                expected = serialization.load(f)
+        else:
+            print(f"Unknown argument: {flag}")
+            return 2
+
+    print(format_summary(summarize(load_columns(path), by=by, expected=expected)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,466 @@
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import metrics
+from hedging import HedgeSlot
+from incremental_json import StreamAborted
+from request_control import (APIRequestError, CancelToken, Deadline, DeadlineExceeded, RequestCancelled,
+                             RETRYABLE_STATUS_CODES, timeouts_for)
+from rate_limit import RateLimiter
+from scheduler import INTERACTIVE
+from tracing import TRACER
+
+
+PERPLEXITY_MODELS = ["sonar", "sonar-pro", "sonar-reasoning", "sonar-deep-research"]
+OPENAI_MODELS = ["gpt-5", "gpt-5-mini", "gpt-5-nano"]
+GPT5_MODELS = ["gpt-5", "gpt-5-mini", "gpt-5-nano"]
+
+# Model -> ordered list of models to try when it is failing or its breaker is open
+DEFAULT_FALLBACK_CHAINS = {
+    "sonar-pro": ["sonar"],
+    "sonar-reasoning": ["sonar-pro", "sonar"],
+    "sonar-deep-research": ["sonar-reasoning"],
+    "gpt-5": ["gpt-5-mini"],
+    "gpt-5-mini": ["gpt-5-nano"],
+}
+
+# Parameters understood only by one provider's chat_completion
+PERPLEXITY_ONLY_PARAMS = [
+    "url", "search_domain_filter", "search_recency_filter", "search_after_date_filter",
+    "search_before_date_filter", "search_context_size", "return_images",
+    "return_related_questions", "user_location"
+]
+SAMPLING_PARAMS = ["temperature", "max_tokens", "top_p", "frequency_penalty", "presence_penalty"]
+
+
+class CircuitOpenError(APIRequestError):
+    """Raised when every candidate model is short-circuited by an open breaker."""
+
+
+def provider_for(model: str) -> Optional[str]:
+    """
+    Get the provider serving a model.
+
+    Args:
+        model: The model name
+
+    Returns:
+        "perplexity", "openai", or None for unknown models
+    """
+    if model in PERPLEXITY_MODELS:
+        return "perplexity"
+    if model in OPENAI_MODELS:
+        return "openai"
+    return None
+
+
+def extract_schema(response_format: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Pull the bare JSON schema out of either provider's response_format shape.
+
+    Perplexity nests it under json_schema.schema; OpenAI configs either do the
+    same or spread the schema directly into json_schema next to name/strict.
+
+    Args:
+        response_format: A response_format configuration
+
+    Returns:
+        The JSON schema, or None if the format carries no schema
+    """
+    if not response_format or response_format.get("type") != "json_schema":
+        return None
+    json_schema = response_format.get("json_schema") or {}
+    if "schema" in json_schema:
+        return json_schema["schema"]
+    schema = {k: v for k, v in json_schema.items() if k not in ("name", "strict", "description")}
+    return schema or None
+
+
+def translate_response_format(response_format: Optional[Dict[str, Any]],
+                              target_model: str) -> Optional[Dict[str, Any]]:
+    """
+    Rewrite a response_format for the provider serving target_model.
+
+    Args:
+        response_format: The response_format written for the requested model
+        target_model: The model that will actually serve the request
+
+    Returns:
+        A response_format the target provider accepts
+    """
+    schema = extract_schema(response_format)
+    if schema is None:
+        return response_format
+
+    if provider_for(target_model) == "perplexity":
+        return {"type": "json_schema", "json_schema": {"schema": schema}}
+
+    json_schema = response_format.get("json_schema", {})
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": json_schema.get("name", "response"),
+            "strict": json_schema.get("strict", True),
+            "schema": schema
+        }
+    }
+
+
+def translate_params(params: Dict[str, Any], target_model: str,
+                     source_model: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Turn provider-neutral run parameters into chat_completion kwargs for target_model.
+
+    Parameters the target provider or model does not support are dropped, the same
+    way GPT-5 models ignore sampling parameters.
+
+    Args:
+        params: Provider-neutral parameters (messages, sampling, search and OpenAI options)
+        target_model: The model that will serve the request
+        source_model: The model params were written for; response_format is only
+                      rewritten when the provider changes
+
+    Returns:
+        Keyword arguments for the target client's chat_completion
+    """
+    provider = provider_for(target_model)
+    kwargs = {
+        "model": target_model,
+        "messages": params["messages"],
+        "stream": False
+    }
+
+    if params.get("response_format"):
+        response_format = params["response_format"]
+        if source_model is not None and provider_for(source_model) != provider:
+            response_format = translate_response_format(response_format, target_model)
+        kwargs["response_format"] = response_format
+
+    if provider == "perplexity":
+        for key in PERPLEXITY_ONLY_PARAMS + SAMPLING_PARAMS:
+            if params.get(key) is not None:
+                kwargs[key] = params[key]
+        return kwargs
+
+    if target_model in GPT5_MODELS:
+        # GPT-5 models have limited parameter support
+        if params.get("max_tokens"):
+            kwargs["max_tokens"] = params["max_tokens"]
+    else:
+        for key in SAMPLING_PARAMS:
+            if params.get(key) is not None:
+                kwargs[key] = params[key]
+
+    for key in ("reasoning_effort", "verbosity", "seed", "tools", "parallel_tool_calls"):
+        if params.get(key) is not None:
+            kwargs[key] = params[key]
+
+    # Logprobs are not supported by GPT-5
+    if target_model not in GPT5_MODELS and params.get("logprobs"):
+        kwargs["logprobs"] = True
+        if params.get("top_logprobs") is not None:
+            kwargs["top_logprobs"] = params["top_logprobs"]
+
+    return kwargs
+
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open breaker driven by error rate and slow-call rate.
+
+    The breaker opens when failures (errors or calls slower than slow_call_seconds)
+    make up failure_threshold of the last window calls. After cooldown seconds a
+    single probe is let through; its outcome closes or re-opens the breaker.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_threshold: float = 0.5,
+        slow_call_seconds: float = 30.0,
+        cooldown: float = 30.0
+    ):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.cooldown = cooldown
+
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go through right now (may claim the half-open probe)."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record(self, success: bool, latency: float):
+        failed = not success or latency > self.slow_call_seconds
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe_in_flight = False
+                if failed:
+                    self._trip()
+                else:
+                    self.state = self.CLOSED
+                    self._outcomes.clear()
+                return
+
+            self._outcomes.append(failed)
+            if len(self._outcomes) >= self.min_calls:
+                failure_rate = sum(self._outcomes) / len(self._outcomes)
+                if failure_rate >= self.failure_threshold:
+                    self._trip()
+
+    def release(self):
+        """Give back a half-open probe that was claimed but never used."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _trip(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self._outcomes.clear()
+
+
+class BreakerBoard:
+    """
+    Circuit breakers for every provider and every model.
+
+    A call is allowed only when both its provider's and its model's breakers allow it.
+    Provider breakers need a larger, more uniform failure rate to trip so that one
+    failing model does not take its healthy siblings down with it.
+    """
+
+    def __init__(
+        self,
+        model_breaker_kwargs: Optional[Dict[str, Any]] = None,
+        provider_breaker_kwargs: Optional[Dict[str, Any]] = None
+    ):
+        self.model_breaker_kwargs = model_breaker_kwargs or {}
+        self.provider_breaker_kwargs = provider_breaker_kwargs or {
+            "window": 50, "min_calls": 10, "failure_threshold": 0.8
+        }
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, key: str, slow_call_seconds: Optional[float] = None) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                if key.startswith("provider:"):
+                    kwargs = dict(self.provider_breaker_kwargs)
+                else:
+                    kwargs = dict(self.model_breaker_kwargs)
+                if slow_call_seconds is not None:
+                    kwargs.setdefault("slow_call_seconds", slow_call_seconds)
+                breaker = self._breakers[key] = CircuitBreaker(**kwargs)
+            return breaker
+
+    def _breakers_for(self, model: str) -> Tuple[CircuitBreaker, CircuitBreaker]:
+        # A call is "slow" once it has used half of the model's read timeout
+        slow_call_seconds = timeouts_for(model).read / 2
+        return (self.breaker(f"provider:{provider_for(model)}", slow_call_seconds),
+                self.breaker(f"model:{model}", slow_call_seconds))
+
+    def allow(self, model: str) -> bool:
+        provider_breaker, model_breaker = self._breakers_for(model)
+        if not provider_breaker.allow():
+            return False
+        if not model_breaker.allow():
+            provider_breaker.release()
+            return False
+        return True
+
+    def release(self, model: str):
+        for breaker in self._breakers_for(model):
+            breaker.release()
+
+    def record(self, model: str, success: bool, latency: float):
+        for breaker in self._breakers_for(model):
+            breaker.record(success, latency)
+
+    def states(self) -> Dict[str, str]:
+        with self._lock:
+            return {key: breaker.state for key, breaker in self._breakers.items()}
+
+
+@dataclass
+class RoutedResponse:
+    """
+    A response together with the model that actually served it.
+
+    Attributes:
+        response: The API response dictionary
+        requested_model: The model the caller asked for
+        served_model: The model whose response was returned
+        attempts: (model, outcome) pairs for every model tried, in order
+    """
+    response: Dict[str, Any]
+    requested_model: str
+    served_model: str
+    attempts: List[Tuple[str, str]] = field(default_factory=list)
+
+    @property
+    def fell_back(self) -> bool:
+        return self.served_model != self.requested_model
+
+
+def _should_fall_back(error: Exception) -> bool:
+    """Only outages are worth another model; a malformed request fails everywhere."""
+    if isinstance(error, DeadlineExceeded):
+        return True
+    if isinstance(error, APIRequestError):
+        return error.status_code is None or error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+class FallbackRouter:
+    """
+    Route calls through circuit breakers and configurable fallback chains.
+    """
+
+    def __init__(
+        self,
+        clients: Dict[str, Any],
+        chains: Optional[Dict[str, List[str]]] = None,
+        board: Optional[BreakerBoard] = None,
+        limiter: Optional[RateLimiter] = None
+    ):
+        """
+        Args:
+            clients: Provider name -> API client ("perplexity", "openai"); None if not configured
+            chains: Model -> fallback models, defaults to DEFAULT_FALLBACK_CHAINS
+            board: BreakerBoard to share; a new one is created if omitted
+            limiter: Shared RateLimiter (usually a scheduler.Scheduler) applied to every call, or None for no limits
+        """
+        self.clients = clients
+        self.chains = chains if chains is not None else dict(DEFAULT_FALLBACK_CHAINS)
+        self.board = board or BreakerBoard()
+        self.limiter = limiter
+
+    def _slot(self, provider: str, cancel_token: Optional[CancelToken], deadline: Optional[Deadline],
+              priority: str):
+        if self.limiter is None:
+            return nullcontext()
+        return self.limiter.acquire(provider, cancel_token, deadline, priority)
+
+    def candidates(self, model: str, allow_fallback: bool = True) -> List[str]:
+        if not allow_fallback:
+            return [model]
+        return [model] + [m for m in self.chains.get(model, []) if m != model]
+
+    def complete(
+        self,
+        model: str,
+        params: Dict[str, Any],
+        allow_fallback: bool = True,
+        deadline: Optional[Deadline] = None,
+        cancel_token: Optional[CancelToken] = None,
+        on_delta: Optional[Callable[[str], None]] = None,
+        priority: str = INTERACTIVE
+    ) -> RoutedResponse:
+        """
+        Send a request to model, falling back along its chain on outages.
+
+        Args:
+            model: The requested model
+            params: Provider-neutral parameters (see translate_params)
+            allow_fallback: If False, only the requested model is tried (breakers still fail fast)
+            deadline: Overall deadline shared by every model tried
+            cancel_token: Token that aborts the in-flight request
+            on_delta: Stream the response, passing each content fragment here. Once
+                      content has been passed on, a failure is raised rather than
+                      falling back, so the caller never sees two answers spliced together
+            priority: Scheduling class for the limiter (see scheduler.PRIORITY_WEIGHTS)
+
+        Returns:
+            RoutedResponse recording which model served the result
+
+        Raises:
+            CircuitOpenError: If every candidate was short-circuited
+            Exception: The last error when every candidate failed
+        """
+        attempts = []
+        last_error = None
+        streamed = []
+
+        def forward(text: str):
+            streamed.append(True)
+            on_delta(text)
+
+        for candidate in self.candidates(model, allow_fallback):
+            client = self.clients.get(provider_for(candidate))
+            if client is None:
+                attempts.append((candidate, "no client"))
+                continue
+            if not self.board.allow(candidate):
+                attempts.append((candidate, "circuit open"))
+                continue
+
+            kwargs = translate_params(params, candidate, source_model=model)
+            if on_delta is not None:
+                kwargs["stream"] = True
+                kwargs["on_delta"] = forward
+            if self.limiter is not None and getattr(client, "hedge_policy", None) is not None:
+                # A hedge is a second call to the provider; it needs a slot of its own
+                kwargs["hedge_slot"] = HedgeSlot(self.limiter, provider_for(candidate), priority)
+            with self._slot(provider_for(candidate), cancel_token, deadline, priority):
+                # Time spent queued for a rate-limit slot is not the provider's fault
+                start_time = time.monotonic()
+                try:
+                    with TRACER.span(f"call {candidate}", "api", model=candidate, requested=model):
+                        response = client.chat_completion(**kwargs, deadline=deadline, cancel_token=cancel_token)
+                except Exception as e:
+                    latency = time.monotonic() - start_time
+                    if isinstance(e, StreamAborted):
+                        metrics.record_aborted(candidate)
+                    elif not isinstance(e, RequestCancelled):
+                        metrics.record_request(candidate, latency, e)
+                    if not _should_fall_back(e):
+                        # A rejected request still proves the provider is up; a cancellation proves nothing
+                        if isinstance(e, APIRequestError):
+                            self.board.record(candidate, True, latency)
+                        else:
+                            self.board.release(candidate)
+                        raise
+                    self.board.record(candidate, False, latency)
+                    if streamed:
+                        # Part of this answer was already passed on; another model can't continue it
+                        raise
+                    attempts.append((candidate, str(e)))
+                    last_error = e
+                    if deadline is not None and deadline.expired():
+                        break
+                    continue
+
+            latency = time.monotonic() - start_time
+            self.board.record(candidate, True, latency)
+            metrics.record_request(candidate, latency)
+            attempts.append((candidate, "ok"))
+            return RoutedResponse(response, model, candidate, attempts)
+
+        if last_error is not None:
+            raise last_error
+        tried = ", ".join(f"{m} ({outcome})" for m, outcome in attempts)
+        raise CircuitOpenError(f"No model available for {model}: {tried}")
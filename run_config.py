@@ -0,0 +1,243 @@
+from dataclasses import asdict, dataclass, replace
+from typing import Any, Dict, List, Optional
+
+import serialization
+
+
+def _parse_int(value: str) -> Optional[int]:
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _parse_float(value: str) -> Optional[float]:
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+@dataclass(frozen=True)
+class RunConfig:
+    """
+    Immutable snapshot of everything needed to run one test.
+
+    Captured from the widgets on the Tk main thread, then handed to worker threads,
+    which never touch a widget. Fields hold the raw widget text, exactly as a saved
+    test stores it; parsing happens in to_params().
+    """
+    model: str
+    prompt: str
+    system_prompt: str = ""
+    url: str = ""
+    # Search parameters (Perplexity)
+    domain_filter: str = ""
+    recency_filter: str = "none"
+    context_size: str = "low"
+    after_date: str = ""
+    before_date: str = ""
+    return_images: bool = False
+    return_questions: bool = False
+    latitude: str = ""
+    longitude: str = ""
+    country: str = ""
+    # LLM parameters
+    temperature: float = 0.2
+    max_tokens: str = ""
+    # Size max_tokens (GPT-5: verbosity) from the JSON schema when max_tokens is empty
+    auto_budget: bool = True
+    top_p: str = ""
+    frequency_penalty: str = ""
+    presence_penalty: str = ""
+    # OpenAI parameters
+    reasoning_effort: str = "medium"
+    verbosity: str = "medium"
+    enable_tools: bool = False
+    parallel_tools: bool = True
+    seed: str = ""
+    logprobs: bool = False
+    top_logprobs: str = ""
+    # Response format
+    use_json: bool = False
+    json_format: str = ""
+    # Routing
+    allow_fallback: bool = False
+    resolve_locally: bool = True
+
+    def with_changes(self, **changes) -> "RunConfig":
+        return replace(self, **changes)
+
+    def messages(self) -> List[Dict[str, str]]:
+        messages = []
+        if self.system_prompt:
+            messages.append({"role": "system", "content": self.system_prompt})
+        messages.append({"role": "user", "content": self.prompt})
+        return messages
+
+    def response_format(self) -> Optional[Dict[str, Any]]:
+        """The parsed JSON format configuration, or None when JSON is off or invalid."""
+        if not self.use_json:
+            return None
+        json_str = self.json_format.strip()
+        if not json_str or json_str == '{}':
+            return None
+        try:
+            return serialization.loads(json_str)
+        except serialization.JSONDecodeError:
+            return None
+
+    def to_params(self) -> Dict[str, Any]:
+        """
+        Build provider-neutral request parameters (see routing.translate_params).
+
+        Returns:
+            Parameters for FallbackRouter.complete
+        """
+        # Prepare search domain filter
+        search_domain_filter = None
+        domains = [d.strip() for d in self.domain_filter.split(',') if d.strip()]
+        if domains:
+            search_domain_filter = domains[:3]  # Limit to 3 domains
+
+        # Get location
+        user_location = None
+        latitude = _parse_float(self.latitude)
+        longitude = _parse_float(self.longitude)
+        if latitude is not None and longitude is not None:
+            user_location = {"latitude": latitude, "longitude": longitude}
+            if self.country.strip():
+                user_location["country"] = self.country.strip()
+
+        params = {
+            "messages": self.messages(),
+            "response_format": self.response_format(),
+            "url": self.url.strip() or None,
+            "search_domain_filter": search_domain_filter,
+            "search_recency_filter": self.recency_filter if self.recency_filter != "none" else None,
+            "search_after_date_filter": self.after_date.strip() or None,
+            "search_before_date_filter": self.before_date.strip() or None,
+            "search_context_size": self.context_size,
+            "return_images": self.return_images or None,
+            "return_related_questions": self.return_questions or None,
+            "user_location": user_location,
+            "temperature": self.temperature,
+            "max_tokens": _parse_int(self.max_tokens),
+            "top_p": _parse_float(self.top_p),
+            "frequency_penalty": _parse_float(self.frequency_penalty),
+            "presence_penalty": _parse_float(self.presence_penalty)
+        }
+
+        # Medium is the API default, so it is not sent explicitly
+        if self.reasoning_effort and self.reasoning_effort != "medium":
+            params["reasoning_effort"] = self.reasoning_effort
+        if self.verbosity and self.verbosity != "medium":
+            params["verbosity"] = self.verbosity
+
+        seed = _parse_int(self.seed)
+        if seed is not None:
+            params["seed"] = seed
+
+        # Logprobs are dropped for GPT-5 during translation
+        if self.logprobs:
+            params["logprobs"] = True
+            top_logprobs = _parse_int(self.top_logprobs)
+            if top_logprobs is not None:
+                params["top_logprobs"] = top_logprobs
+
+        return params
+
+    def to_test_data(self) -> Dict[str, Any]:
+        """Serialize to the saved-test layout written by save_test (without the response)."""
+        return {
+            "model": self.model,
+            "prompt": self.prompt,
+            "system_prompt": self.system_prompt,
+            "url": self.url,
+            "search_params": {
+                "domain_filter": self.domain_filter,
+                "recency_filter": self.recency_filter,
+                "context_size": self.context_size,
+                "after_date": self.after_date,
+                "before_date": self.before_date,
+                "return_images": self.return_images,
+                "return_questions": self.return_questions
+            },
+            "location": {
+                "latitude": self.latitude,
+                "longitude": self.longitude,
+                "country": self.country
+            },
+            "llm_params": {
+                "temperature": self.temperature,
+                "max_tokens": self.max_tokens,
+                "top_p": self.top_p,
+                "frequency_penalty": self.frequency_penalty,
+                "presence_penalty": self.presence_penalty
+            },
+            "openai_params": {
+                "reasoning_effort": self.reasoning_effort,
+                "verbosity": self.verbosity,
+                "enable_tools": self.enable_tools,
+                "parallel_tools": self.parallel_tools,
+                "seed": self.seed,
+                "logprobs": self.logprobs,
+                "top_logprobs": self.top_logprobs
+            },
+            "use_json": self.use_json,
+            "json_format": self.json_format
+        }
+
+    @classmethod
+    def from_test_data(cls, test_data: Dict[str, Any]) -> "RunConfig":
+        """
+        Build a snapshot from a saved test dictionary.
+
+        Accepts every saved-test layout the GUI can load, including the old
+        expected_json field name.
+        """
+        search_params = test_data.get("search_params", {})
+        location = test_data.get("location", {})
+        llm_params = test_data.get("llm_params", {})
+        openai_params = test_data.get("openai_params", {})
+        defaults = cls(model="", prompt="")
+
+        return cls(
+            model=test_data.get("model", "sonar"),
+            prompt=test_data.get("prompt", ""),
+            system_prompt=test_data.get("system_prompt", ""),
+            url=test_data.get("url", ""),
+            domain_filter=search_params.get("domain_filter", ""),
+            recency_filter=search_params.get("recency_filter", "none"),
+            context_size=search_params.get("context_size", "low"),
+            after_date=search_params.get("after_date", ""),
+            before_date=search_params.get("before_date", ""),
+            return_images=search_params.get("return_images", False),
+            return_questions=search_params.get("return_questions", False),
+            latitude=str(location.get("latitude", "")),
+            longitude=str(location.get("longitude", "")),
+            country=location.get("country", ""),
+            temperature=llm_params.get("temperature", defaults.temperature),
+            max_tokens=str(llm_params.get("max_tokens", "")),
+            top_p=str(llm_params.get("top_p", "")),
+            frequency_penalty=str(llm_params.get("frequency_penalty", "")),
+            presence_penalty=str(llm_params.get("presence_penalty", "")),
+            reasoning_effort=openai_params.get("reasoning_effort", defaults.reasoning_effort),
+            verbosity=openai_params.get("verbosity", defaults.verbosity),
+            enable_tools=openai_params.get("enable_tools", False),
+            parallel_tools=openai_params.get("parallel_tools", True),
+            seed=str(openai_params.get("seed", "")),
+            logprobs=openai_params.get("logprobs", False),
+            top_logprobs=str(openai_params.get("top_logprobs", "")),
+            use_json=test_data.get("use_json", False),
+            json_format=test_data.get("json_format") or test_data.get("expected_json", "")
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
@@ -0,0 +1,549 @@
+import itertools
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from jsonschema import Draft202012Validator
+
+import metrics
+import serialization
+from incremental_json import StreamAborted, StreamValidator
+from local_tools import ToolRegistry
+from pre_resolver import LOCAL_MODEL, PreResolver
+from profiling import profiled
+from request_control import CancelToken, Deadline, RequestCancelled, timeouts_for
+from routing import FallbackRouter, RoutedResponse, extract_schema, provider_for
+from run_config import RunConfig
+from scheduler import INTERACTIVE
+from token_budget import BudgetStats, plan_budget, truncated
+from tracing import TRACER, traced
+
+# sonar-reasoning models prefix their answer with a <think> block
+THINK_BLOCK = re.compile(r"<think>.*?</think>", re.DOTALL)
+
+# Model calls per run when tools are enabled; a model stuck calling tools gets its last reply returned
+MAX_TOOL_ROUNDS = 8
+
+# Compiled validators keyed by canonical schema JSON; exports validate many rows per schema
+_validators: Dict[str, Draft202012Validator] = {}
+_validators_lock = threading.Lock()
+
+
+class QueueFullError(Exception):
+    """Raised when a run is submitted while the run queue is at capacity."""
+
+
+def response_content(response: Dict[str, Any]) -> str:
+    """The first choice's message content, or "" if there is none."""
+    choices = response.get("choices") or []
+    if not choices:
+        return ""
+    return choices[0].get("message", {}).get("content") or ""
+
+
+def strip_reasoning(content: str) -> str:
+    """Remove <think> blocks so only the model's answer remains."""
+    return THINK_BLOCK.sub("", content).strip()
+
+
+def _add_usage(total: Dict[str, Any], usage: Dict[str, Any]):
+    for key, value in usage.items():
+        if isinstance(value, dict):
+            # Perplexity reports its cost breakdown as a nested object
+            _add_usage(total.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            total[key] = total.get(key, 0) + value
+
+
+@dataclass
+class ValidationOutcome:
+    """
+    Result of checking a response's content against its response_format.
+
+    Attributes:
+        is_json: Whether the content parsed as JSON
+        schema_valid: Whether it satisfied the schema (None when no schema was given)
+        parsed: The parsed JSON value, if any
+        error: Description of the first problem found
+    """
+    is_json: bool
+    schema_valid: Optional[bool]
+    parsed: Any = None
+    error: Optional[str] = None
+
+    @property
+    def valid(self) -> bool:
+        return self.is_json and self.schema_valid is not False
+
+
+def _validator_for(schema: Dict[str, Any]) -> Draft202012Validator:
+    key = serialization.dumps(schema, sort_keys=True)
+    with _validators_lock:
+        validator = _validators.get(key)
+        metrics.record_cache("schema_validators", validator is not None)
+        if validator is None:
+            validator = _validators[key] = Draft202012Validator(schema)
+        return validator
+
+
+@traced("validate", "validation")
+def validate_output(content: str, response_format: Optional[Dict[str, Any]]) -> ValidationOutcome:
+    """
+    Parse content as JSON and validate it against response_format's schema.
+
+    Args:
+        content: The model's message content
+        response_format: The response_format the request was sent with
+
+    Returns:
+        ValidationOutcome
+    """
+    try:
+        parsed = serialization.loads(strip_reasoning(content))
+    except serialization.JSONDecodeError as e:
+        return ValidationOutcome(False, None, error=f"Response is not JSON: {e}")
+
+    schema = extract_schema(response_format)
+    if schema is None:
+        return ValidationOutcome(True, None, parsed)
+
+    error = next(iter(_validator_for(schema).iter_errors(parsed)), None)
+    if error is not None:
+        return ValidationOutcome(True, False, parsed, error.message)
+    return ValidationOutcome(True, True, parsed)
+
+
+def extract_answer(parsed: Any) -> Any:
+    """
+    The answer value of a structured response.
+
+    Uses an "answer" field when present, otherwise the only field of a
+    single-field object, otherwise the parsed value itself.
+    """
+    if isinstance(parsed, dict):
+        if "answer" in parsed:
+            return parsed["answer"]
+        if len(parsed) == 1:
+            return next(iter(parsed.values()))
+    return parsed
+
+
+def answers_match(answer: Any, expected: str) -> bool:
+    """Loose comparison of an extracted answer with a user-entered expected value."""
+    if answer is None:
+        return False
+    if isinstance(answer, (int, float)) and not isinstance(answer, bool):
+        try:
+            return abs(float(answer) - float(expected)) <= 1e-9 * max(1.0, abs(float(expected)))
+        except ValueError:
+            return False
+    return str(answer).strip().lower() == expected.strip().lower()
+
+
+@dataclass
+class RunResult:
+    """
+    The outcome of executing one RunConfig.
+
+    Attributes:
+        config: The snapshot that was run
+        response: The API response dictionary
+        response_time: Wall-clock seconds spent in the API call
+        served_model: The model that actually produced the response
+        cost: Total cost in USD, when the provider reports or we can estimate it
+    """
+    config: RunConfig
+    response: Dict[str, Any]
+    response_time: float
+    served_model: str
+    cost: Optional[float] = None
+
+    @property
+    def content(self) -> str:
+        return response_content(self.response)
+
+    @property
+    def usage(self) -> Dict[str, Any]:
+        return self.response.get("usage") or {}
+
+    @property
+    def prompt_tokens(self) -> int:
+        return self.usage.get("prompt_tokens", 0)
+
+    @property
+    def completion_tokens(self) -> int:
+        return self.usage.get("completion_tokens", 0)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.usage.get("total_tokens", 0)
+
+    def validate(self) -> ValidationOutcome:
+        return validate_output(self.content, self.config.response_format())
+
+
+class RunEngine:
+    """
+    Executes RunConfig snapshots; safe to call from any thread.
+
+    With tools, a run whose config enables them becomes a loop: every tool call
+    in a reply is executed locally (concurrently when parallel_tools is set) and
+    the results are sent back until the model answers without calling tools.
+
+    With a resolver, lookups it can answer from local data (and that the config
+    lets it) never reach the router.
+
+    JSON runs that leave max_tokens empty get a budget sized from their schema
+    (see token_budget); a reply cut off by it is retried once with a larger one.
+    A streamed JSON run is parsed as it arrives and abandoned as soon as it
+    leaves its schema (see incremental_json).
+    """
+
+    def __init__(
+        self,
+        router: FallbackRouter,
+        tools: Optional[ToolRegistry] = None,
+        resolver: Optional[PreResolver] = None
+    ):
+        self.router = router
+        self.tools = tools
+        self.resolver = resolver
+        self.budget_stats = BudgetStats()
+
+    @profiled("execute")
+    @traced("execute", "run")
+    def execute(
+        self,
+        config: RunConfig,
+        cancel_token: Optional[CancelToken] = None,
+        on_delta: Optional[Callable[[str], None]] = None,
+        priority: str = INTERACTIVE,
+        on_field: Optional[Callable[[str, Any], None]] = None
+    ) -> RunResult:
+        """
+        Run one test.
+
+        Args:
+            config: The snapshot to run
+            cancel_token: Token that aborts the in-flight request
+            on_delta: Stream the response, passing each content fragment here as it arrives
+            priority: Scheduling class of the run's API calls (see scheduler.PRIORITY_WEIGHTS)
+            on_field: With on_delta and a JSON schema, called with each top-level
+                      property as soon as it is complete and valid
+
+        Returns:
+            RunResult for the call. After tool rounds, the response is the final
+            reply with usage summed over every call and the executed tools listed
+            under "local_tool_calls". A budgeted run reports its budget under
+            "token_budget", with usage including any truncated first attempt.
+            A stream abandoned for leaving its schema returns the content so far
+            with finish_reason "aborted" and the reason under "stream_aborted".
+
+        Raises:
+            RequestCancelled: If cancel_token was cancelled, even if a response raced it
+        """
+        if config.resolve_locally and self.resolver is not None:
+            start_time = time.monotonic()
+            with TRACER.span("resolve locally", "resolve", model=config.model) as span:
+                response = self.resolver.resolve(config)
+                span["resolved"] = response is not None
+            if response is not None:
+                if on_delta is not None:
+                    on_delta(response_content(response))
+                return RunResult(config, response, time.monotonic() - start_time, LOCAL_MODEL, cost=0.0)
+
+        plan = plan_budget(config)
+        budget = plan if config.auto_budget else None
+        # One deadline covers the whole call, including retries, fallbacks, tool rounds and a budget retry
+        deadline = Deadline(timeouts_for(config.model).total)
+        params = config.to_params()
+        if budget is not None:
+            params = budget.apply(params)
+
+        schema = extract_schema(config.response_format())
+        if on_delta is not None and schema is not None and not (config.enable_tools and self.tools):
+            # Tool rounds may carry prose before the answer, so only plain JSON runs are followed
+            on_delta = self._following(StreamValidator(schema, on_field), on_delta)
+
+        start_time = time.monotonic()
+        try:
+            routed, usage, trace = self._complete(config, params, deadline, cancel_token, on_delta, priority)
+        except StreamAborted as e:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            response = {
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": e.content},
+                             "finish_reason": "aborted"}],
+                "stream_aborted": e.message,
+            }
+            return self.account(RunResult(config, response, time.monotonic() - start_time, config.model))
+        retried = False
+        if budget is not None and budget.max_tokens is not None:
+            outcome = validate_output(response_content(routed.response), config.response_format())
+            if truncated(routed.response, outcome.is_json):
+                # The cut-off call was billed too; the retry is not streamed over its text
+                retried = True
+                first_usage = usage
+                routed, usage, trace = self._complete(config, dict(params, max_tokens=budget.retry_tokens),
+                                                      deadline, cancel_token, None, priority)
+                _add_usage(usage, first_usage)
+            metrics.record_budget(config.model, retried)
+        response_time = time.monotonic() - start_time
+
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+
+        response = routed.response
+        if trace or retried:
+            response = dict(response, usage=usage)
+        if trace:
+            response["local_tool_calls"] = trace
+        if plan is not None:
+            self.budget_stats.record(config, budget is not None, response_time)
+        if budget is not None:
+            response = dict(response, token_budget={
+                "estimate": budget.estimate,
+                "max_tokens": budget.retry_tokens if retried else budget.max_tokens,
+                "verbosity": budget.verbosity,
+                "retried": retried,
+                "latency_saved": self.budget_stats.latency_saved(config),
+            })
+        return self.account(RunResult(config, response, response_time, routed.served_model))
+
+    @staticmethod
+    def _following(validator: StreamValidator, on_delta: Callable[[str], None]) -> Callable[[str], None]:
+        def forward(text: str):
+            on_delta(text)
+            validator.feed(text)
+        return forward
+
+    def _complete(
+        self,
+        config: RunConfig,
+        params: Dict[str, Any],
+        deadline: Deadline,
+        cancel_token: Optional[CancelToken],
+        on_delta: Optional[Callable[[str], None]],
+        priority: str
+    ) -> Tuple[RoutedResponse, Dict[str, Any], List[Dict[str, Any]]]:
+        """One answer: a model call, plus the tool rounds it asks for when tools are enabled"""
+        use_tools = config.enable_tools and bool(self.tools)
+        if use_tools:
+            params = dict(params, tools=self.tools.specs(), parallel_tool_calls=config.parallel_tools)
+
+        model, allow_fallback = config.model, config.allow_fallback
+        usage: Dict[str, Any] = {}
+        trace: List[Dict[str, Any]] = []
+        for _ in range(MAX_TOOL_ROUNDS):
+            routed = self.router.complete(model, params, allow_fallback=allow_fallback,
+                                          deadline=deadline, cancel_token=cancel_token, on_delta=on_delta,
+                                          priority=priority)
+            _add_usage(usage, routed.response.get("usage") or {})
+            choices = routed.response.get("choices") or [{}]
+            message = choices[0].get("message") or {}
+            if not use_tools or not message.get("tool_calls"):
+                break
+
+            with TRACER.span("run tools", "tools", calls=len(message["tool_calls"])):
+                results = self.tools.execute(message["tool_calls"], config.parallel_tools, cancel_token)
+            for result in results:
+                trace.append(result.pop("trace"))
+            reply = {"role": "assistant", "content": message.get("content"), "tool_calls": message["tool_calls"]}
+            params = dict(params, messages=params["messages"] + [reply] + results)
+            # Tool call ids belong to the model that issued them
+            model, allow_fallback = routed.served_model, False
+        return routed, usage, trace
+
+    def account(self, result: RunResult) -> RunResult:
+        """Fill in the result's cost and count its usage in the metrics"""
+        result.cost = self.cost_of(result)
+        metrics.record_usage(result.served_model, result.usage, result.cost)
+        return result
+
+    def cost_of(self, result: RunResult) -> Optional[float]:
+        """Provider-reported cost (Perplexity), else an estimate from the OpenAI price table."""
+        cost = result.usage.get("cost")
+        if isinstance(cost, dict) and cost.get("total_cost") is not None:
+            return cost["total_cost"]
+
+        openai_client = self.router.clients.get("openai")
+        if (provider_for(result.served_model) == "openai" and openai_client is not None
+                and openai_client.get_model_info(result.served_model)):
+            return openai_client.estimate_cost(result.served_model, result.prompt_tokens,
+                                               result.completion_tokens)["total_cost"]
+        return None
+
+
+class RunRecord:
+    """
+    A queued run and its progress.
+
+    Status moves queued -> running -> done | failed | cancelled.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    def __init__(self, run_id: int, config: RunConfig):
+        self.run_id = run_id
+        self.config = config
+        self.status = self.QUEUED
+        self.cancel_token = CancelToken()
+        self.result: Optional[RunResult] = None
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in (self.QUEUED, self.RUNNING)
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+
+class RunQueue:
+    """
+    Bounded executor for RunConfig snapshots.
+
+    At most max_workers runs execute at once and at most max_pending wait behind
+    them; their API calls are scheduled as priority. on_update is called from
+    worker threads whenever a record changes status. With on_field, JSON runs
+    are streamed and on_field gets each top-level property as it completes.
+    """
+
+    def __init__(
+        self,
+        engine: RunEngine,
+        max_workers: int = 4,
+        max_pending: int = 32,
+        on_update: Optional[Callable[[RunRecord], None]] = None,
+        priority: str = INTERACTIVE,
+        on_field: Optional[Callable[[RunRecord, str, Any], None]] = None
+    ):
+        self.engine = engine
+        self.priority = priority
+        self.on_field = on_field
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.on_update = on_update
+        self.records: List[RunRecord] = []
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="run")
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _span_id(self, record: RunRecord) -> str:
+        # Run ids restart at 1 in every queue, and a sweep runs its own queue next to the GUI's
+        return f"queue {id(self):x} run {record.run_id}"
+
+    def active_count(self) -> int:
+        with self._lock:
+            return sum(1 for r in self.records if r.active)
+
+    def submit(self, config: RunConfig) -> RunRecord:
+        """
+        Queue a run.
+
+        Raises:
+            QueueFullError: If max_workers + max_pending runs are already active
+        """
+        with self._lock:
+            active = sum(1 for r in self.records if r.active)
+            if active >= self.max_workers + self.max_pending:
+                raise QueueFullError(f"Run queue is full ({active} runs active)")
+            record = RunRecord(next(self._ids), config)
+            self.records.append(record)
+
+        metrics.RUN_QUEUE.inc(status=RunRecord.QUEUED)
+        TRACER.begin("queued", "queue", self._span_id(record), model=config.model, priority=self.priority)
+        self._executor.submit(self._run, record)
+        return record
+
+    def get(self, run_id: int) -> Optional[RunRecord]:
+        with self._lock:
+            for record in self.records:
+                if record.run_id == run_id:
+                    return record
+        return None
+
+    def cancel(self, record: RunRecord):
+        if not record.active:
+            return
+        record.cancel_token.cancel()
+        if record.status == RunRecord.QUEUED:
+            # Never started: mark it now, _run will skip it
+            self._finish(record, RunRecord.CANCELLED)
+            TRACER.end("queued", "queue", self._span_id(record), cancelled=True)
+
+    def cancel_all(self):
+        with self._lock:
+            records = [r for r in self.records if r.active]
+        for record in records:
+            self.cancel(record)
+
+    def _finish(self, record: RunRecord, status: str, error: Optional[str] = None):
+        with self._lock:
+            if not record.active:
+                return
+            metrics.RUN_QUEUE.dec(status=record.status)
+            record.status = status
+            record.error = error
+            record.finished_at = time.time()
+        self._notify(record)
+
+    def _notify(self, record: RunRecord):
+        if self.on_update is not None:
+            self.on_update(record)
+
+    def _run(self, record: RunRecord):
+        with self._lock:
+            if record.status != RunRecord.QUEUED:
+                return
+            TRACER.end("queued", "queue", self._span_id(record))
+            record.status = RunRecord.RUNNING
+            record.started_at = time.time()
+            metrics.RUN_QUEUE.dec(status=RunRecord.QUEUED)
+            metrics.RUN_QUEUE.inc(status=RunRecord.RUNNING)
+        self._notify(record)
+
+        try:
+            record.result = self.engine.execute(record.config, record.cancel_token, **self._streaming(record),
+                                                priority=self.priority)
+        except RequestCancelled:
+            self._finish(record, RunRecord.CANCELLED)
+        except Exception as e:
+            self._finish(record, RunRecord.FAILED, str(e))
+        else:
+            self._finish(record, RunRecord.DONE)
+
+    def _streaming(self, record: RunRecord) -> Dict[str, Any]:
+        """
+        execute() arguments that stream a JSON run into on_field.
+
+        Streamed calls cannot be hedged, so runs whose provider has a hedge
+        policy are not streamed: with Hedge Slow Requests on, a slow call
+        gets a duplicate instead of early field display and schema aborts.
+        """
+        if self.on_field is None or extract_schema(record.config.response_format()) is None:
+            return {}
+        client = self.engine.router.clients.get(provider_for(record.config.model))
+        if client is not None and getattr(client, "hedge_policy", None) is not None:
+            return {}
+        return {
+            "on_delta": lambda text: None,
+            "on_field": lambda name, value: self.on_field(record, name, value),
+        }
+
+    def shutdown(self):
+        self.cancel_all()
+        self._executor.shutdown(wait=False)
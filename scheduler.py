@@ -0,0 +1,213 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import metrics
+from rate_limit import ProviderLimit, RateLimiter
+from request_control import CancelToken, Deadline, DeadlineExceeded, RequestCancelled
+from tracing import TRACER
+
+# Priority classes, from most to least urgent
+INTERACTIVE = "interactive"
+PIPELINE = "pipeline"
+BULK = "bulk"
+
+# Share of a provider's slots each class gets while all of them are waiting.
+# A Run click queues behind at most one bulk item; bulk still gets 1 slot in 21.
+PRIORITY_WEIGHTS = {INTERACTIVE: 16.0, PIPELINE: 4.0, BULK: 1.0}
+
+# Seconds between checks of a waiter's cancel token and deadline
+POLL_INTERVAL = 0.25
+
+
+class _Waiter:
+    __slots__ = ("tag", "seq", "priority")
+
+    def __init__(self, tag: float, seq: int, priority: str):
+        self.tag = tag
+        self.seq = seq
+        self.priority = priority
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.tag, self.seq) < (other.tag, other.seq)
+
+
+class FairQueue:
+    """
+    Weighted fair queue in front of one provider's concurrency slots and token bucket.
+
+    Each waiter gets a virtual finish tag: the later of the queue's virtual time
+    and its class's last tag, plus 1 / weight. Slots go to the smallest tag, so
+    classes share the provider in proportion to their weights while they all
+    have work queued, and an idle class's first request goes ahead of a backlog.
+    """
+
+    def __init__(self, provider: str, limit: ProviderLimit):
+        self.provider = provider
+        self.limit = limit
+        self.in_flight = 0
+        self.virtual_time = 0.0
+        self._last_tags: Dict[str, float] = {}
+        self._heap: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._ready = threading.Condition()
+
+    def waiting(self) -> Dict[str, int]:
+        with self._ready:
+            counts: Dict[str, int] = {}
+            for waiter in self._heap:
+                counts[waiter.priority] = counts.get(waiter.priority, 0) + 1
+            return counts
+
+    def _enqueue(self, priority: str) -> _Waiter:
+        tag = max(self.virtual_time, self._last_tags.get(priority, 0.0)) + 1.0 / PRIORITY_WEIGHTS[priority]
+        self._last_tags[priority] = tag
+        waiter = _Waiter(tag, next(self._seq), priority)
+        heapq.heappush(self._heap, waiter)
+        return waiter
+
+    def _withdraw(self, waiter: _Waiter):
+        self._heap.remove(waiter)
+        heapq.heapify(self._heap)
+        # Whoever is first now may be able to go
+        self._ready.notify_all()
+
+    def acquire(self, priority: str, cancel_token: Optional[CancelToken], deadline: Optional[Deadline]):
+        """
+        Block until this caller's turn comes and it has a slot and a rate token.
+
+        Raises:
+            RequestCancelled: If cancel_token is cancelled while waiting
+            DeadlineExceeded: If the wait would outlive the deadline
+        """
+        with self._ready:
+            waiter = self._enqueue(priority)
+            try:
+                while True:
+                    if cancel_token is not None and cancel_token.cancelled:
+                        raise RequestCancelled("Request cancelled")
+                    if deadline is not None and deadline.expired():
+                        raise DeadlineExceeded("Request deadline exceeded while waiting for rate limit")
+                    wait = POLL_INTERVAL
+                    if self._heap[0] is waiter and self.in_flight < self.limit.max_concurrency:
+                        delay = self.limit.bucket.try_acquire()
+                        if delay == 0:
+                            heapq.heappop(self._heap)
+                            self.in_flight += 1
+                            self.virtual_time = waiter.tag
+                            self._ready.notify_all()
+                            return
+                        if deadline is not None and delay >= deadline.remaining():
+                            raise DeadlineExceeded("Request deadline exceeded while waiting for rate limit")
+                        wait = min(delay, POLL_INTERVAL)
+                    self._ready.wait(wait)
+            except BaseException:
+                self._withdraw(waiter)
+                raise
+
+    def try_acquire(self, priority: str) -> bool:
+        """
+        Take a slot and a rate token without waiting, or return False.
+
+        Never jumps the queue: with anyone waiting the answer is False, so
+        optional calls (hedges) only use capacity nobody else has asked for.
+        """
+        with self._ready:
+            if self._heap or self.in_flight >= self.limit.max_concurrency:
+                return False
+            if self.limit.bucket.try_acquire() != 0:
+                return False
+            tag = max(self.virtual_time, self._last_tags.get(priority, 0.0)) + 1.0 / PRIORITY_WEIGHTS[priority]
+            self._last_tags[priority] = tag
+            self.virtual_time = tag
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._ready:
+            self.in_flight -= 1
+            self._ready.notify_all()
+
+
+class Scheduler(RateLimiter):
+    """
+    Shared per-provider rate limits that serve waiting calls by priority class.
+
+    Interactive runs (the GUI's Run button), pipeline work (jobs, the local
+    service) and bulk work (batches, sweeps) draw from the same per-provider
+    budgets. Within a provider, queued calls are served by weighted fair
+    queuing over PRIORITY_WEIGHTS: a new interactive call goes ahead of queued
+    bulk work, but bulk keeps getting its share instead of starving.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Dict[str, float]]] = None):
+        super().__init__(limits)
+        self.queues = {provider: FairQueue(provider, limit) for provider, limit in self.limits.items()}
+
+    def waiting(self) -> Dict[Tuple[str, str], int]:
+        """Calls queued for a slot, by (provider, priority)"""
+        return {(provider, priority): count
+                for provider, queue in self.queues.items()
+                for priority, count in queue.waiting().items()}
+
+    @contextmanager
+    def acquire(
+        self,
+        provider: str,
+        cancel_token: Optional[CancelToken] = None,
+        deadline: Optional[Deadline] = None,
+        priority: str = INTERACTIVE
+    ) -> Iterator[None]:
+        """
+        Block until provider can take another call from this priority class.
+
+        Args:
+            provider: Provider name; providers without a configured limit pass straight through
+            cancel_token: Abort the wait when cancelled
+            deadline: Give up once the deadline would pass
+            priority: INTERACTIVE, PIPELINE or BULK
+
+        Raises:
+            ValueError: If priority is not a known class
+            RequestCancelled: If cancel_token is cancelled while waiting
+            DeadlineExceeded: If the wait would outlive the deadline
+        """
+        if priority not in PRIORITY_WEIGHTS:
+            raise ValueError(f"Unknown priority: {priority}")
+        queue = self.queues.get(provider)
+        if queue is None:
+            yield
+            return
+
+        start = time.monotonic()
+        with TRACER.span("wait for slot", "rate_limit", provider=provider, priority=priority):
+            queue.acquire(priority, cancel_token, deadline)
+        metrics.SCHEDULER_WAIT.observe(time.monotonic() - start, provider=provider, priority=priority)
+        try:
+            yield
+        finally:
+            queue.release()
+
+    def try_acquire(self, provider: str, priority: str = INTERACTIVE) -> bool:
+        """
+        Take a slot for provider only if one is free and nobody is queued for it.
+
+        Returns:
+            True if taken (always, for providers without a limit); pair it with release()
+
+        Raises:
+            ValueError: If priority is not a known class
+        """
+        if priority not in PRIORITY_WEIGHTS:
+            raise ValueError(f"Unknown priority: {priority}")
+        queue = self.queues.get(provider)
+        return queue is None or queue.try_acquire(priority)
+
+    def release(self, provider: str):
+        """Give back a slot taken with try_acquire()"""
+        queue = self.queues.get(provider)
+        if queue is not None:
+            queue.release()
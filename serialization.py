@@ -0,0 +1,80 @@
+import io
+import json
+from typing import Any, IO, Union
+
+# orjson is optional; when installed it encodes/decodes several times faster
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so one except clause covers both
+JSONDecodeError = json.JSONDecodeError
+
+
+def dumps_bytes(obj: Any, indent: bool = False, sort_keys: bool = False) -> bytes:
+    """
+    Serialize obj to UTF-8 JSON bytes.
+
+    Args:
+        obj: JSON-serializable value
+        indent: Pretty-print with two-space indentation
+        sort_keys: Sort object keys (for canonical output)
+
+    Returns:
+        Encoded JSON
+    """
+    if orjson is not None:
+        option = 0
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, option=option)
+        except TypeError:
+            # e.g. integers beyond 64 bits or non-str keys - let the stdlib handle it
+            pass
+
+    if indent:
+        text = json.dumps(obj, indent=2, sort_keys=sort_keys, ensure_ascii=False)
+    else:
+        text = json.dumps(obj, separators=(",", ":"), sort_keys=sort_keys, ensure_ascii=False)
+    return text.encode("utf-8")
+
+
+def dumps(obj: Any, indent: bool = False, sort_keys: bool = False) -> str:
+    """Serialize obj to a JSON string (see dumps_bytes)."""
+    return dumps_bytes(obj, indent=indent, sort_keys=sort_keys).decode("utf-8")
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """
+    Deserialize JSON from bytes or str.
+
+    Bytes are decoded directly by orjson without building an intermediate str.
+
+    Raises:
+        JSONDecodeError: If data is not valid JSON
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def dump(obj: Any, fp: IO, indent: bool = False, sort_keys: bool = False):
+    """Write obj as JSON to a text or binary file object."""
+    data = dumps_bytes(obj, indent=indent, sort_keys=sort_keys)
+    if isinstance(fp, io.TextIOBase):
+        fp.write(data.decode("utf-8"))
+    else:
+        fp.write(data)
+
+
+def load(fp: IO) -> Any:
+    """Read JSON from a text or binary file object."""
+    return loads(fp.read())
@@ -0,0 +1,352 @@
+import argparse
+import asyncio
+import itertools
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+import serialization
+from batch_runner import build_engine
+from request_control import CancelToken, ConnectionWarmer, RequestCancelled
+from response_cache import DEFAULT_TTL, ResponseCache
+from run_config import RunConfig
+from run_engine import RunEngine, RunResult
+from scheduler import PIPELINE, PRIORITY_WEIGHTS
+from tracing import export_on_exit
+
+DEFAULT_PORT = 8765
+
+# Calls executing at once; matches the sum of the default provider concurrency limits
+DEFAULT_WORKERS = 16
+
+# Runs accepted (executing or waiting for a worker) before new ones get 503
+DEFAULT_MAX_PENDING = 256
+
+# Finished results kept for GET /runs/<id>
+RESULTS_KEPT = 1000
+
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+
+class HTTPError(Exception):
+    """A request the service rejects; sent to the client as {"error": message}."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def parse_run_request(request: Any) -> Tuple[RunConfig, bool, bool, str]:
+    """
+    Read a POST /run body.
+
+    The body is either a saved test, exactly as Save Test writes it, or
+    {"config": {...}} with RunConfig fields. Either form may add "stream": true
+    (server-sent events), "cache": false (always call the API) and "priority"
+    ("interactive", "pipeline" or "bulk"; default "pipeline").
+
+    Returns:
+        (config, stream, use_cache, priority)
+
+    Raises:
+        HTTPError: If the body is not a usable request
+    """
+    if not isinstance(request, dict):
+        raise HTTPError(400, "Body must be a JSON object")
+    try:
+        if "config" in request:
+            config = RunConfig(**request["config"])
+        else:
+            config = RunConfig.from_test_data(request)
+    except (TypeError, ValueError) as e:
+        raise HTTPError(400, f"Invalid request: {e}")
+    if not config.model or not config.prompt:
+        raise HTTPError(400, "A model and a prompt are required")
+    priority = request.get("priority", PIPELINE)
+    if not isinstance(priority, str) or priority not in PRIORITY_WEIGHTS:
+        raise HTTPError(400, f"Unknown priority: {priority}")
+    return config, bool(request.get("stream", False)), bool(request.get("cache", True)), priority
+
+
+def result_payload(run_id: int, result: RunResult, cached: bool) -> Dict[str, Any]:
+    outcome = result.validate() if result.config.use_json else None
+    return {
+        "run_id": run_id,
+        "model": result.config.model,
+        "served_model": result.served_model,
+        "response_time": result.response_time,
+        "cost": result.cost,
+        "cached": cached,
+        "content": result.content,
+        "valid": outcome.valid if outcome else None,
+        "validation_error": outcome.error if outcome else None,
+        "response": result.response,
+    }
+
+
+async def send_json(writer: asyncio.StreamWriter, status: int, payload: Any):
+    body = serialization.dumps_bytes(payload)
+    head = (f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n")
+    writer.write(head.encode("ascii") + body)
+    await writer.drain()
+
+
+async def read_request(reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes]:
+    """
+    Read one HTTP/1.1 request.
+
+    Returns:
+        (method, path without query, lower-cased headers, body)
+
+    Raises:
+        HTTPError: If the request is malformed or too large
+    """
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.LimitOverrunError:
+        raise HTTPError(431, "Request headers too large")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, "Request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target.split("?", 1)[0], headers, body
+
+
+async def _start_events(writer: asyncio.StreamWriter):
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                 b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+    await writer.drain()
+
+
+async def _send_event(writer: asyncio.StreamWriter, event: str, payload: Any):
+    writer.write(f"event: {event}\ndata: {serialization.dumps(payload)}\n\n".encode("utf-8"))
+    await writer.drain()
+
+
+async def _until_hangup(reader: asyncio.StreamReader):
+    # Each connection carries one request, so anything after it is ignored until EOF
+    while await reader.read(1024):
+        pass
+
+
+class TesterService:
+    """
+    Local HTTP front end to a RunEngine.
+
+    Every connection is a coroutine on one event loop; only the API calls
+    themselves run on a fixed pool of worker threads, because the engine's
+    clients block. All callers share the engine's pooled sessions, rate limiter
+    and circuit breakers, plus one ResponseCache and one results store. Service
+    state is only touched on the loop thread.
+
+    Endpoints:
+        POST /run       Run a saved test or {"config": {...}} (see parse_run_request)
+        GET  /runs/<id> A finished run's result
+        GET  /health    Configured providers and load
+
+    A client that disconnects before its result is ready cancels the call.
+    """
+
+    def __init__(
+        self,
+        engine: RunEngine,
+        cache: Optional[ResponseCache] = None,
+        max_workers: int = DEFAULT_WORKERS,
+        max_pending: int = DEFAULT_MAX_PENDING
+    ):
+        self.engine = engine
+        self.cache = cache if cache is not None else ResponseCache()
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="service")
+        self._ids = itertools.count(1)
+        self._warmer = ConnectionWarmer()
+        self._results: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT):
+        self._warmer.keep_warm([(client.session, client.base_url)
+                                for client in self.engine.router.clients.values() if client is not None])
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_HEADER_BYTES)
+        print(f"Serving on http://{host}:{port}", flush=True)
+        async with server:
+            await server.serve_forever()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            method, path, _, body = await read_request(reader)
+            await self._dispatch(method, path, body, reader, writer)
+        except HTTPError as e:
+            await send_json(writer, e.status, {"error": e.message})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _dispatch(self, method: str, path: str, body: bytes,
+                        reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if path == "/run":
+            if method != "POST":
+                raise HTTPError(405, "Use POST")
+            try:
+                request = serialization.loads(body)
+            except serialization.JSONDecodeError as e:
+                raise HTTPError(400, f"Invalid JSON: {e}")
+            await self._run(request, reader, writer)
+        elif path.startswith("/runs/") and method == "GET":
+            try:
+                payload = self._results.get(int(path[len("/runs/"):]))
+            except ValueError:
+                payload = None
+            if payload is None:
+                raise HTTPError(404, "Unknown or expired run id")
+            await send_json(writer, 200, payload)
+        elif path == "/health" and method == "GET":
+            await send_json(writer, 200, {
+                "status": "ok",
+                "providers": {name: client is not None for name, client in self.engine.router.clients.items()},
+                "pending": self.pending,
+                "cached": len(self.cache),
+            })
+        else:
+            raise HTTPError(404, f"No route for {method} {path}")
+
+    def _store(self, run_id: int, result: RunResult, cached: bool) -> Dict[str, Any]:
+        payload = result_payload(run_id, result, cached)
+        self._results[run_id] = payload
+        while len(self._results) > RESULTS_KEPT:
+            self._results.popitem(last=False)
+        return payload
+
+    async def _run(self, request: Any, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        config, stream, use_cache, priority = parse_run_request(request)
+        run_id = next(self._ids)
+
+        result = self.cache.get(config) if use_cache else None
+        if result is not None:
+            payload = self._store(run_id, result, cached=True)
+            if stream:
+                await _start_events(writer)
+                if result.content:
+                    await _send_event(writer, "delta", {"content": result.content})
+                await _send_event(writer, "result", payload)
+            else:
+                await send_json(writer, 200, payload)
+            return
+
+        if self.pending >= self.max_pending:
+            raise HTTPError(503, f"{self.pending} runs in progress; try again later")
+
+        loop = asyncio.get_running_loop()
+        cancel_token = CancelToken()
+        # Deltas hop from the worker thread to the loop; None marks the end of the call
+        deltas: asyncio.Queue = asyncio.Queue()
+        on_delta = (lambda text: loop.call_soon_threadsafe(deltas.put_nowait, text)) if stream else None
+
+        self.pending += 1
+        future = loop.run_in_executor(self._executor, self.engine.execute, config, cancel_token, on_delta, priority)
+        future.add_done_callback(lambda f: deltas.put_nowait(None))
+        hangup = asyncio.ensure_future(_until_hangup(reader))
+        try:
+            if stream:
+                await _start_events(writer)
+                await self._forward_deltas(deltas, hangup, writer)
+            else:
+                await asyncio.wait({future, hangup}, return_when=asyncio.FIRST_COMPLETED)
+        except ConnectionError:
+            pass
+        if not future.done():
+            # The client hung up; stop paying for an answer nobody will read
+            cancel_token.cancel()
+        hangup.cancel()
+
+        try:
+            result = await future
+        except RequestCancelled:
+            return
+        except Exception as e:
+            error = {"run_id": run_id, "error": str(e), "status_code": getattr(e, "status_code", None)}
+            if stream:
+                await _send_event(writer, "error", error)
+            else:
+                await send_json(writer, 502, error)
+            return
+        finally:
+            self.pending -= 1
+
+        self.cache.put(result)
+        payload = self._store(run_id, result, cached=False)
+        if stream:
+            await _send_event(writer, "result", payload)
+        else:
+            await send_json(writer, 200, payload)
+
+    async def _forward_deltas(self, deltas: asyncio.Queue, hangup: asyncio.Future,
+                              writer: asyncio.StreamWriter):
+        while True:
+            getter = asyncio.ensure_future(deltas.get())
+            await asyncio.wait({getter, hangup}, return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                return
+            text = getter.result()
+            if text is None:
+                return
+            await _send_event(writer, "delta", {"content": text})
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Serve the tester's run engine over local HTTP")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind (default localhost only)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port (default {DEFAULT_PORT})")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"API calls executing at once (default {DEFAULT_WORKERS})")
+    parser.add_argument("--cache-ttl", type=float, default=DEFAULT_TTL,
+                        help=f"Seconds a result is reused for identical requests; 0 disables (default {DEFAULT_TTL:g})")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this localhost port")
+    parser.add_argument("--http2", action="store_true",
+                        help="Multiplex API calls over HTTP/2 (needs httpx and h2)")
+    parser.add_argument("--trace", help="Write a Chrome trace of every request stage to this file on exit")
+    args = parser.parse_args(argv)
+
+    export_on_exit(args.trace)
+    if args.metrics_port:
+        metrics.start_server(args.metrics_port)
+    service = TesterService(build_engine(args.http2), ResponseCache(ttl=args.cache_ttl), max_workers=args.workers)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
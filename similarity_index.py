@@ -0,0 +1,337 @@
+import argparse
+import difflib
+import hashlib
+import os
+import random
+import re
+import sys
+import threading
+import zlib
+from typing import Any, Dict, List, Sequence, Tuple
+
+import compact_store
+import metrics
+from routing import translate_params
+from run_config import RunConfig
+
+# numpy is optional; without it a lookup takes ~10 ms instead of well under 1 ms
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Requests at least this similar (estimated Jaccard of prompt shingles) count as near-duplicates
+DEFAULT_THRESHOLD = 0.85
+
+# Characters per shingle; short enough that a one-letter typo changes only a handful
+SHINGLE_SIZE = 5
+
+# Saved tests are flagged at a lower similarity; flagging costs nothing if wrong
+LIBRARY_THRESHOLD = 0.55
+
+# NUM_PERM = BANDS * ROWS. 128 values estimate similarity to about +-0.04;
+# 32 bands of 4 rows make pairs at 0.85 candidates with probability > 0.9999
+# and pairs at 0.3 with probability < 0.25 (candidates are then checked)
+NUM_PERM = 128
+BANDS = 32
+
+_MASK64 = (1 << 64) - 1
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def normalize(text: str) -> str:
+    """Lowercase and collapse punctuation and whitespace, so formatting edits don't count"""
+    return " ".join(_WORD.findall(text.lower()))
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> List[int]:
+    """CRC32 hashes of the distinct character shingles of normalized text"""
+    text = normalize(text)
+    if len(text) <= size:
+        return [zlib.crc32(text.encode("utf-8"))]
+    data = text.encode("utf-8")
+    return list({zlib.crc32(data[i:i + size]) for i in range(len(data) - size + 1)})
+
+
+def params_key(config: RunConfig) -> str:
+    """
+    Hash of everything sent except the user prompt; equal keys mean only its wording differs.
+
+    The system prompt counts as a setting: it usually carries the output
+    instructions, which change the answer more than the question's wording.
+    """
+    params = translate_params(config.to_params(), config.model)
+    params["messages"] = config.system_prompt
+    # Tools and the output budget are applied by the engine, not to_params
+    params["enable_tools"] = config.enable_tools
+    params["auto_budget"] = config.auto_budget
+    return hashlib.sha256(compact_store.canonical_bytes(params)).hexdigest()
+
+
+def word_differences(old: str, new: str, limit: int = 3) -> List[str]:
+    """
+    The first few word-level edits turning old into new, e.g. '"Notew" -> "Note"'.
+
+    Shown next to a reuse offer: a near-duplicate prompt with a different
+    address is not the same question.
+    """
+    old_words, new_words = old.split(), new.split()
+    changes = []
+    matcher = difflib.SequenceMatcher(None, old_words, new_words, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        before = " ".join(old_words[i1:i2])
+        after = " ".join(new_words[j1:j2])
+        changes.append(f'"{before}" -> "{after}"' if before and after
+                       else f'added "{after}"' if after else f'removed "{before}"')
+        if len(changes) == limit:
+            break
+    return changes
+
+
+class Match:
+    """
+    An indexed request similar to a query.
+
+    Attributes:
+        config: The indexed request
+        payload: Whatever was stored with it (a RunResult, a file path, ...)
+        similarity: Estimated Jaccard similarity of the prompt shingles, 0-1
+        same_params: True when every other setting is identical
+    """
+
+    def __init__(self, config: RunConfig, payload: Any, similarity: float, same_params: bool):
+        self.config = config
+        self.payload = payload
+        self.similarity = similarity
+        self.same_params = same_params
+
+
+class SimilarityIndex:
+    """
+    MinHash/LSH index of requests for finding near-duplicates.
+
+    Each request's user prompt is reduced to a NUM_PERM-value MinHash signature
+    whose agreement with another signature estimates the Jaccard similarity of
+    their shingle sets. Signatures are split into BANDS bands and bucketed, so
+    a query only compares against requests sharing at least one band: lookup
+    cost depends on the number of near-duplicates, not the size of the index.
+
+    A request with the same text and parameters as an indexed one replaces its
+    payload, so repeated runs keep the index at one entry per distinct request.
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, bands: int = BANDS, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        # Multiply-shift hash family: h(x) = ((a * x + b) mod 2**64) >> 32, a odd
+        rng = random.Random(seed)
+        self._a = [rng.getrandbits(64) | 1 for _ in range(num_perm)]
+        self._b = [rng.getrandbits(64) for _ in range(num_perm)]
+        if numpy is not None:
+            self._a_array = numpy.array(self._a, dtype=numpy.uint64)[:, None]
+            self._b_array = numpy.array(self._b, dtype=numpy.uint64)[:, None]
+
+        self._configs: List[RunConfig] = []
+        self._payloads: List[Any] = []
+        self._params: List[str] = []
+        self._signatures: List[Tuple[int, ...]] = []
+        # With numpy, signatures are matrix rows instead, so candidates are scored in one comparison
+        self._matrix = numpy.empty((64, num_perm), dtype=numpy.uint64) if numpy is not None else None
+        self._buckets: List[Dict[Tuple[int, ...], List[int]]] = [{} for _ in range(bands)]
+        self._exact: Dict[Tuple[bytes, str], int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._configs)
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        hashes = shingles(text)
+        if numpy is not None:
+            values = numpy.array(hashes, dtype=numpy.uint64)[None, :]
+            # uint64 arithmetic wraps, which is the mod 2**64 the hash family needs
+            with numpy.errstate(over="ignore"):
+                mins = ((self._a_array * values + self._b_array) >> numpy.uint64(32)).min(axis=1)
+            return tuple(mins.tolist())
+        return tuple(min(((a * h + b) & _MASK64) >> 32 for h in hashes)
+                     for a, b in zip(self._a, self._b))
+
+    def _band_keys(self, signature: Tuple[int, ...]) -> List[Tuple[int, ...]]:
+        return [signature[i * self.rows:(i + 1) * self.rows] for i in range(self.bands)]
+
+    def add(self, config: RunConfig, payload: Any = None) -> int:
+        """
+        Index a request.
+
+        Returns:
+            The entry id (an existing one if the request was already indexed)
+        """
+        key = (hashlib.sha1(normalize(config.prompt).encode("utf-8")).digest(), params_key(config))
+        signature = self.signature(config.prompt)
+        with self._lock:
+            entry = self._exact.get(key)
+            if entry is not None:
+                self._configs[entry] = config
+                self._payloads[entry] = payload
+                return entry
+            entry = len(self._configs)
+            self._exact[key] = entry
+            self._configs.append(config)
+            self._payloads.append(payload)
+            self._params.append(key[1])
+            if self._matrix is not None:
+                if entry == len(self._matrix):
+                    self._matrix = numpy.concatenate((self._matrix, numpy.empty_like(self._matrix)))
+                self._matrix[entry] = signature
+            else:
+                self._signatures.append(signature)
+            for bucket, band in zip(self._buckets, self._band_keys(signature)):
+                bucket.setdefault(band, []).append(entry)
+        return entry
+
+    def query(
+        self,
+        config: RunConfig,
+        threshold: float = DEFAULT_THRESHOLD,
+        same_params: bool = False,
+        limit: int = 5
+    ) -> List[Match]:
+        """
+        Find indexed requests whose prompts are near-duplicates of config's.
+
+        Args:
+            config: The request about to be sent (or saved)
+            threshold: Minimum estimated similarity
+            same_params: Only return requests whose other settings are identical,
+                i.e. ones whose result could stand in for this request's
+            limit: Maximum matches returned
+
+        Returns:
+            Matches, most similar first
+        """
+        signature = self.signature(config.prompt)
+        key = params_key(config)
+        with self._lock:
+            candidates = set()
+            for bucket, band in zip(self._buckets, self._band_keys(signature)):
+                candidates.update(bucket.get(band, ()))
+            if same_params:
+                candidates = [entry for entry in candidates if self._params[entry] == key]
+            else:
+                candidates = list(candidates)
+            if self._matrix is not None and candidates:
+                agreement = (self._matrix[candidates] == numpy.array(signature, dtype=numpy.uint64)).sum(axis=1)
+                similarities = (agreement / self.num_perm).tolist()
+            else:
+                similarities = [sum(1 for x, y in zip(signature, self._signatures[entry]) if x == y) / self.num_perm
+                                for entry in candidates]
+            matches = [Match(self._configs[entry], self._payloads[entry], similarity, self._params[entry] == key)
+                       for entry, similarity in zip(candidates, similarities) if similarity >= threshold]
+        matches.sort(key=lambda match: (match.similarity, match.same_params), reverse=True)
+        metrics.record_cache("similar_requests", bool(matches))
+        return matches[:limit]
+
+
+def _test_files(paths: Sequence[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if name.endswith((".json", compact_store.COMPACT_EXTENSION)))
+        else:
+            files.append(path)
+    return files
+
+
+def _library_configs(paths: Sequence[str]) -> List[Tuple[str, RunConfig]]:
+    """(path, config) for every readable saved test with a prompt"""
+    configs = []
+    for path in _test_files(paths):
+        try:
+            config = RunConfig.from_test_data(compact_store.load(path))
+        except (OSError, ValueError) as e:
+            print(f"Skipping {path}: {e}", file=sys.stderr)
+            continue
+        if config.prompt.strip():
+            configs.append((path, config))
+    return configs
+
+
+def _library_index() -> SimilarityIndex:
+    # Narrow bands: libraries are small, and pairs near a low threshold must not slip through
+    return SimilarityIndex(bands=NUM_PERM // 2)
+
+
+def find_similar_tests(
+    config: RunConfig,
+    paths: Sequence[str],
+    threshold: float = LIBRARY_THRESHOLD
+) -> List[Match]:
+    """
+    Saved tests whose prompts are near-duplicates of config's.
+
+    Args:
+        config: The test about to be saved
+        paths: Saved test files or directories of them
+        threshold: Minimum estimated similarity
+
+    Returns:
+        Matches (payload is the file path), most similar first
+    """
+    index = _library_index()
+    for path, other in _library_configs(paths):
+        index.add(other, path)
+    return index.query(config, threshold, limit=max(len(index), 1))
+
+
+def find_library_duplicates(
+    paths: Sequence[str],
+    threshold: float = LIBRARY_THRESHOLD
+) -> List[Tuple[str, str, float, bool]]:
+    """
+    Near-duplicate pairs among saved tests.
+
+    Args:
+        paths: Saved test files or directories of them
+        threshold: Minimum estimated similarity
+
+    Returns:
+        (earlier file, later file, similarity, same settings) per pair, most similar first
+    """
+    index = _library_index()
+    pairs = []
+    for path, config in _library_configs(paths):
+        for match in index.query(config, threshold, limit=max(len(index), 1)):
+            pairs.append((match.payload, path, match.similarity, match.same_params))
+        index.add(config, path)
+    pairs.sort(key=lambda pair: pair[2], reverse=True)
+    return pairs
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="List near-duplicate saved tests")
+    parser.add_argument("paths", nargs="+", help="Saved test files or directories")
+    parser.add_argument("--threshold", type=float, default=LIBRARY_THRESHOLD,
+                        help=f"Minimum similarity, 0-1 (default {LIBRARY_THRESHOLD})")
+    args = parser.parse_args(argv)
+
+    pairs = find_library_duplicates(args.paths, args.threshold)
+    if not pairs:
+        print("No near-duplicates found")
+        return 0
+    for first, second, similarity, same in pairs:
+        settings = "same settings" if same else "different settings"
+        print(f"{similarity:4.0%}  {first}  ~  {second}  ({settings})")
+        first_prompt = RunConfig.from_test_data(compact_store.load(first)).prompt
+        second_prompt = RunConfig.from_test_data(compact_store.load(second)).prompt
+        for change in word_differences(first_prompt, second_prompt):
+            print(f"      {change}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
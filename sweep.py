@@ -0,0 +1,234 @@
+import itertools
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from compact_store import canonical_bytes
+from routing import GPT5_MODELS, provider_for, translate_params
+from run_config import RunConfig
+from run_engine import RunEngine, RunQueue, RunRecord, answers_match, extract_answer
+from scheduler import BULK
+
+# Values each sweepable RunConfig field accepts; temperature is any float in the range
+SWEEP_AXES = {
+    "context_size": ["low", "medium", "high"],
+    "recency_filter": ["none", "hour", "day", "week", "month"],
+    "temperature": (0.0, 2.0),
+    "reasoning_effort": ["minimal", "low", "medium", "high"],
+    "verbosity": ["low", "medium", "high"],
+}
+
+# Axes that reach the wire for each provider (see routing.translate_params)
+PROVIDER_AXES = {
+    "perplexity": ["context_size", "recency_filter", "temperature"],
+    "openai": ["temperature", "reasoning_effort", "verbosity"],
+}
+
+# Guard against fat-fingered grids burning through the API budget
+MAX_SWEEP_POINTS = 64
+
+
+def parse_axis(axis: str, text: str) -> List[Any]:
+    """
+    Parse a comma-separated list of values for one sweep axis.
+
+    Args:
+        axis: Key of SWEEP_AXES
+        text: User input such as "low, high" or "0, 0.5, 1.0"
+
+    Returns:
+        The distinct values in input order
+
+    Raises:
+        ValueError: If a value is not allowed for the axis
+    """
+    values = []
+    for item in (part.strip() for part in text.split(",")):
+        if not item:
+            continue
+        if axis == "temperature":
+            low, high = SWEEP_AXES[axis]
+            try:
+                value = float(item)
+            except ValueError:
+                raise ValueError(f"temperature: '{item}' is not a number")
+            if not low <= value <= high:
+                raise ValueError(f"temperature: {value} is outside {low}-{high}")
+        else:
+            value = item.lower()
+            if value not in SWEEP_AXES[axis]:
+                raise ValueError(f"{axis}: '{item}' is not one of {', '.join(SWEEP_AXES[axis])}")
+        if value not in values:
+            values.append(value)
+    return values
+
+
+def relevant_axes(model: str) -> List[str]:
+    """Sweep axes that change the request actually sent for model."""
+    axes = PROVIDER_AXES[provider_for(model)]
+    if model in GPT5_MODELS:
+        # GPT-5 only runs at its fixed temperature
+        axes = [axis for axis in axes if axis != "temperature"]
+    return axes
+
+
+class SweepPoint:
+    """
+    One configuration in a sweep grid.
+
+    Attributes:
+        config: The snapshot to run
+        varied: The swept axes and their values for this point
+    """
+
+    def __init__(self, config: RunConfig, varied: Dict[str, Any]):
+        self.config = config
+        self.varied = varied
+
+    def label(self) -> str:
+        if not self.varied:
+            return "(base)"
+        return ", ".join(f"{axis}={value}" for axis, value in self.varied.items())
+
+
+def expand_grid(base: RunConfig, grid: Dict[str, List[Any]]) -> List[SweepPoint]:
+    """
+    Build the cartesian product of grid over base, pruned for base.model.
+
+    Axes the model's provider ignores are dropped before expansion, and points
+    whose translated request is identical to an earlier point are skipped, so
+    every returned point sends a distinct request.
+
+    Args:
+        base: Snapshot supplying every non-swept field
+        grid: Axis name -> values to try
+
+    Returns:
+        The distinct sweep points
+
+    Raises:
+        ValueError: If the grid expands to more than MAX_SWEEP_POINTS points
+    """
+    axes = [axis for axis in relevant_axes(base.model) if grid.get(axis)]
+    points = []
+    seen = set()
+    for combo in itertools.product(*(grid[axis] for axis in axes)):
+        varied = dict(zip(axes, combo))
+        config = base.with_changes(**varied)
+        key = canonical_bytes(translate_params(config.to_params(), config.model))
+        if key in seen:
+            continue
+        seen.add(key)
+        points.append(SweepPoint(config, varied))
+        if len(points) > MAX_SWEEP_POINTS:
+            raise ValueError(f"Sweep grid has more than {MAX_SWEEP_POINTS} points; narrow it down")
+    return points
+
+
+class SweepRow:
+    """
+    A sweep point and the metrics of its run.
+
+    Metrics are None until the run finishes successfully.
+    """
+
+    def __init__(self, index: int, point: SweepPoint, record: RunRecord):
+        self.index = index
+        self.point = point
+        self.record = record
+        self.latency: Optional[float] = None
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.cost: Optional[float] = None
+        self.valid: Optional[bool] = None
+        self.correct: Optional[bool] = None
+        self.answer: Any = None
+
+    @property
+    def status(self) -> str:
+        return self.record.status
+
+    def score(self, expected: Optional[str]):
+        """Fill in the metrics from the finished run"""
+        result = self.record.result
+        self.latency = result.response_time
+        self.prompt_tokens = result.prompt_tokens
+        self.completion_tokens = result.completion_tokens
+        self.cost = result.cost
+
+        outcome = result.validate()
+        self.valid = outcome.valid
+        if outcome.is_json:
+            self.answer = extract_answer(outcome.parsed)
+        else:
+            self.answer = result.content.strip()
+        if expected:
+            self.correct = answers_match(self.answer, expected)
+
+    @property
+    def acceptable(self) -> bool:
+        """Finished, valid, and correct when an expected answer was given"""
+        return self.status == RunRecord.DONE and bool(self.valid) and self.correct is not False
+
+
+class Sweep:
+    """
+    Runs every point of a grid concurrently on a private RunQueue.
+
+    The queue shares the caller's RunEngine, so the router's rate limiter and
+    circuit breakers apply across the sweep and any other runs in flight; sweep
+    calls are scheduled as bulk work, so a Run click does not wait behind them.
+    on_update is called from worker threads whenever a row changes status.
+    """
+
+    def __init__(
+        self,
+        engine: RunEngine,
+        points: List[SweepPoint],
+        expected: Optional[str] = None,
+        max_workers: int = 6,
+        on_update: Optional[Callable[[SweepRow], None]] = None
+    ):
+        self.points = points
+        self.expected = expected.strip() if expected else None
+        self.on_update = on_update
+        self.rows: List[SweepRow] = []
+        self._rows_by_run: Dict[int, SweepRow] = {}
+        self._lock = threading.Lock()
+        self.queue = RunQueue(engine, max_workers=max_workers,
+                              max_pending=len(points), on_update=self._on_record, priority=BULK)
+
+    def start(self):
+        # Hold the lock so a fast worker cannot report before its row exists
+        with self._lock:
+            for index, point in enumerate(self.points, start=1):
+                record = self.queue.submit(point.config)
+                row = SweepRow(index, point, record)
+                self.rows.append(row)
+                self._rows_by_run[record.run_id] = row
+
+    def _on_record(self, record: RunRecord):
+        with self._lock:
+            row = self._rows_by_run.get(record.run_id)
+        if row is None:
+            return
+        if record.status == RunRecord.DONE:
+            row.score(self.expected)
+        if self.on_update is not None:
+            self.on_update(row)
+
+    @property
+    def finished(self) -> bool:
+        return self.queue.active_count() == 0
+
+    def best(self) -> Optional[SweepRow]:
+        """The fastest acceptable row, if any has finished"""
+        acceptable = [row for row in self.rows if row.acceptable]
+        if not acceptable:
+            return None
+        return min(acceptable, key=lambda row: row.latency)
+
+    def cancel(self):
+        self.queue.cancel_all()
+
+    def shutdown(self):
+        self.queue.shutdown()
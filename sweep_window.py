@@ -0,0 +1,219 @@
+import tkinter as tk
+from tkinter import ttk, messagebox
+from typing import Callable, Optional
+
+import customtkinter as ctk
+
+from run_config import RunConfig
+from run_engine import RunEngine, RunRecord, RunResult
+from sweep import SWEEP_AXES, Sweep, SweepRow, expand_grid, parse_axis, relevant_axes
+
+AXIS_LABELS = {
+    "context_size": "Context Size",
+    "recency_filter": "Recency Filter",
+    "temperature": "Temperature",
+    "reasoning_effort": "Reasoning Effort",
+    "verbosity": "Verbosity",
+}
+
+COLUMNS = (
+    ("point", "#", 40),
+    ("settings", "Settings", 280),
+    ("status", "Status", 80),
+    ("latency", "Latency (s)", 80),
+    ("prompt_tokens", "In Tokens", 75),
+    ("completion_tokens", "Out Tokens", 75),
+    ("cost", "Cost ($)", 80),
+    ("valid", "Valid", 50),
+    ("correct", "Correct", 60),
+    ("answer", "Answer", 180),
+)
+
+
+def _mark(value: Optional[bool]) -> str:
+    if value is None:
+        return ""
+    return "✓" if value else "✗"
+
+
+class SweepWindow(ctk.CTkToplevel):
+    """
+    Runs a grid of settings for the current prompt and tabulates the results.
+
+    The base snapshot is taken when the window opens; only the swept axes differ
+    between rows. on_open is called with a row's RunResult when it is double-clicked.
+    """
+
+    def __init__(
+        self,
+        master,
+        engine: RunEngine,
+        base: RunConfig,
+        on_open: Optional[Callable[[RunResult], None]] = None
+    ):
+        super().__init__(master)
+        self.title(f"Parameter Sweep - {base.model}")
+        self.geometry("1100x600")
+
+        self.engine = engine
+        self.base = base
+        self.on_open = on_open
+        self.sweep: Optional[Sweep] = None
+        self.sort_column = "point"
+        self.sort_reverse = False
+
+        self.setup_ui()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def setup_ui(self):
+        grid_frame = ctk.CTkFrame(self)
+        grid_frame.pack(fill=tk.X, padx=10, pady=10)
+
+        axes = relevant_axes(self.base.model)
+        self.axis_entries = {}
+        for row, axis in enumerate(axes):
+            ctk.CTkLabel(grid_frame, text=f"{AXIS_LABELS[axis]}:").grid(row=row, column=0, padx=5, pady=2, sticky="w")
+            entry = ctk.CTkEntry(grid_frame, width=300)
+            entry.insert(0, str(getattr(self.base, axis)))
+            entry.grid(row=row, column=1, padx=5, pady=2, sticky="w")
+            choices = SWEEP_AXES[axis]
+            hint = f"{choices[0]}-{choices[1]}" if axis == "temperature" else ", ".join(choices)
+            ctk.CTkLabel(grid_frame, text=hint, text_color="gray").grid(row=row, column=2, padx=5, sticky="w")
+            self.axis_entries[axis] = entry
+
+        ctk.CTkLabel(grid_frame, text="Expected Answer:").grid(row=len(axes), column=0, padx=5, pady=2, sticky="w")
+        self.expected_entry = ctk.CTkEntry(grid_frame, width=300,
+                                           placeholder_text="Optional; checks the answer field")
+        self.expected_entry.grid(row=len(axes), column=1, padx=5, pady=2, sticky="w")
+
+        button_frame = ctk.CTkFrame(self)
+        button_frame.pack(fill=tk.X, padx=10)
+
+        self.run_button = ctk.CTkButton(button_frame, text="Run Sweep", command=self.start_sweep,
+                                        width=120)
+        self.run_button.pack(side=tk.LEFT, padx=5, pady=5)
+
+        self.cancel_button = ctk.CTkButton(button_frame, text="Cancel", command=self.cancel_sweep,
+                                           width=100, state="disabled")
+        self.cancel_button.pack(side=tk.LEFT, padx=5, pady=5)
+
+        self.status_label = ctk.CTkLabel(button_frame, text="Comma-separate the values to try for each setting")
+        self.status_label.pack(side=tk.LEFT, padx=10)
+
+        self.tree = ttk.Treeview(self, columns=[c[0] for c in COLUMNS], show="headings",
+                                 selectmode="browse")
+        for column, heading, width in COLUMNS:
+            self.tree.heading(column, text=heading, command=lambda c=column: self.sort_by(c))
+            self.tree.column(column, width=width, stretch=(column in ("settings", "answer")))
+        self.tree.tag_configure("best", background="#2e7d32", foreground="white")
+        self.tree.tag_configure("failed", foreground="#e57373")
+        self.tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.tree.bind("<Double-1>", self.on_row_opened)
+
+    def start_sweep(self):
+        try:
+            grid = {axis: parse_axis(axis, entry.get()) for axis, entry in self.axis_entries.items()}
+            points = expand_grid(self.base, grid)
+        except ValueError as e:
+            messagebox.showerror("Invalid Sweep", str(e), parent=self)
+            return
+
+        self.tree.delete(*self.tree.get_children())
+        self.sweep = Sweep(self.engine, points, expected=self.expected_entry.get(),
+                           on_update=self.on_row_update)
+        self.sweep.start()
+        for row in self.sweep.rows:
+            self.tree.insert("", tk.END, iid=str(row.index), values=self.row_values(row))
+
+        self.run_button.configure(state="disabled")
+        self.cancel_button.configure(state="normal")
+        self.update_status()
+
+    def cancel_sweep(self):
+        if self.sweep is not None:
+            self.sweep.cancel()
+
+    def row_values(self, row: SweepRow):
+        def fmt(value, spec):
+            return "" if value is None else format(value, spec)
+
+        return (
+            row.index,
+            row.point.label(),
+            row.status,
+            fmt(row.latency, ".2f"),
+            fmt(row.prompt_tokens, "d"),
+            fmt(row.completion_tokens, "d"),
+            fmt(row.cost, ".5f"),
+            _mark(row.valid),
+            _mark(row.correct),
+            "" if row.answer is None else str(row.answer)[:80],
+        )
+
+    def on_row_update(self, row: SweepRow):
+        """Sweep callback; runs on worker threads, so hop to the main thread"""
+        self.after(0, self.refresh_row, row)
+
+    def refresh_row(self, row: SweepRow):
+        # Ignore late callbacks from a previous sweep
+        if not self.winfo_exists() or self.sweep is None or row not in self.sweep.rows:
+            return
+        iid = str(row.index)
+        if self.tree.exists(iid):
+            tags = ("failed",) if row.status == RunRecord.FAILED else ()
+            self.tree.item(iid, values=self.row_values(row), tags=tags)
+        self.update_status()
+
+    def update_status(self):
+        sweep = self.sweep
+        done = sum(1 for row in sweep.rows if not row.record.active)
+        best = sweep.best()
+
+        # Only the best row carries the highlight
+        for row in sweep.rows:
+            iid = str(row.index)
+            tags = [t for t in self.tree.item(iid, "tags") if t != "best"]
+            if row is best:
+                tags.append("best")
+            self.tree.item(iid, tags=tags)
+
+        text = f"{done}/{len(sweep.rows)} finished"
+        if best is not None:
+            text += f"  |  Fastest acceptable: #{best.index} {best.point.label()} ({best.latency:.2f}s)"
+        self.status_label.configure(text=text)
+
+        if sweep.finished:
+            self.run_button.configure(state="normal")
+            self.cancel_button.configure(state="disabled")
+
+    def sort_by(self, column: str):
+        if column == self.sort_column:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_column, self.sort_reverse = column, False
+
+        def key(iid):
+            value = self.tree.set(iid, column)
+            # Numbers before text (a column can mix answers like "12" and "Franklin"),
+            # blank cells (unfinished runs) last
+            try:
+                return (0, float(value), "")
+            except ValueError:
+                return (1 if value else 2, 0.0, value)
+
+        iids = sorted(self.tree.get_children(), key=key, reverse=self.sort_reverse)
+        for position, iid in enumerate(iids):
+            self.tree.move(iid, "", position)
+
+    def on_row_opened(self, event=None):
+        selection = self.tree.selection()
+        if not selection or self.sweep is None or self.on_open is None:
+            return
+        row = self.sweep.rows[int(selection[0]) - 1]
+        if row.record.result is not None:
+            self.on_open(row.record.result)
+
+    def on_close(self):
+        if self.sweep is not None:
+            self.sweep.shutdown()
+        self.destroy()
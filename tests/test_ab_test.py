@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+from ab_test import A, B, SequentialTest
+
+
+def decide(winners):
+    """Feed winners in order; returns (pairs fed, decision) at the first decision"""
+    test = SequentialTest()
+    for count, winner in enumerate(winners, 1):
+        test.add(winner)
+        if test.decision is not None:
+            return count, test.decision
+    return len(winners), None
+
+
+def test_consistent_winner_is_named_after_nine_straight_wins():
+    # Each side runs at alpha / 2: eight straight wins are not yet enough at alpha 0.05
+    assert decide([A] * 8) == (8, None)
+    assert decide([B] * 20) == (9, B)
+
+
+def test_ties_carry_no_evidence():
+    assert decide([None] * 50) == (50, None)
+    assert decide([None, A] * 9) == (18, A)
+
+
+def test_even_split_is_declared_equivalent():
+    assert decide([A, B] * 10) == (12, "equivalent")
+
+
+def test_mixed_sequence_decides_when_the_evidence_crosses():
+    # A loss costs more than a win gains: one loss pushes the decision from 9 to 11 wins
+    assert decide([A, A, B, A, A, A, A, A, A, A]) == (10, None)
+    assert decide([A, A, B, A, A, A, A, A, A, A, A, A, A]) == (12, A)
+
+
+def test_false_winner_rate_stays_within_alpha():
+    rng = random.Random(7)
+    false_winners = 0
+    runs = 4000
+    for _ in range(runs):
+        test = SequentialTest(alpha=0.05)
+        while test.decision is None:
+            test.add(A if rng.random() < 0.5 else B)
+        false_winners += test.decision in (A, B)
+    assert false_winners / runs <= 0.055
+
+
+def test_effect_must_favour_the_winner():
+    with pytest.raises(ValueError):
+        SequentialTest(effect=0.5)
@@ -0,0 +1,92 @@
+import asyncio
+import http.client
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import caching_proxy
+from caching_proxy import CachingProxy
+
+BODY = b'{"model": "sonar", "messages": [{"role": "user", "content": "What county is Columbus, OH in?"}]}'
+
+
+class Upstream(BaseHTTPRequestHandler):
+    """Stand-in API that records the Authorization header of every call"""
+    calls = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        Upstream.calls.append(self.headers.get("Authorization"))
+        body = b'{"choices": [{"message": {"content": "Franklin"}}]}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    Upstream.calls = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Upstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def serve(proxy):
+    """Run the proxy on its own loop; returns the port"""
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    ports = []
+
+    async def start():
+        server = await asyncio.start_server(proxy.handle, "127.0.0.1", 0)
+        ports.append(server.sockets[0].getsockname()[1])
+        started.set()
+        await server.serve_forever()
+
+    threading.Thread(target=loop.run_until_complete, args=(start(),), daemon=True).start()
+    started.wait(5)
+    return ports[0]
+
+
+def post(port, headers):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    connection.request("POST", "/perplexity/chat/completions", body=BODY, headers=headers)
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.status
+
+
+def test_operator_keys_require_allowed_keys(upstream):
+    with pytest.raises(ValueError):
+        CachingProxy(keys={"perplexity": "SECRET"}, upstreams={"perplexity": upstream})
+    with pytest.raises(SystemExit):
+        caching_proxy.main(["--keys-from-env"])
+
+
+def test_operator_key_is_only_spent_for_listed_callers(upstream):
+    proxy = CachingProxy(keys={"perplexity": "SECRET"}, upstreams={"perplexity": upstream},
+                         allowed_keys=["team-token"])
+    port = serve(proxy)
+    try:
+        assert post(port, {}) == 401
+        assert post(port, {"Authorization": "x"}) == 403
+        assert post(port, {"Authorization": "Bearer stolen"}) == 403
+        assert Upstream.calls == []
+
+        assert post(port, {"Authorization": "Bearer team-token"}) == 200
+        assert Upstream.calls == ["Bearer SECRET"]
+        # A cached answer is still refused to an unlisted key
+        assert post(port, {"Authorization": "Bearer stolen"}) == 403
+        assert post(port, {"Authorization": "Bearer team-token"}) == 200
+        assert len(Upstream.calls) == 1
+    finally:
+        proxy.shutdown()
@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+
+from hedging import HedgePolicy, send_hedged
+from rate_limit import RateLimiter
+from routing import FallbackRouter
+from scheduler import BULK, Scheduler
+
+PARAMS = {"messages": [{"role": "user", "content": "What county is Columbus, OH in?"}]}
+
+
+def limits(max_concurrency):
+    return {"perplexity": {"requests_per_minute": 60000, "burst": 1000, "max_concurrency": max_concurrency}}
+
+
+def eager_policy():
+    """Hedges any request still running after 50 ms"""
+    policy = HedgePolicy(min_samples=1, budget_ratio=1.0, min_delay=0.05)
+    policy.tracker.record("sonar", 0.01)
+    return policy
+
+
+class SlowFirstClient:
+    """Stand-in API client whose first request of each call hangs, so every call wants a hedge"""
+
+    def __init__(self, policy):
+        self.hedge_policy = policy
+        self.active = 0
+        self.peak = 0
+        self.sends = 0
+        self._lock = threading.Lock()
+
+    def chat_completion(self, model, messages, stream=False, deadline=None, cancel_token=None, hedge_slot=None,
+                        **kwargs):
+        first = [True]
+
+        def send(token):
+            with self._lock:
+                self.active += 1
+                self.sends += 1
+                self.peak = max(self.peak, self.active)
+            try:
+                slow, first[0] = first[0], False
+                token.wait(0.5 if slow else 0.01)
+                return {"choices": [{"message": {"content": "Franklin"}}]}
+            finally:
+                with self._lock:
+                    self.active -= 1
+
+        return send_hedged(self.hedge_policy, model, cancel_token, send, hedge_slot)
+
+
+def wait_until(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.005)
+
+
+def test_hedge_takes_its_own_slot_when_one_is_free():
+    scheduler = Scheduler(limits(2))
+    client = SlowFirstClient(eager_policy())
+    router = FallbackRouter({"perplexity": client}, limiter=scheduler)
+    router.complete("sonar", PARAMS)
+    assert client.hedge_policy.report()["hedges_won"] == 1
+    assert client.peak == 2
+    wait_until(lambda: scheduler.queues["perplexity"].in_flight == 0)
+
+
+def test_hedge_is_skipped_when_the_provider_is_at_its_limit():
+    scheduler = Scheduler(limits(1))
+    client = SlowFirstClient(eager_policy())
+    router = FallbackRouter({"perplexity": client}, limiter=scheduler)
+    router.complete("sonar", PARAMS)
+    assert client.sends == 1
+    assert client.hedge_policy.report()["hedges_issued"] == 0
+    assert scheduler.queues["perplexity"].in_flight == 0
+
+
+@pytest.mark.parametrize("limiter", [Scheduler(limits(3)), RateLimiter(limits(3))])
+def test_concurrent_hedged_calls_never_exceed_the_concurrency_limit(limiter):
+    client = SlowFirstClient(eager_policy())
+    router = FallbackRouter({"perplexity": client}, limiter=limiter)
+    threads = [threading.Thread(target=router.complete, args=("sonar", PARAMS), kwargs={"priority": BULK})
+               for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    # Unlimited hedges would put up to 12 requests in flight
+    assert client.peak <= 3
+
+
+def test_hedge_does_not_jump_queued_calls():
+    scheduler = Scheduler(limits(2))
+    queue = scheduler.queues["perplexity"]
+    assert scheduler.try_acquire("perplexity", BULK)
+    assert scheduler.try_acquire("perplexity", BULK)
+    waiter = threading.Thread(target=queue.acquire, args=(BULK, None, None))
+    waiter.start()
+    wait_until(lambda: queue.waiting() == {BULK: 1})
+    scheduler.release("perplexity")
+    waiter.join(5)
+    # The freed slot went to the waiter, not to an optional call
+    assert not scheduler.try_acquire("perplexity")
+    with pytest.raises(ValueError):
+        scheduler.try_acquire("perplexity", "urgent")
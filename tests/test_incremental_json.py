@@ -0,0 +1,115 @@
+import json
+import random
+
+import pytest
+
+from incremental_json import IncrementalJSONError, IncrementalParser, StreamAborted, StreamValidator, subschema
+
+DOCUMENT = {
+    "county": "Cuyahoga",
+    "neighborhood": "Slavic Village \"east\" é",
+    "year_built": 1925,
+    "lot_acres": -0.125e-1,
+    "flags": [True, False, None],
+    "sources": [{"url": "https://example.com/a", "rank": 1}, {"url": "https://example.com/b", "rank": 2}],
+    "empty": {},
+    "none": [],
+}
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "county": {"type": "string"},
+        "year_built": {"type": "integer"},
+        "sources": {"type": "array", "items": {"$ref": "#/$defs/source"}},
+    },
+    "additionalProperties": False,
+    "$defs": {"source": {"type": "object", "properties": {"url": {"type": "string"}}}},
+}
+
+
+def feed_in_chunks(parser, text, rng):
+    completed = []
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 7)
+        completed += parser.feed(text[position:position + size])
+        position += size
+    return completed + parser.finish()
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_chunk_splits_rebuild_the_document(seed):
+    text = json.dumps(DOCUMENT, indent=seed % 3 or None, ensure_ascii=seed % 2 == 0)
+    parser = IncrementalParser()
+    completed = feed_in_chunks(parser, text, random.Random(seed))
+    assert parser.done
+    assert parser.root == DOCUMENT
+    assert completed[-1] == ((), DOCUMENT)
+    assert ("sources", 1, "rank") in [path for path, _ in completed]
+
+
+def test_values_are_reported_when_they_close():
+    parser = IncrementalParser()
+    assert parser.feed('{"county": "Frank') == []
+    assert parser.feed('lin", "year": 19') == [(("county",), "Franklin")]
+    # A number is only complete once something follows it
+    assert parser.feed("25") == []
+    assert parser.feed("}") == [(("year",), 1925), ((), {"county": "Franklin", "year": 1925})]
+
+
+def test_bare_number_completes_on_finish():
+    parser = IncrementalParser()
+    assert parser.feed("42") == []
+    assert parser.finish() == [((), 42)]
+
+
+@pytest.mark.parametrize("text", ["The county is Franklin.", '{"county" "Franklin"}', "[1, 2,, 3]", '{"a": 1} extra'])
+def test_malformed_text_is_rejected(text):
+    with pytest.raises(IncrementalJSONError):
+        IncrementalParser().feed(text)
+
+
+def test_unfinished_document_fails_on_finish():
+    parser = IncrementalParser()
+    parser.feed('{"county": "Franklin"')
+    with pytest.raises(IncrementalJSONError):
+        parser.finish()
+
+
+def test_subschema_follows_properties_items_and_forbidden_properties():
+    assert subschema(SCHEMA, ("county",)) == {"type": "string"}
+    assert subschema(SCHEMA, ("sources", 3)) == {"$ref": "#/$defs/source"}
+    assert subschema(SCHEMA, ("sources", 0, "anything")) == {}
+    assert subschema(SCHEMA, ("unknown",)) is None
+
+
+def test_validator_reports_fields_as_they_validate():
+    seen = []
+    validator = StreamValidator(SCHEMA, on_field=lambda name, value: seen.append((name, value)))
+    text = '<think>Franklin or Delaware?</think>\n{"county": "Franklin", "sources": [{"url": "x"}], "year_built": 1925}'
+    for position in range(0, len(text), 5):
+        validator.feed(text[position:position + 5])
+    assert seen == [("county", "Franklin"), ("sources", [{"url": "x"}]), ("year_built", 1925)]
+    assert validator.content == text
+
+
+def test_validator_aborts_on_prose_at_the_first_letter():
+    validator = StreamValidator(SCHEMA)
+    with pytest.raises(StreamAborted) as raised:
+        validator.feed("Sure")
+    assert raised.value.content == "Sure"
+
+
+@pytest.mark.parametrize("text, where", [
+    ('{"county": 7,', "county"),
+    # Inside a $ref the error surfaces when the referencing item closes
+    ('{"sources": [{"url": 1}', "sources.0:"),
+    ('{"notes": "x",', "'notes'"),
+])
+def test_validator_aborts_when_a_value_breaks_the_schema(text, where):
+    validator = StreamValidator(SCHEMA)
+    with pytest.raises(StreamAborted) as raised:
+        validator.feed(text)
+    assert where in raised.value.message
+    assert validator.fields == {}
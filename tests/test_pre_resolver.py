@@ -0,0 +1,76 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+from local_tools import SCHEMA, PropertyDataset, address_key
+from pre_resolver import PreResolver, split_place
+from run_config import RunConfig
+
+ADDRESS = "6603 Gertrude Ave, Cleveland, OH 44105"
+GOOD_PROMPTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Good_prompts")
+
+
+@pytest.fixture
+def resolver(tmp_path):
+    path = str(tmp_path / "property_data.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.execute("INSERT INTO counties (city, state, county) VALUES ('Columbus', 'OH', 'Franklin')")
+    conn.execute("INSERT INTO zip_counties (zip, county, state) VALUES ('44105', 'Cuyahoga', 'OH')")
+    conn.execute("INSERT INTO properties (address_key, address, neighborhood) VALUES (?, ?, 'Slavic Village')",
+                 (address_key(ADDRESS), ADDRESS))
+    conn.commit()
+    conn.close()
+    return PreResolver(PropertyDataset(path))
+
+
+@pytest.mark.parametrize("prompt, answer", [
+    ("What county is columbus ohio in? Just provide me with the county name", "Franklin"),
+    ("Which county is Columbus, OH located in?", "Franklin"),
+    ("What county is ZIP 44105 in?", "Cuyahoga"),
+    (f"What county is {ADDRESS} in?", "Cuyahoga"),
+    (f"What neighborhood is {ADDRESS} in?", "Slavic Village"),
+    (f"Which neighborhood of Cleveland Ohio is {ADDRESS} in? Please provide only the neighborhood name",
+     "Slavic Village"),
+    # Good_prompts/neighborhood-name.json, typo included
+    ("I need you to tell me what neighborhood of Cleveland Ohio the followin address is in: "
+     f"{ADDRESS}. Please provide only the neighborhood name in your response", "Slavic Village"),
+    (f"Tell me what neighborhood the following address is in: {ADDRESS}", "Slavic Village"),
+])
+def test_lookup_questions_are_answered(resolver, prompt, answer):
+    assert resolver.answer(prompt)[0] == answer
+
+
+@pytest.mark.parametrize("prompt", [
+    "Which county borders the county that contains ZIP 44105?",
+    f"What neighborhood is next to the one containing {ADDRESS}?",
+    f"What neighborhood is next to {ADDRESS} in?",
+    f"I need you to tell me what neighborhood is next to the following address: {ADDRESS}",
+    f"Tell me what neighborhood the following address is in: {ADDRESS}. Also list nearby schools",
+    "What county is columbus ohio in, and what is its population?",
+    "Which county is the city next to Columbus Ohio in?",
+    f"I am buying {ADDRESS}. What county is it in, and what are the taxes?",
+])
+def test_near_miss_questions_go_to_the_model(resolver, prompt):
+    assert resolver.answer(prompt) is None
+
+
+@pytest.mark.parametrize("name, answer", [
+    ("county-name.json", "Franklin"),
+    ("neighborhood-name.json", "Slavic Village"),
+])
+def test_saved_tests_resolve_locally(resolver, name, answer):
+    with open(os.path.join(GOOD_PROMPTS, name), encoding="utf-8") as f:
+        config = RunConfig.from_test_data(json.load(f))
+    response = resolver.resolve(config)
+    assert response is not None
+    assert answer in response["choices"][0]["message"]["content"]
+
+
+def test_split_place():
+    assert split_place("columbus ohio") == ("columbus", "OH")
+    assert split_place("Columbus, OH") == ("Columbus", "OH")
+    assert split_place("New York, New York") == ("New York", "NY")
+    assert split_place("Springfield") is None
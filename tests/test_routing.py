@@ -0,0 +1,54 @@
+import pytest
+
+import metrics
+from incremental_json import StreamAborted
+from request_control import APIRequestError
+from routing import FallbackRouter
+
+PARAMS = {"messages": [{"role": "user", "content": "What county is Columbus, OH in?"}]}
+
+
+class StreamingClient:
+    """Stand-in client that streams one fragment, or fails like an API outage"""
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def chat_completion(self, model, messages, stream=False, on_delta=None, **kwargs):
+        if self.error is not None:
+            raise self.error
+        on_delta("Sure, the county is")
+        return {"choices": [{"message": {"content": "Sure, the county is Franklin"}}]}
+
+
+def abort(text):
+    raise StreamAborted("Response left the schema: expected JSON", text)
+
+
+def outcomes(model):
+    return {outcome: metrics.REQUESTS.value(provider="perplexity", model=model, outcome=outcome)
+            for outcome in ("ok", "error", "aborted")}
+
+
+def test_schema_abort_is_not_counted_as_an_api_error():
+    model = "sonar-pro"
+    before = outcomes(model)
+    errors_before = metrics.REQUEST_ERRORS.value(provider="perplexity", model=model, code="StreamAborted")
+    router = FallbackRouter({"perplexity": StreamingClient()})
+    with pytest.raises(StreamAborted):
+        router.complete(model, PARAMS, allow_fallback=False, on_delta=abort)
+    after = outcomes(model)
+    assert after["aborted"] == before["aborted"] + 1
+    assert after["error"] == before["error"]
+    assert metrics.REQUEST_ERRORS.value(provider="perplexity", model=model, code="StreamAborted") == errors_before
+    assert router.board.allow(model)
+
+
+def test_api_failure_is_still_counted_as_an_error():
+    model = "sonar-reasoning"
+    before = outcomes(model)
+    router = FallbackRouter({"perplexity": StreamingClient(APIRequestError("Bad request", 400))})
+    with pytest.raises(APIRequestError):
+        router.complete(model, PARAMS, allow_fallback=False, on_delta=abort)
+    assert outcomes(model)["error"] == before["error"] + 1
+    assert metrics.REQUEST_ERRORS.value(provider="perplexity", model=model, code=400) >= 1
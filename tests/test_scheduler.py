@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+
+from rate_limit import ProviderLimit
+from request_control import CancelToken, Deadline, DeadlineExceeded, RequestCancelled
+from scheduler import BULK, INTERACTIVE, PIPELINE, FairQueue, Scheduler
+
+# One slot and a bucket that never throttles, so the order of grants is the queue's alone
+LIMIT = {"requests_per_minute": 60000, "burst": 1000, "max_concurrency": 1}
+
+
+def wait_until(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.005)
+
+
+def grant_order(queue, priorities):
+    """Queue one waiter per priority behind a held slot, then release it and record who goes when"""
+    queue.acquire(PIPELINE, None, None)
+    order = []
+
+    def worker(label, priority):
+        queue.acquire(priority, None, None)
+        order.append(label)
+        queue.release()
+
+    threads = []
+    for index, priority in enumerate(priorities):
+        thread = threading.Thread(target=worker, args=(f"{priority} {index}", priority))
+        thread.start()
+        threads.append(thread)
+        # Enqueue in a known order
+        wait_until(lambda: sum(queue.waiting().values()) == index + 1)
+    queue.release()
+    for thread in threads:
+        thread.join(5)
+    return order
+
+
+def test_interactive_call_goes_ahead_of_queued_bulk_work():
+    queue = FairQueue("perplexity", ProviderLimit(**LIMIT))
+    order = grant_order(queue, [BULK] * 5 + [INTERACTIVE])
+    assert order[0] == "interactive 5"
+    assert order[1:] == [f"bulk {index}" for index in range(5)]
+
+
+def test_bulk_keeps_its_share_behind_an_interactive_backlog():
+    queue = FairQueue("perplexity", ProviderLimit(**LIMIT))
+    order = grant_order(queue, [INTERACTIVE] * 30 + [BULK])
+    assert order.index("bulk 30") <= 16
+
+
+def test_cancelled_waiter_is_withdrawn():
+    queue = FairQueue("perplexity", ProviderLimit(**LIMIT))
+    queue.acquire(PIPELINE, None, None)
+    token = CancelToken()
+    errors = []
+
+    def worker():
+        try:
+            queue.acquire(BULK, token, None)
+        except RequestCancelled as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    wait_until(lambda: queue.waiting() == {BULK: 1})
+    token.cancel()
+    thread.join(5)
+    assert len(errors) == 1
+    assert queue.waiting() == {}
+    assert queue.in_flight == 1
+
+
+def test_wait_gives_up_at_the_deadline():
+    queue = FairQueue("perplexity", ProviderLimit(**LIMIT))
+    queue.acquire(PIPELINE, None, None)
+    with pytest.raises(DeadlineExceeded):
+        queue.acquire(INTERACTIVE, None, Deadline(0.05))
+    assert queue.waiting() == {}
+
+
+def test_scheduler_rejects_unknown_priority_and_passes_unlimited_providers():
+    scheduler = Scheduler({"perplexity": LIMIT})
+    with pytest.raises(ValueError):
+        with scheduler.acquire("perplexity", priority="urgent"):
+            pass
+    with scheduler.acquire("local"):
+        pass
+    with scheduler.acquire("perplexity", priority=BULK):
+        assert scheduler.queues["perplexity"].in_flight == 1
+    assert scheduler.queues["perplexity"].in_flight == 0
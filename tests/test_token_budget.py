@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from run_config import RunConfig
+from token_budget import MIN_SAMPLES, BudgetPlan, BudgetStats, estimate_tokens, plan_budget, truncated
+
+COUNTY_SCHEMA = {"type": "object", "properties": {"county": {"type": "string"}}}
+
+
+def json_config(model="sonar", schema=COUNTY_SCHEMA, **kwargs):
+    json_format = json.dumps({"type": "json_schema", "json_schema": {"schema": schema}})
+    return RunConfig(model=model, prompt="What county is Columbus, OH in?", use_json=True,
+                     json_format=json_format, **kwargs)
+
+
+@pytest.mark.parametrize("schema, tokens", [
+    ({"type": "string"}, 24),
+    ({"type": "string", "maxLength": 30}, 12),
+    ({"type": "integer"}, 6),
+    ({"type": "null"}, 2),
+    ({"type": ["string", "null"]}, 24),
+    ({"enum": ["Franklin", "Cuyahoga County"]}, 6),
+    ({"anyOf": [{"type": "number"}, {"type": "string"}]}, 24),
+    ({"type": "array", "items": {"type": "string"}, "maxItems": 3}, 77),
+    ({"type": "array", "items": {"type": "string"}}, 252),
+    (COUNTY_SCHEMA, 31),
+])
+def test_estimate_tokens(schema, tokens):
+    assert estimate_tokens(schema) == tokens
+
+
+@pytest.mark.parametrize("schema", [
+    {"$ref": "#/$defs/county"},
+    {"type": "object"},
+    {"type": "object", "properties": {"county": {"$ref": "#/$defs/county"}}},
+    {"anyOf": [{"type": "string"}, {"type": "object"}]},
+    {"type": "array", "items": {"type": "object"}},
+    {},
+])
+def test_unboundable_schemas_have_no_estimate(schema):
+    assert estimate_tokens(schema) is None
+
+
+def test_plan_caps_max_tokens_with_headroom():
+    plan = plan_budget(json_config())
+    assert plan == BudgetPlan(31, 63)
+    assert plan.retry_tokens == 252
+    assert plan.apply({"model": "sonar"}) == {"model": "sonar", "max_tokens": 63}
+
+
+def test_gpt5_gets_low_verbosity_instead_of_a_cap():
+    plan = plan_budget(json_config("gpt-5"))
+    assert plan == BudgetPlan(31, None, "low")
+    assert plan.retry_tokens is None
+    assert plan.apply({}) == {"verbosity": "low"}
+    assert plan_budget(json_config("gpt-5", verbosity="high")) is None
+
+
+@pytest.mark.parametrize("config", [
+    json_config(max_tokens="100"),
+    json_config("sonar-reasoning"),
+    json_config(schema={"type": "object"}),
+    RunConfig(model="sonar", prompt="What county is Columbus, OH in?"),
+])
+def test_runs_sent_as_configured(config):
+    assert plan_budget(config) is None
+
+
+def test_truncated():
+    assert truncated({"choices": [{"finish_reason": "length"}]}, is_json=True)
+    assert truncated({"choices": [{"finish_reason": "stop"}]}, is_json=False)
+    assert not truncated({"choices": [{"finish_reason": "stop"}]}, is_json=True)
+    assert not truncated({}, is_json=True)
+
+
+def test_latency_saved_needs_samples_on_both_sides():
+    stats = BudgetStats()
+    config = json_config()
+    for _ in range(MIN_SAMPLES):
+        stats.record(config, True, 2.0)
+    assert stats.latency_saved(config) is None
+    for _ in range(MIN_SAMPLES):
+        stats.record(config, False, 3.5)
+    assert stats.latency_saved(config) == pytest.approx(1.5)
+    assert stats.latency_saved(json_config("sonar-pro")) is None
@@ -0,0 +1,192 @@
+import math
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+import serialization
+from routing import GPT5_MODELS, extract_schema
+from run_config import RunConfig
+
+# Models whose output shares max_tokens with a reasoning trace; a schema-sized
+# cap would cut the reasoning short, so they are never budgeted
+UNBUDGETED_MODELS = ["sonar-reasoning", "sonar-deep-research"]
+
+# Token estimates for JSON values without size hints in the schema
+STRING_TOKENS = 24
+NUMBER_TOKENS = 6
+BOOLEAN_TOKENS = 2
+ARRAY_ITEMS = 10
+
+# Roughly three characters per token for keys, enums and bounded strings
+CHARS_PER_TOKEN = 3
+
+# Headroom over the estimate: budget = estimate * MARGIN + SLACK
+MARGIN = 1.5
+SLACK = 16
+
+# A truncated answer is retried once with this many times the budget
+RETRY_FACTOR = 4
+
+# GPT-5 answers estimated at or under this many tokens are requested with low verbosity
+SMALL_ANSWER_TOKENS = 200
+
+# Runs per side before a latency saving is reported
+MIN_SAMPLES = 3
+
+
+def _text_tokens(length: int) -> int:
+    return max(1, math.ceil(length / CHARS_PER_TOKEN))
+
+
+def estimate_tokens(schema: Any) -> Optional[int]:
+    """
+    Upper estimate of the output tokens a JSON value matching schema takes.
+
+    Strings use maxLength or their longest enum value, arrays maxItems (else
+    ARRAY_ITEMS), objects every property; anyOf/oneOf take the largest option.
+
+    Args:
+        schema: A JSON schema (sub)document
+
+    Returns:
+        Estimated tokens, or None for schemas that cannot be bounded ($ref,
+        open objects, unknown types)
+    """
+    if not isinstance(schema, dict) or "$ref" in schema:
+        return None
+    if "enum" in schema or "const" in schema:
+        values = schema.get("enum", [schema.get("const")])
+        return max((_text_tokens(len(serialization.dumps(v))) for v in values), default=1)
+
+    options = schema.get("anyOf") or schema.get("oneOf")
+    if options:
+        estimates = [estimate_tokens(option) for option in options]
+        if any(e is None for e in estimates):
+            return None
+        return max(estimates)
+
+    kind = schema.get("type")
+    if isinstance(kind, list):
+        estimates = [estimate_tokens(dict(schema, type=k)) for k in kind]
+        if any(e is None for e in estimates):
+            return None
+        return max(estimates)
+
+    if kind == "string":
+        if "maxLength" in schema:
+            return _text_tokens(schema["maxLength"]) + 2
+        return STRING_TOKENS
+    if kind in ("number", "integer"):
+        return NUMBER_TOKENS
+    if kind in ("boolean", "null"):
+        return BOOLEAN_TOKENS
+    if kind == "array":
+        item = estimate_tokens(schema.get("items", {"type": "string"}))
+        if item is None:
+            return None
+        return 2 + (item + 1) * schema.get("maxItems", ARRAY_ITEMS)
+    if kind == "object":
+        properties = schema.get("properties")
+        if not properties:
+            return None
+        total = 2
+        for name, subschema in properties.items():
+            value = estimate_tokens(subschema)
+            if value is None:
+                return None
+            # Quotes, colon and comma around each key
+            total += _text_tokens(len(name)) + 3 + value
+        return total
+    return None
+
+
+@dataclass(frozen=True)
+class BudgetPlan:
+    """
+    Output limits derived from a run's response schema.
+
+    Attributes:
+        estimate: Estimated tokens of a schema-valid answer
+        max_tokens: Cap to send, or None when only verbosity is set (GPT-5)
+        verbosity: GPT-5 verbosity to send, or None to keep the config's
+    """
+    estimate: int
+    max_tokens: Optional[int]
+    verbosity: Optional[str] = None
+
+    @property
+    def retry_tokens(self) -> Optional[int]:
+        return self.max_tokens * RETRY_FACTOR if self.max_tokens else None
+
+    def apply(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Request parameters with this plan's limits filled in"""
+        params = dict(params)
+        if self.max_tokens is not None:
+            params["max_tokens"] = self.max_tokens
+        if self.verbosity is not None:
+            params["verbosity"] = self.verbosity
+        return params
+
+
+def plan_budget(config: RunConfig) -> Optional[BudgetPlan]:
+    """
+    The output budget for a run, whether or not its auto_budget is on.
+
+    Only JSON runs with a boundable schema and an empty max_tokens get one.
+    GPT-5 reasoning tokens count against the same cap as the answer, so GPT-5
+    runs get low verbosity for small answers instead of a max_tokens.
+
+    Args:
+        config: The RunConfig to plan for
+
+    Returns:
+        BudgetPlan, or None when the run should be sent as configured
+    """
+    if config.max_tokens.strip() or config.model in UNBUDGETED_MODELS:
+        return None
+    estimate = estimate_tokens(extract_schema(config.response_format()))
+    if estimate is None:
+        return None
+    if config.model in GPT5_MODELS:
+        if estimate > SMALL_ANSWER_TOKENS or config.verbosity != "medium":
+            return None
+        return BudgetPlan(estimate, None, "low")
+    return BudgetPlan(estimate, math.ceil(estimate * MARGIN) + SLACK)
+
+
+def truncated(response: Dict[str, Any], is_json: bool) -> bool:
+    """Whether a budgeted reply was cut off: finish_reason "length", or content that is not JSON"""
+    choices = response.get("choices") or [{}]
+    return choices[0].get("finish_reason") == "length" or not is_json
+
+
+class BudgetStats:
+    """
+    Mean response times of schema runs with and without a budget, per model and schema.
+
+    Runs whose max_tokens was left empty feed the unbudgeted side when
+    auto_budget is off, so the saving compares like with like.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (model, schema JSON) -> {budgeted: [runs, total seconds]}
+        self._times: Dict[Tuple[str, str], Dict[bool, list]] = {}
+
+    def _key(self, config: RunConfig) -> Tuple[str, str]:
+        schema = extract_schema(config.response_format())
+        return config.model, serialization.dumps(schema, sort_keys=True)
+
+    def record(self, config: RunConfig, budgeted: bool, response_time: float):
+        with self._lock:
+            sides = self._times.setdefault(self._key(config), {True: [0, 0.0], False: [0, 0.0]})
+            sides[budgeted][0] += 1
+            sides[budgeted][1] += response_time
+
+    def latency_saved(self, config: RunConfig) -> Optional[float]:
+        """Mean seconds saved per run by budgeting, once both sides have MIN_SAMPLES runs"""
+        with self._lock:
+            sides = self._times.get(self._key(config))
+            if sides is None or min(sides[True][0], sides[False][0]) < MIN_SAMPLES:
+                return None
+            return sides[False][1] / sides[False][0] - sides[True][1] / sides[True][0]
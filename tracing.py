@@ -0,0 +1,154 @@
+import atexit
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import serialization
+
+# Set to a file path to trace from the start and write the trace there on exit
+TRACE_ENV_VAR = "PROMPT_TESTER_TRACE"
+
+# Events kept per session; later ones are counted as dropped so a long run cannot exhaust memory
+MAX_EVENTS = 500_000
+
+
+class Tracer:
+    """
+    Span events for every stage of a request, exported as a Chrome trace.
+
+    Spans cost one attribute check when tracing is off. When on, each span
+    becomes a complete ("X") event on the thread that ran it, so a batch opens
+    in Perfetto (ui.perfetto.dev) or chrome://tracing as one track per worker,
+    with queue waits, rate-limit waits, network, validation and persistence
+    nested as they happened. The category names the stage. Waits that span
+    threads, such as time queued before a worker picks a run up, are async
+    events with one track per run.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.dropped = 0
+        self._events: List[Dict[str, Any]] = []
+        self._threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        """Stop recording; recorded events are kept until reset()"""
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._events.clear()
+            self._threads.clear()
+            self.dropped = 0
+        self._origin = time.perf_counter()
+
+    def _timestamp(self) -> float:
+        # Trace timestamps are microseconds
+        return (time.perf_counter() - self._origin) * 1e6
+
+    def _record(self, event: Dict[str, Any]):
+        thread = threading.current_thread()
+        event["pid"] = self._pid
+        event["tid"] = thread.native_id
+        with self._lock:
+            if len(self._events) >= MAX_EVENTS:
+                self.dropped += 1
+                return
+            self._events.append(event)
+            self._threads.setdefault(thread.native_id, thread.name)
+
+    @contextmanager
+    def span(self, name: str, category: str, **args) -> Iterator[Dict[str, Any]]:
+        """
+        Record the enclosed block as one span.
+
+        Yields:
+            The span's args; add to it inside the block (e.g. a status code)
+        """
+        if not self.enabled:
+            yield args
+            return
+        start = self._timestamp()
+        try:
+            yield args
+        except BaseException as e:
+            args["error"] = type(e).__name__
+            raise
+        finally:
+            self._record({"name": name, "cat": category, "ph": "X", "ts": start,
+                          "dur": self._timestamp() - start, "args": args})
+
+    def instant(self, name: str, category: str, **args):
+        if self.enabled:
+            self._record({"name": name, "cat": category, "ph": "i", "s": "t", "ts": self._timestamp(),
+                          "args": args})
+
+    def begin(self, name: str, category: str, span_id: Any, **args):
+        """Open an async span that may end on another thread (see end)"""
+        if self.enabled:
+            self._record({"name": name, "cat": category, "ph": "b", "id": str(span_id),
+                          "ts": self._timestamp(), "args": args})
+
+    def end(self, name: str, category: str, span_id: Any, **args):
+        if self.enabled:
+            self._record({"name": name, "cat": category, "ph": "e", "id": str(span_id),
+                          "ts": self._timestamp(), "args": args})
+
+    def events(self) -> List[Dict[str, Any]]:
+        """Recorded events, preceded by metadata naming the process and each thread"""
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        metadata = [{"name": "process_name", "ph": "M", "pid": self._pid, "tid": 0,
+                     "args": {"name": "llm_prompt_tester"}}]
+        metadata += [{"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid, "args": {"name": name}}
+                     for tid, name in threads.items()]
+        return metadata + events
+
+    def export(self, path: str) -> int:
+        """
+        Write the trace in the Chrome trace-event JSON format.
+
+        Returns:
+            The number of events written
+        """
+        events = self.events()
+        with open(path, "wb") as f:
+            serialization.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                                "otherData": {"dropped_events": self.dropped}}, f)
+        return len(events)
+
+
+TRACER = Tracer()
+if os.getenv(TRACE_ENV_VAR):
+    TRACER.enable()
+    atexit.register(TRACER.export, os.getenv(TRACE_ENV_VAR))
+
+
+def traced(name: str, category: str) -> Callable:
+    """Decorator form of TRACER.span(name, category)"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return func(*args, **kwargs)
+            with TRACER.span(name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def export_on_exit(path: Optional[str]):
+    """Enable tracing and write the trace to path when the process exits; no-op without a path"""
+    if path:
+        TRACER.enable()
+        atexit.register(TRACER.export, path)